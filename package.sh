@@ -12,6 +12,7 @@ echo "Creation de $packet_name"
 mkdir $packet_name
 cp src/*.py $packet_name
 rm $packet_name/test_*.py
+rm $packet_name/bench_*.py
 
 case ${TYPE} in
     zip) zip -r $packet_name.zip $packet_name;;
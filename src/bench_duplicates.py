@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Measures the duplicate detection on a generated subscribers table.
+
+Usage : bench_duplicates.py [row count]'''
+
+import sys
+import time
+
+import gaabo_conf
+from gaabo_exploit_db import SqliteDbOperator
+from duplicate_detector import DuplicateDetector
+from bench_routage_export import fill_db, BENCH_DB, DEFAULT_ROW_COUNT
+
+def main():
+    row_count = DEFAULT_ROW_COUNT
+    if len(sys.argv) > 1:
+        row_count = int(sys.argv[1])
+    gaabo_conf.db_name = BENCH_DB
+    print u'Création de %d abonnés...' % row_count
+    fill_db(row_count)
+    try:
+        start = time.time()
+        detector = DuplicateDetector()
+        duplicates = detector.find_duplicates()
+        print u'Paires comparées   : %d' % detector.scored_pairs
+        print u'Doublons probables : %d' % len(duplicates)
+        print u'Groupes ignorés    : %d' % detector.skipped_buckets
+        print u'Durée              : %.1f s' % (time.time() - start)
+    finally:
+        SqliteDbOperator().remove_db()
+
+if __name__ == '__main__':
+    main()
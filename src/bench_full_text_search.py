@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Measures the latency of the free text search, with the full text index
+and with the scan of the columns used without it, on the ranked ids and the
+first page of the result.
+
+Usage : bench_full_text_search.py [row count...]'''
+
+import sys
+import time
+
+import gaabo_conf
+import gaabo_db
+from gaabo_exploit_db import SqliteDbOperator
+from subscriber import SubscriberDAO
+from bench_routage_export import fill_db, BENCH_DB
+
+DEFAULT_ROW_COUNTS = [100000, 1000000]
+QUERIES = [u'faull', u'rue république 12', u'lefèvre saint-étienne',
+        u'hélène orléans 18']
+RUN_COUNT = 5
+
+class ScanDAO(SubscriberDAO):
+    """DAO searching the text as if sqlite had no full text index"""
+    FULL_TEXT_TABLE = 'missing_fts'
+
+def time_search(dao, text):
+    """Return the average time to get the ranked ids and the first page,
+    and the count"""
+    start = time.time()
+    for i in range(RUN_COUNT):
+        identifiers = dao.full_text_ids(text)
+        dao.get_summaries(identifiers[:gaabo_conf.search_page_size])
+    return (time.time() - start) / RUN_COUNT, len(identifiers)
+
+def main():
+    row_counts = DEFAULT_ROW_COUNTS
+    if len(sys.argv) > 1:
+        row_counts = [int(arg) for arg in sys.argv[1:]]
+    gaabo_conf.db_name = BENCH_DB
+    try:
+        for row_count in row_counts:
+            print u'Création de %d abonnés...' % row_count
+            start = time.time()
+            fill_db(row_count)
+            print u'Créés en %.1f s' % (time.time() - start)
+            gaabo_db.close_connections()
+            index_dao = SubscriberDAO()
+            scan_dao = ScanDAO()
+            print u'%-25s %8s %12s %12s' % (
+                    u'Recherche', u'Trouvés', u'Index (ms)', u'Scan (ms)')
+            for text in QUERIES:
+                index_time, count = time_search(index_dao, text)
+                scan_time, scan_count = time_search(scan_dao, text)
+                print u'%-25s %8d %12.1f %12.1f' % (
+                        text, count, index_time * 1000, scan_time * 1000)
+    finally:
+        gaabo_db.close_connections()
+        SqliteDbOperator().remove_db()
+
+if __name__ == '__main__':
+    main()
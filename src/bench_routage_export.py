@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Measures the routage export with the cached ASCII folding against the
+previous unicodedata conversion.
+
+Usage : bench_routage_export.py [row count]'''
+
+import os
+import sys
+import time
+import sqlite3
+import random
+import unicodedata
+
+import gaabo_conf
+from gaabo_exploit_db import SqliteDbOperator
+from subscriber_exporter import RoutageExporter
+
+BENCH_DB = 'bench.db'
+EXPORT_FILE = 'bench_routage.txt'
+DEFAULT_ROW_COUNT = 1000000
+
+LASTNAMES = [u'Martin', u'Bernard', u'Dubois', u'Thomas', u'Robert',
+        u'Lefèvre', u'Müller', u'Gicqueau', u'Faullummel', u'Nguyễn']
+FIRSTNAMES = [u'Jean', u'Marie', u'Hélène', u'François', u'Léa', u'Chloé']
+CITIES = [u'Rouen', u'Saint-Étienne', u"Île d'Yeu", u'Besançon', u'Évreux',
+        u'Lyon', u'Orléans', u'Nîmes']
+
+class PreviousRoutageExporter(RoutageExporter):
+    """Routage export with the conversion used before the ASCII folding"""
+
+    def format_string(self, string):
+        new_string = unicodedata.normalize('NFKD', unicode(string))
+        new_string = ''.join(
+                [c for c in new_string if not unicodedata.combining(c)])
+        new_string = new_string.encode('ascii', 'ignore')
+        return new_string.upper()
+
+def fill_db(row_count):
+    """Create the bench database with row_count subscribers to export"""
+    generator = random.Random(0)
+    SqliteDbOperator().create_db()
+    conn = sqlite3.Connection(os.path.join(gaabo_conf.db_directory, BENCH_DB))
+    rows = ((generator.choice(LASTNAMES), generator.choice(FIRSTNAMES),
+        u'', u'', u'%d rue de la République' % (i % 200), u'',
+        generator.randint(1000, 95999), generator.choice(CITIES), 1)
+        for i in xrange(row_count))
+    conn.executemany("""INSERT INTO subscribers (lastname, firstname, company,
+        name_addition, address, address_addition, post_code, city, last_issue)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+    conn.commit()
+    conn.close()
+
+def time_export(exporter_class):
+    """Return the time spent to export the routage file"""
+    start = time.time()
+    exporter_class(EXPORT_FILE).do_export()
+    return time.time() - start
+
+def main():
+    row_count = DEFAULT_ROW_COUNT
+    if len(sys.argv) > 1:
+        row_count = int(sys.argv[1])
+    gaabo_conf.db_name = BENCH_DB
+    print u'Création de %d abonnés...' % row_count
+    fill_db(row_count)
+    try:
+        previous = time_export(PreviousRoutageExporter)
+        previous_content = open(EXPORT_FILE).read()
+        current = time_export(RoutageExporter)
+        if open(EXPORT_FILE).read() != previous_content:
+            print u'ERREUR : les fichiers générés sont différents'
+        print u'Conversion unicodedata : %.2f s' % previous
+        print u'Conversion en cache    : %.2f s' % current
+        print u'Gain                   : x%.1f' % (previous / current)
+    finally:
+        os.remove(EXPORT_FILE)
+        SqliteDbOperator().remove_db()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Measures the memory used by the subscribers read from the database, as
+Subscriber objects and as SubscriberRecord objects. tracemalloc does not
+exist for python 2, the size of the objects reachable from each subscriber is
+summed with sys.getsizeof.
+
+Usage : bench_subscriber_memory.py [row count]'''
+
+import gc
+import sys
+import sqlite3
+
+import gaabo_conf
+from gaabo_exploit_db import SqliteDbOperator
+from subscriber import SubscriberDAO
+from bench_routage_export import BENCH_DB
+from bench_routage_export import fill_db
+
+DEFAULT_ROW_COUNT = 100000
+
+# Objects shared by all the subscribers, not counted
+SHARED_TYPES = (type, SubscriberDAO, sqlite3.Connection, sqlite3.Cursor)
+
+def deep_size(objects):
+    """Return the size in bytes of the objects and of the objects they
+    reference, each object being counted once"""
+    seen = set()
+    stack = list(objects)
+    size = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, SHARED_TYPES):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return size
+
+def main():
+    row_count = DEFAULT_ROW_COUNT
+    if len(sys.argv) > 1:
+        row_count = int(sys.argv[1])
+    gaabo_conf.db_name = BENCH_DB
+    print u'Création de %d abonnés...' % row_count
+    fill_db(row_count)
+    try:
+        dao = SubscriberDAO()
+        dao.result = dao.cursor.execute(dao.SELECT_SUBSCRIBERS)
+        subscribers = dao.fetch_result()
+        subscriber_size = deep_size(subscribers) / float(row_count)
+        del subscribers
+        dao.result = dao.cursor.execute(dao.SELECT_SUBSCRIBERS)
+        records = dao.fetch_records()
+        record_size = deep_size(records) / float(row_count)
+        del records
+        print u'Subscriber       : %d octets par abonné' % subscriber_size
+        print u'SubscriberRecord : %d octets par abonné' % record_size
+    finally:
+        SqliteDbOperator().remove_db()
+
+if __name__ == '__main__':
+    main()
@@ -5,17 +5,56 @@
 import gaabo_conf
 import sqlite3
 import os
+from gaabo_exploit_db import SqliteDbOperator
+from transliteration import to_search_key
+from phonetic import french_phonetic_key
 
 def run():
     updater = DbUpdater()
-    updater.add_mail_sent_col()
+    updater.migrate()
 
 class DbUpdater(object):
+    """Brings the database to the SqliteDbOperator.SCHEMA_VERSION. The version
+    of a database is kept in its user_version pragma, so an up to date
+    database only costs one pragma read at startup. Each migration is
+    idempotent, since the databases created before the versioning start at
+    version 0 whatever their schema."""
+
+    # Ordered migrations: the version reached once the method has run
+    MIGRATIONS = [
+    (1, 'add_mail_sent_col'),
+    (2, 'add_issue_counter'),
+    (3, 'add_indexes'),
+    (4, 'add_subscriber_stats'),
+    (5, 'add_full_text_index'),
+    (6, 'add_search_keys'),
+    (7, 'add_phonetic_keys'),
+    (8, 'add_post_code_index'),
+    (9, 'add_change_tracking'),
+    ]
+
     def __init__(self):
         db_path = os.path.join(gaabo_conf.db_directory, gaabo_conf.db_name)
         self.conn = sqlite3.Connection(db_path)
         self.cur = self.conn.cursor()
 
+    def get_version(self):
+        """Return the schema version of the database"""
+        self.cur.execute("PRAGMA user_version")
+        return self.cur.fetchone()[0]
+
+    def set_version(self, version):
+        self.cur.execute("PRAGMA user_version = %d" % version)
+        self.conn.commit()
+
+    def migrate(self):
+        """Run the migrations the database has not been through yet"""
+        version = self.get_version()
+        for migration_version, method_name in self.MIGRATIONS:
+            if migration_version > version:
+                getattr(self, method_name)()
+                self.set_version(migration_version)
+
     def add_mail_sent_col(self):
         try:
             self.cur.execute("SELECT mail_sent FROM subscribers WHERE 0 = 1")
@@ -25,3 +64,116 @@ class DbUpdater(object):
         self.cur.execute("UPDATE subscribers SET mail_sent = 0 WHERE mail_sent IS NULL")
         self.conn.commit()
 
+    def add_issue_counter(self):
+        """Move from the issues_to_receive and hors_serie1 counters, which
+        were decremented on each row at each shipment, to the last issue of
+        the subscriptions and the global issue counter"""
+        self.cur.execute(SqliteDbOperator.ISSUE_COUNTER_CREATE)
+        self.cur.execute(SqliteDbOperator.ISSUE_COUNTER_INIT)
+        try:
+            self.cur.execute("SELECT last_issue FROM subscribers WHERE 0 = 1")
+        except sqlite3.OperationalError:
+            self.cur.execute("""ALTER TABLE subscribers
+            ADD COLUMN last_issue INTEGER DEFAULT 0""")
+            self.cur.execute("""ALTER TABLE subscribers
+            ADD COLUMN last_special_issue INTEGER DEFAULT 0""")
+            self.cur.execute("""UPDATE subscribers SET
+            last_issue = COALESCE(issues_to_receive, 0)
+                + (SELECT regular_issue FROM issue_counter),
+            last_special_issue = COALESCE(hors_serie1, 0)
+                + (SELECT special_issue FROM issue_counter)""")
+        self.conn.commit()
+
+    def add_indexes(self):
+        """Create the indexes of the subscribers table on databases created
+        before them and drop the ones that were replaced"""
+        for index_name in SqliteDbOperator.OBSOLETE_INDEXES:
+            self.cur.execute("DROP INDEX IF EXISTS %s" % index_name)
+        for index_create in SqliteDbOperator.SUBSCRIBERS_INDEXES:
+            self.cur.execute(index_create)
+        self.conn.commit()
+
+    def add_subscriber_stats(self):
+        """Create the counters of the status bar and their triggers. The
+        counters are computed once from the subscribers table."""
+        self.cur.execute(SqliteDbOperator.SUBSCRIBER_STATS_CREATE)
+        self.cur.execute("SELECT COUNT(*) FROM subscriber_stats")
+        if self.cur.fetchone()[0] == 0:
+            self.cur.execute(SqliteDbOperator.SUBSCRIBER_STATS_BACKFILL)
+        for trigger_create in SqliteDbOperator.SUBSCRIBER_STATS_TRIGGERS:
+            self.cur.execute(trigger_create)
+        self.conn.commit()
+
+    def add_full_text_index(self):
+        """Create and fill the index of the free text search"""
+        SqliteDbOperator().create_full_text_index(self.cur)
+        self.conn.commit()
+
+    def add_search_keys(self):
+        """Add the folded keys of the lastname and company searches, compute
+        them for the existing subscribers and index them instead of the
+        NOCASE columns"""
+        try:
+            self.cur.execute("SELECT lastname_key FROM subscribers WHERE 0 = 1")
+        except sqlite3.OperationalError:
+            self.cur.execute("ALTER TABLE subscribers ADD COLUMN lastname_key TEXT")
+            self.cur.execute("ALTER TABLE subscribers ADD COLUMN company_key TEXT")
+        reader = self.conn.cursor()
+        reader.execute("SELECT id, lastname, company FROM subscribers")
+        rows = reader.fetchmany(gaabo_conf.db_batch_size)
+        while rows:
+            self.cur.executemany(
+                    """UPDATE subscribers SET lastname_key = ?, company_key = ?
+                    WHERE id = ?""",
+                    [(to_search_key(lastname), to_search_key(company), row_id)
+                        for row_id, lastname, company in rows]
+                    )
+            rows = reader.fetchmany(gaabo_conf.db_batch_size)
+        for trigger_create in SqliteDbOperator.SEARCH_KEY_TRIGGERS:
+            self.cur.execute(trigger_create)
+        for index_create in SqliteDbOperator.SEARCH_KEY_INDEXES:
+            self.cur.execute(index_create)
+        for index_name in SqliteDbOperator.OBSOLETE_INDEXES:
+            self.cur.execute("DROP INDEX IF EXISTS %s" % index_name)
+        self.conn.commit()
+
+    def add_phonetic_keys(self):
+        """Add the phonetic key of the lastname and compute it for the
+        existing subscribers"""
+        try:
+            self.cur.execute(
+                    "SELECT lastname_phonetic FROM subscribers WHERE 0 = 1")
+        except sqlite3.OperationalError:
+            self.cur.execute(
+                    "ALTER TABLE subscribers ADD COLUMN lastname_phonetic TEXT")
+        reader = self.conn.cursor()
+        reader.execute("SELECT id, lastname FROM subscribers")
+        rows = reader.fetchmany(gaabo_conf.db_batch_size)
+        while rows:
+            self.cur.executemany(
+                    "UPDATE subscribers SET lastname_phonetic = ? WHERE id = ?",
+                    [(french_phonetic_key(lastname), row_id)
+                        for row_id, lastname in rows]
+                    )
+            rows = reader.fetchmany(gaabo_conf.db_batch_size)
+        for index_create in SqliteDbOperator.PHONETIC_KEY_INDEXES:
+            self.cur.execute(index_create)
+        self.conn.commit()
+
+    def add_post_code_index(self):
+        """Add the index read by the presorted routing export"""
+        for index_create in SqliteDbOperator.SUBSCRIBERS_INDEXES:
+            self.cur.execute(index_create)
+        self.conn.commit()
+
+    def add_change_tracking(self):
+        """Add the modification time of the subscribers and the tables of the
+        delta export. The subscribers written before have no time: the first
+        delta export writes them all."""
+        try:
+            self.cur.execute("SELECT updated_at FROM subscribers WHERE 0 = 1")
+        except sqlite3.OperationalError:
+            self.cur.execute(
+                    "ALTER TABLE subscribers ADD COLUMN updated_at TEXT")
+        SqliteDbOperator().create_change_tracking(self.cur)
+        self.conn.commit()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''This module finds the subscribers registered several times under slightly
+different spellings. Comparing every pair of subscribers does not scale, so
+the subscribers are grouped in buckets by blocking keys and only the pairs
+of a bucket are scored:
+
+    - the post code and the beginning of the folded lastname (or company),
+    - the post code and the phonetic key of the lastname,
+    - the email address.
+
+The table is read in the order of each blocking key, so a bucket is complete
+as soon as the key changes and only one bucket is kept in memory while
+reading. The buckets are scored by a pool of processes.'''
+
+import difflib
+import io
+import itertools
+import multiprocessing
+
+import gaabo_conf
+import gaabo_db
+from transliteration import to_search_key
+
+# Positions of the columns in the rows of the blocking queries
+ID = 0
+LASTNAME = 1
+FIRSTNAME = 2
+COMPANY = 3
+ADDRESS = 4
+POST_CODE = 5
+CITY = 6
+EMAIL = 7
+BLOCK_NAME = 8
+
+# Weight of each column in the similarity of two subscribers. The city only
+# counts when the post codes are the same. The firstname weighs as much as the
+# lastname so the members of a family living together are not duplicates.
+WEIGHTS = [(LASTNAME, 0.3), (FIRSTNAME, 0.3), (ADDRESS, 0.25)]
+CITY_WEIGHT = 0.15
+# Similarity given to two subscribers with the same email address
+SAME_EMAIL_SCORE = 0.9
+# Number of letters of the name in the post code blocking key
+NAME_PREFIX_LENGTH = 3
+
+# The block_name column is the name part of the blocking key
+SELECT_COLUMNS = """SELECT id, lastname, firstname, company, address,
+    post_code, city, email_address, %s AS block_name
+    FROM subscribers"""
+
+def post_code_block_key(row):
+    """Blocking key of the post code and the beginning of the name"""
+    return (row[POST_CODE], (row[BLOCK_NAME] or '')[:NAME_PREFIX_LENGTH])
+
+def sound_block_key(row):
+    """Blocking key of the post code and the phonetic key of the name"""
+    return (row[POST_CODE], row[BLOCK_NAME])
+
+def email_block_key(row):
+    """Blocking key of the email address. Its query leaves out the missing
+    email addresses, NULL != '' being false."""
+    return row[EMAIL].lower()
+
+# Query read in the order of its blocking key -> function computing the key.
+# The phonetic key brings together the names whose spellings differ from
+# their first letters, like Faullummel and Folummel.
+BLOCKINGS = [
+    (SELECT_COLUMNS % "COALESCE(NULLIF(lastname_key, ''), company_key)" + """
+    ORDER BY post_code, block_name""", post_code_block_key),
+    (SELECT_COLUMNS % "lastname_phonetic" + """
+    WHERE lastname_phonetic != ''
+    ORDER BY post_code, block_name""", sound_block_key),
+    (SELECT_COLUMNS % "NULL" + """ INDEXED BY subscribers_email_idx
+    WHERE email_address != ''
+    ORDER BY email_address COLLATE NOCASE""", email_block_key),
+    ]
+
+def similarity(first, second):
+    """Return the similarity of two strings folded like the search keys,
+    between 0 and 1"""
+    return difflib.SequenceMatcher(
+            None,
+            to_search_key(first or u''),
+            to_search_key(second or u'')
+            ).ratio()
+
+def score_pair(first, second):
+    """Return the likelihood, between 0 and 1, that two rows are the same
+    subscriber"""
+    score = 0.0
+    for position, weight in WEIGHTS:
+        score += weight * similarity(first[position], second[position])
+    if first[POST_CODE] == second[POST_CODE]:
+        score += CITY_WEIGHT * similarity(first[CITY], second[CITY])
+    email = (first[EMAIL] or u'').lower()
+    if email and email == (second[EMAIL] or u'').lower():
+        score = max(score, SAME_EMAIL_SCORE)
+    return score
+
+def score_bucket(arguments):
+    """Return the (score, first row, second row) of the pairs of the bucket
+    scored at least threshold. It runs in the processes of the pool."""
+    bucket, threshold = arguments
+    duplicates = []
+    for first, second in itertools.combinations(bucket, 2):
+        score = score_pair(first, second)
+        if score >= threshold:
+            duplicates.append((score, first, second))
+    return duplicates
+
+class DuplicateDetector(object):
+    """Finds the likely duplicates of the subscribers table and writes them
+    in a report, the most likely first:
+
+        detector = DuplicateDetector()
+        duplicates = detector.find_duplicates()
+        detector.write_report('../doublons.csv', duplicates)
+
+    A bucket larger than max_bucket_size is not scored, its pairs would be
+    too many: it comes from a very common name in a city, not from
+    duplicates. skipped_buckets counts them."""
+
+    SEPARATOR = u';'
+    EOL = u'\r\n'
+
+    def __init__(self, db_path=None, threshold=None, pool_size=None,
+            max_bucket_size=None):
+        if db_path is None:
+            db_path = gaabo_db.get_db_path()
+        if threshold is None:
+            threshold = gaabo_conf.duplicate_threshold
+        if pool_size is None:
+            pool_size = gaabo_conf.duplicate_pool_size
+        if max_bucket_size is None:
+            max_bucket_size = gaabo_conf.duplicate_max_bucket_size
+        self.db_path = db_path
+        self.threshold = threshold
+        self.pool_size = pool_size
+        self.max_bucket_size = max_bucket_size
+        self.chunk_size = gaabo_conf.db_batch_size
+        self.skipped_buckets = 0
+        self.scored_pairs = 0
+
+    def iter_rows(self, query):
+        """Generator of the rows of the query, fetched by chunks"""
+        conn = gaabo_db.connect(self.db_path)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query)
+            rows = cursor.fetchmany(self.chunk_size)
+            while rows:
+                for row in rows:
+                    yield row
+                rows = cursor.fetchmany(self.chunk_size)
+        finally:
+            conn.close()
+
+    def iter_buckets(self):
+        """Generator of the buckets of at least two rows sharing a blocking
+        key"""
+        for query, block_key in BLOCKINGS:
+            for key, rows in itertools.groupby(self.iter_rows(query), block_key):
+                bucket = list(rows)
+                if len(bucket) < 2:
+                    continue
+                if len(bucket) > self.max_bucket_size:
+                    self.skipped_buckets += 1
+                    continue
+                self.scored_pairs += len(bucket) * (len(bucket) - 1) / 2
+                yield bucket, self.threshold
+
+    def find_duplicates(self):
+        """Return the (score, first row, second row) of the likely
+        duplicates, the most likely first. A pair found by several blocking
+        keys is returned once."""
+        pool = multiprocessing.Pool(self.pool_size)
+        try:
+            best_scores = {}
+            for duplicates in pool.imap_unordered(
+                    score_bucket, self.iter_buckets(), 100):
+                for score, first, second in duplicates:
+                    pair = tuple(sorted((first[ID], second[ID])))
+                    if pair not in best_scores or best_scores[pair][0] < score:
+                        best_scores[pair] = (score, first, second)
+        finally:
+            pool.terminate()
+            pool.join()
+        return sorted(best_scores.values(),
+                key=lambda duplicate: (-duplicate[0], duplicate[1][ID]))
+
+    def write_report(self, file_path, duplicates):
+        """Write the duplicates in a CSV file"""
+        report = io.open(file_path, 'w', encoding='utf-8', newline='')
+        try:
+            report.write(self.SEPARATOR.join([u'score',
+                u'id 1', u'abonné 1', u'adresse 1',
+                u'id 2', u'abonné 2', u'adresse 2']) + self.EOL)
+            for score, first, second in duplicates:
+                report.write(self.SEPARATOR.join(
+                    [u'%.2f' % score]
+                    + self.format_subscriber(first)
+                    + self.format_subscriber(second)) + self.EOL)
+        finally:
+            report.close()
+
+    def format_subscriber(self, row):
+        """Return the id, the name and the address fields of a row"""
+        name = u' '.join([value for value in
+            (row[FIRSTNAME], row[LASTNAME], row[COMPANY]) if value])
+        address = u' '.join([unicode(value) for value in
+            (row[ADDRESS], row[POST_CODE], row[CITY]) if value])
+        return [unicode(row[ID]), name, address]
@@ -1,9 +1,22 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+'''Usage : extract_subscribers_for_management.py [--delta]
+
+With --delta, only the subscribers changed or deleted since the previous
+delta extraction are written.'''
+
+import sys
 
 from subscriber_exporter import CsvExporter
+from subscriber_exporter import DeltaCsvExporter
 
 def main():
+    if '--delta' in sys.argv[1:]:
+        extract_delta()
+    else:
+        extract_all()
+
+def extract_all():
     file_name = '../subscriber_list.csv'
     print u'Extraction des abonnés dans %s...' % file_name
 
@@ -12,5 +25,17 @@ def main():
 
     print 'Fait.'
 
+def extract_delta():
+    file_name = '../subscriber_delta.csv'
+    print u'Extraction des abonnés modifiés dans %s...' % file_name
+
+    exporter = DeltaCsvExporter(file_name)
+    exporter.do_export()
+
+    print u'Fait : %d abonnés modifiés, %d supprimés.' % (
+            exporter.changed_count,
+            exporter.deleted_count
+            )
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+from duplicate_detector import DuplicateDetector
+
+def main():
+    file_name = '../doublons.csv'
+    print u'Recherche des abonnés en double...'
+
+    start = time.time()
+    detector = DuplicateDetector()
+    duplicates = detector.find_duplicates()
+    detector.write_report(file_name, duplicates)
+
+    print u'%d doublons probables écrits dans %s en %.1f s.' % (
+            len(duplicates),
+            file_name,
+            time.time() - start
+            )
+    if detector.skipped_buckets:
+        print u'%d groupes trop grands n\'ont pas été comparés.' % (
+                detector.skipped_buckets)
+
+if __name__ == '__main__':
+    main()
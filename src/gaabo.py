@@ -10,14 +10,16 @@ import datetime
 from gaabo_controler import Controler
 import gaabo_controler
 from subscriber import Subscriber
-import subscriber_exporter
 import panels
 import bootstrap
+from gaabo_tasks import TaskRunner
 
 class GaaboFrame(wx.Frame):
 
     FIELD_HEIGHT = 25
     SPECIAL_ISSUE_BTN_ID = 1
+    EMAIL_LIST_FILE = '../email_resubscription.txt'
+    RESUBSCRIPTION_FILE = '../resubscription.csv'
 
     def __init__(self, parent, title):
         #TODO Too many fields in this class
@@ -30,9 +32,12 @@ class GaaboFrame(wx.Frame):
         self.searched_name_in = None
         self.searched_company_in = None
         self.searched_email_in = None
-        self.subs_dict = {}
+        self.searched_text_in = None
+        self.searched_sounds_like_in = None
 
         self.subscriber_values = {}
+        self.task_runner = TaskRunner(wx.CallAfter)
+        self.progress_dialog = None
 
         self.setup_status_bar()
 
@@ -59,7 +64,9 @@ class GaaboFrame(wx.Frame):
     def update_subscriber_counter(self):
         """Update number of subscriber in notification area"""
         self.status_bar.SetStatusText(
-                u'Nb abonnés : %d' % gaabo_controler.get_subscription_count(),
+                u'Nb abonnés : %(total)d, actifs : %(active)d, '
+                u'à relancer : %(awaiting_renewal)d'
+                % gaabo_controler.get_subscription_counts(),
                 2)
 
     def show_subscriber_creation_form(self, event):
@@ -101,25 +108,37 @@ class GaaboFrame(wx.Frame):
         self.searched_params['name'] = self.searched_name_in.GetValue()
         self.searched_params['company'] = self.searched_company_in.GetValue()
         self.searched_params['email'] = self.searched_email_in.GetValue()
+        self.searched_params['text'] = self.searched_text_in.GetValue()
+        self.searched_params['sounds_like'] = \
+                self.searched_sounds_like_in.GetValue()
 
-        subscriber_list = gaabo_controler.get_searched_subscriber_list(
-                self.searched_params
-                )
+        result_model = gaabo_controler.SearchResultModel(self.searched_params)
 
-        self.get_search_panel_with_result(subscriber_list)
+        self.run_task(
+                u'Recherche',
+                result_model.prefetch,
+                self.get_search_panel_with_result
+                )
 
-    def get_search_panel_with_result(self, subscriber_list):
+    def get_search_panel_with_result(self, result_model):
         self.right_panel.Destroy()
         self.right_panel = panels.SearchPanel(self)
-        self.right_panel.add_result(subscriber_list)
+        self.right_panel.add_result(result_model)
         self.refresh_window()
 
     def modify_subscriber_form(self, event):
-        self.controler.subscriber_values = self.subs_dict[event.GetId()]
+        summary = self.right_panel.get_selected_subscriber()
+        if summary is None:
+            return
+        self.controler.subscriber_values = \
+                gaabo_controler.get_subscriber_values(summary['subscriber_id'])
         self.get_subscriber_edition_panel()
 
     def delete_subscriber(self, event):
-        self.controler.subscriber_values = self.subs_dict[event.GetId()]
+        summary = self.right_panel.get_selected_subscriber()
+        if summary is None:
+            return
+        self.controler.subscriber_values = summary
         dialog = wx.MessageDialog(
                 None,
                 u'Ètes-vous sur de vouloir supprimer l\'abonné %s ?' 
@@ -148,10 +167,66 @@ class GaaboFrame(wx.Frame):
 
     def export_subscriber_for_routage(self, event):
         file_path = self.right_panel.exported_file_field.GetValue()
+        presorted = self.right_panel.presorted_checkbox.GetValue()
+        sharded = self.right_panel.sharded_checkbox.GetValue()
+        if self.right_panel.resubscription_checkbox.GetValue():
+            self.export_issue_files(file_path, presorted or sharded)
+            return
         if self.is_special_issue is True:
-            gaabo_controler.export_special_issue_routing_file(file_path)
+            export = gaabo_controler.export_special_issue_routing_file
         else:
-            gaabo_controler.export_regular_issue_routing_file(file_path)
+            export = gaabo_controler.export_regular_issue_routing_file
+        self.run_task(
+                u'Fichier de routage',
+                lambda progress: export(
+                    file_path, progress, presorted, sharded),
+                self.confirm_issue_shipment
+                )
+
+    def export_issue_files(self, file_path, sorted_file):
+        """Write the routing file and the resubscription lists with a
+        single read of the subscribers, then confirm the shipment and the
+        mail"""
+        if sorted_file:
+            dialog = wx.MessageDialog(
+                    None,
+                    u'Les listes de réabonnement ne sont générées ' +
+                    u'qu\'avec le fichier de routage non trié.',
+                    u'Expédition d\'un numéro',
+                    style=wx.OK
+                    )
+            dialog.ShowModal()
+            return
+        special_issue = self.is_special_issue is True
+        def confirm(result):
+            gaabo_controler.confirm_issue_files(
+                    self.ask_issue_shipment(),
+                    self.ask_mail_sent(self.RESUBSCRIPTION_FILE),
+                    special_issue
+                    )
+            self.update_subscriber_counter()
+        self.run_task(
+                u'Fichiers du numéro',
+                lambda progress: gaabo_controler.export_issue_files(
+                    file_path,
+                    self.EMAIL_LIST_FILE,
+                    self.RESUBSCRIPTION_FILE,
+                    progress,
+                    special_issue
+                    ),
+                confirm
+                )
+
+    def confirm_issue_shipment(self, result):
+        if self.ask_issue_shipment():
+            if self.is_special_issue is True:
+                gaabo_controler.decrement_special_issues_to_receive()
+            else:
+                gaabo_controler.decrement_normal_issues_to_receive()
+            self.update_subscriber_counter()
+
+    def ask_issue_shipment(self):
+        """Return True if the operator confirms the shipment of the issue"""
         dialog = wx.MessageDialog(
                 None,
                 u'Le fichier de routage a été créé. ' +
@@ -160,11 +235,7 @@ class GaaboFrame(wx.Frame):
                 u'Expédition d\'un numéro',
                 style=wx.OK | wx.CANCEL
                 )
-        if dialog.ShowModal() == wx.ID_OK:
-            if self.is_special_issue is True:
-                gaabo_controler.decrement_special_issues_to_receive()
-            else:
-                gaabo_controler.decrement_normal_issues_to_receive()
+        return dialog.ShowModal() == wx.ID_OK
 
     def show_file_browser(self, event):
         """Display a browser to navigate through the files"""
@@ -179,9 +250,15 @@ class GaaboFrame(wx.Frame):
 
     def generate_mailing_list(self, event):
         """Generate the email list for resubscription campain"""
-        file_name = '../email_resubscription.txt'
-        exporter = subscriber_exporter.EmailExporter(file_name)
-        exporter.do_export()
+        file_name = self.EMAIL_LIST_FILE
+        self.run_task(
+                u'Liste des emails',
+                lambda progress: gaabo_controler.\
+                        export_email_resubscription_file(file_name, progress),
+                lambda result: self.show_generated_file(file_name)
+                )
+
+    def show_generated_file(self, file_name):
         dialog = wx.MessageDialog(
                 None,
                 u'Fichier %s généré' % file_name,
@@ -192,9 +269,21 @@ class GaaboFrame(wx.Frame):
 
     def generate_paper_mailing_list(self, event):
         """Generate the email list for resubscription campain"""
-        file_name = '../resubscription.csv'
-        exporter = subscriber_exporter.ReSubscribeExporter(file_name)
-        exporter.do_export()
+        file_name = self.RESUBSCRIPTION_FILE
+        self.run_task(
+                u'Courrier de réabonnement',
+                lambda progress: gaabo_controler.\
+                        export_paper_resubscription_file(file_name, progress),
+                lambda result: self.confirm_mail_sent(file_name)
+                )
+
+    def confirm_mail_sent(self, file_name):
+        if self.ask_mail_sent(file_name):
+            gaabo_controler.update_mail_sent()
+            self.update_subscriber_counter()
+
+    def ask_mail_sent(self, file_name):
+        """Return True if the operator confirms the mail of the file"""
         message = u"Fichier %s généré.\n" % file_name
         message += "Cliquer sur OK pour confirmer l'envoi "
         message += u"du courrier et mettre à jour la base."
@@ -204,8 +293,63 @@ class GaaboFrame(wx.Frame):
                 'Confirmation',
                 style=wx.OK | wx.CANCEL
                 )
-        if dialog.ShowModal() == wx.ID_OK:
-            gaabo_controler.update_mail_sent()
+        return dialog.ShowModal() == wx.ID_OK
+
+    def run_task(self, title, operation, on_done):
+        """Run the operation on a worker thread while a progress dialog is
+        displayed. on_done is called with the result of the operation."""
+        if self.task_runner.is_busy():
+            return
+        self.progress_dialog = wx.ProgressDialog(
+                title,
+                u'Traitement en cours...',
+                100,
+                self,
+                wx.PD_CAN_ABORT | wx.PD_ELAPSED_TIME
+                )
+        self.task_runner.run(
+                operation,
+                on_progress=self.show_task_progress,
+                on_done=lambda result: self.end_task(on_done, result),
+                on_error=self.show_task_error,
+                on_cancelled=self.show_task_cancelled
+                )
+
+    def show_task_progress(self, done, total):
+        if self.progress_dialog is None:
+            return
+        if total:
+            percent = min(100 * done / total, 99)
+            message = u'%d / %d lignes' % (done, total)
+        else:
+            percent = 0
+            message = u'%d lignes' % done
+        keep_going = self.progress_dialog.Update(percent, message)[0]
+        if not keep_going:
+            self.task_runner.cancel()
+
+    def close_progress_dialog(self):
+        if self.progress_dialog is not None:
+            self.progress_dialog.Destroy()
+            self.progress_dialog = None
+
+    def end_task(self, on_done, result):
+        self.close_progress_dialog()
+        on_done(result)
+
+    def show_task_error(self, error):
+        self.close_progress_dialog()
+        dialog = wx.MessageDialog(
+                None,
+                u'Erreur : %s' % error,
+                u'Erreur',
+                style=wx.OK | wx.ICON_ERROR
+                )
+        dialog.ShowModal()
+
+    def show_task_cancelled(self):
+        self.close_progress_dialog()
+        self.status_bar.SetStatusText(u'Opération annulée', 1)
 
 if __name__ == '__main__':
     bootstrap.run()
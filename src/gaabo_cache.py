@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+'''This module contains the bounded cache used to keep the objects read from
+the database'''
+
+import threading
+from collections import OrderedDict
+
+class LruCache(object):
+    '''Dictionary like cache keeping at most max_size entries. When it is
+    full, the least recently used entry is removed. The number of hits and
+    misses of get is counted. It can be shared by several threads.'''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        '''Return the value cached for key, default if it is not cached'''
+        self.lock.acquire()
+        try:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries[key] = value
+            self.hits += 1
+            return value
+        finally:
+            self.lock.release()
+
+    def put(self, key, value):
+        '''Cache the value of key, removing the oldest entry if needed'''
+        if self.max_size <= 0:
+            return
+        self.lock.acquire()
+        try:
+            if key in self.entries:
+                del self.entries[key]
+            elif len(self.entries) >= self.max_size:
+                self.entries.popitem(last=False)
+            self.entries[key] = value
+        finally:
+            self.lock.release()
+
+    def remove(self, key):
+        '''Remove key from the cache if it is cached'''
+        self.lock.acquire()
+        try:
+            self.entries.pop(key, None)
+        finally:
+            self.lock.release()
+
+    def remove_if(self, predicate):
+        '''Remove the entries whose value matches the predicate and return
+        their number'''
+        self.lock.acquire()
+        try:
+            keys = [key for key, value in self.entries.iteritems()
+                    if predicate(value)]
+            for key in keys:
+                del self.entries[key]
+            return len(keys)
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        '''Remove all the entries'''
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+        finally:
+            self.lock.release()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
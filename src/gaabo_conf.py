@@ -6,3 +6,38 @@ db_name = 'ga.db'
 db_directory = '../databases'
 log_directory = '.'
 
+# Number of rows written in one transaction by the bulk operations
+db_batch_size = 1000
+
+# Number of rows fetched and written at once by the exporters
+export_chunk_size = 1000
+
+# Size in bytes of the write buffer of the exported files
+export_buffer_size = 1024 * 1024
+
+# Number of subscribers read at once to display a search result
+search_page_size = 100
+
+# Number of pages of a search result kept in memory
+search_cached_pages = 20
+
+# Number of subscribers kept in memory once read by their id
+subscriber_cache_size = 1000
+
+# Minimal score, between 0 and 1, of the pairs reported as duplicates
+duplicate_threshold = 0.8
+
+# Number of processes scoring the duplicate candidates. None means one per
+# processor.
+duplicate_pool_size = None
+
+# Buckets of duplicate candidates larger than this are not scored
+duplicate_max_bucket_size = 200
+
+# Maximal number of copies of a bundle of the presorted routing export. The
+# copies of a post code are bundled together.
+routage_bundle_size = 50
+
+# Number of processes writing the zone files of the sharded routing export.
+# None means one per processor.
+export_pool_size = None
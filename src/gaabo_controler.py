@@ -3,55 +3,127 @@
 
 __author__ = 'romain.touze@gmail.com'
 
+import base64
 from datetime import date
+
+import gaabo_conf
 from subscriber import Subscriber
 from subscriber import Address
 from subscriber_exporter import RoutageExporter
-
-def get_searched_subscriber_list(parameters):
-    """Find a subscriber using the dict parameter as search criteria"""
-    # TODO improve : retrieve id, lastname, company then retrieve the
-    # customer when edition is demanded
-    subs_list = populate_subs_list(parameters)
-    return refine_subs_list(subs_list)
-
-def populate_subs_list(parameters):
-    """Get a list of subscribers matching given criteria"""
-    subs_list = []
-    lastname = parameters['name']
-    company = parameters['company']
-    email = parameters ['email']
-
-    if lastname:
-        subs_list.extend(
-                SubscriberAdapter.get_subscribers_from_lastname(lastname)
-                )
-    if company:
-        subs_list.extend(
-                SubscriberAdapter.get_subscribers_from_company(company)
-                )
-    if email:
-        subs_list.extend(
-                SubscriberAdapter.get_subscribers_from_email(email)
-                )
-    return subs_list
-
-def refine_subs_list(subs_list):
-    """Remove deplicates from subs_list"""
-    identifiers = []
-    index = 0
-    for subscriber in subs_list:
-        if subscriber['subscriber_id'] in identifiers:
-            subs_list.pop(index)
-        else:
-            identifiers.append(subscriber['subscriber_id'])
-        index += 1
-    
-    return subs_list
-
-def export_regular_issue_routing_file(file_path):
-    """Create the file to send to routing service"""
-    exporter = RoutageExporter(file_path)
+from subscriber_exporter import PresortedRoutageExporter
+from subscriber_exporter import ShardedRoutageExporter
+from subscriber_exporter import ReSubscribeExporter
+from subscriber_exporter import EmailExporter
+from subscriber_exporter import IssueExporter
+from gaabo_cache import LruCache
+
+def get_search_page(parameters, cursor=None, page_size=None):
+    """Return a page of the search result and the cursor of the next page.
+    The cursor is None for the last page. The pages are read from the id of
+    the last subscriber of the previous page, so a page costs the same
+    whatever its position in the result. The free 'text' search is paged
+    with get_full_text_ids and get_summary_list."""
+    if page_size is None:
+        page_size = gaabo_conf.search_page_size
+    summaries = Subscriber.search_summaries(
+            parameters['name'],
+            parameters['company'],
+            parameters['email'],
+            _decode_cursor(cursor),
+            page_size + 1,
+            parameters.get('sounds_like', False)
+            )
+    next_cursor = None
+    if len(summaries) > page_size:
+        summaries = summaries[:page_size]
+        next_cursor = _encode_cursor(summaries[-1][0])
+    return SubscriberAdapter._build_summary_list(summaries), next_cursor
+
+def get_search_cursor(parameters, position):
+    """Return the cursor of the page starting at position, which is not the
+    first one, None if the result ends before it. The page is found with a
+    single query instead of reading the previous pages."""
+    identifier = Subscriber.search_summary_id(
+            position - 1,
+            parameters['name'],
+            parameters['company'],
+            parameters['email'],
+            parameters.get('sounds_like', False)
+            )
+    if identifier is None:
+        return None
+    return _encode_cursor(identifier)
+
+def get_full_text_ids(text):
+    """Return the ids of the subscribers found by the free text search, best
+    matches first. The ranked result has no key to start a page from, so it
+    is read once for the search and its pages with get_summary_list."""
+    return Subscriber.full_text_ids(text)
+
+def get_summary_list(identifiers):
+    """Return the summary dicts of the subscribers, in the order of
+    identifiers"""
+    return SubscriberAdapter._build_summary_list(
+            Subscriber.get_summaries(identifiers))
+
+def get_search_count(parameters):
+    """Return the number of subscribers found by the search"""
+    return Subscriber.count_summaries(
+            parameters['name'],
+            parameters['company'],
+            parameters['email'],
+            parameters.get('sounds_like', False)
+            )
+
+def _encode_cursor(identifier):
+    """The cursor given to the view is an opaque string"""
+    return base64.urlsafe_b64encode(str(identifier))
+
+def _decode_cursor(cursor):
+    """Return the subscriber id of the cursor. None for the first page."""
+    if cursor is None:
+        return None
+    return int(base64.urlsafe_b64decode(cursor))
+
+def get_subscriber_values(subscriber_id):
+    """Get the dict of all the values of a subscriber to edit it"""
+    return SubscriberAdapter.get_from_id(subscriber_id)
+
+def float_from_french(float_string):
+    """Converts a french typed float string (with a decimal comma) to a python
+    float. 0.0 is returned if the string is not a number."""
+    try:
+        return float(float_string.replace(',', '.'))
+    except ValueError:
+        return 0.0
+
+def date_from_french(date_string):
+    """Converts a French format date string (dd/mm/YYYY) to a python date.
+    None is returned if the string is not a date."""
+    try:
+        day, month, year = date_string.split('/')
+        return date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+def get_routing_exporter(file_path, progress, presorted, sharded):
+    """Return the routing exporter, the presorted or the one writing a file
+    per zone if asked"""
+    if sharded:
+        return ShardedRoutageExporter(file_path, progress)
+    if presorted:
+        return PresortedRoutageExporter(file_path, progress)
+    return RoutageExporter(file_path, progress)
+
+def export_regular_issue_routing_file(file_path, progress=None,
+        presorted=False, sharded=False):
+    """Create the file to send to routing service. The progress is the
+    gaabo_tasks.TaskProgress of the task running the export, if any. A
+    presorted file is sorted by post code, with a summary of the copies of
+    each department next to it. A sharded export writes the presorted file
+    in one file per zone, with a manifest."""
+    set_progress_total(progress, 'active')
+    exporter = get_routing_exporter(file_path, progress, presorted, sharded)
     exporter.do_export()
 
 def decrement_normal_issues_to_receive():
@@ -63,19 +135,160 @@ def decrement_special_issues_to_receive():
     validated"""
     Subscriber.decrement_special_issues_to_receive()
 
-def export_special_issue_routing_file(file_path):
+def export_special_issue_routing_file(file_path, progress=None,
+        presorted=False, sharded=False):
     """Create the file to send to routing service for special issues"""
-    exporter = RoutageExporter(file_path)
+    set_progress_total(progress, 'special_pending')
+    exporter = get_routing_exporter(file_path, progress, presorted, sharded)
     exporter.do_export_special_issue()
 
+def export_issue_files(file_path, email_path, resubscribe_path,
+        progress=None, special_issue=False):
+    """Create the routing file of the issue and the email and paper lists of
+    the resubscription campaign with a single read of the subscribers"""
+    set_progress_total(progress, 'total')
+    exporter = IssueExporter(progress)
+    exporter.add_sink(RoutageExporter(file_path).get_sink(special_issue))
+    exporter.add_sink(EmailExporter(email_path).get_sink())
+    exporter.add_sink(ReSubscribeExporter(resubscribe_path).get_sink())
+    exporter.do_export()
+
+def confirm_issue_files(shipped, mail_sent, special_issue=False):
+    """Record the shipment of the issue and the mail of the resubscription
+    lists written by export_issue_files. The mail is recorded first: the
+    shipment ends the subscriptions of the issue, whose subscribers are not
+    in these lists and must receive the next ones."""
+    if mail_sent:
+        update_mail_sent()
+    if shipped:
+        if special_issue:
+            decrement_special_issues_to_receive()
+        else:
+            decrement_normal_issues_to_receive()
+
+def export_email_resubscription_file(file_path, progress=None):
+    """Create the email list of the resubscription campaign. The estimated
+    total is the number of ended subscriptions, with or without email."""
+    if progress is not None:
+        counts = get_subscription_counts()
+        progress.set_total(counts['total'] - counts['active'])
+    exporter = EmailExporter(file_path, progress)
+    exporter.do_export()
+
+def export_paper_resubscription_file(file_path, progress=None):
+    """Create the address list of the paper resubscription campaign"""
+    set_progress_total(progress, 'awaiting_renewal')
+    exporter = ReSubscribeExporter(file_path, progress)
+    exporter.do_export()
+
+def set_progress_total(progress, counter):
+    """Estimate the total of the progress with a subscriber counter"""
+    if progress is not None:
+        progress.set_total(get_subscription_counts()[counter])
+
 def get_subscription_count():
     """Get the subscriber counter to displays it on notification area"""
     return Subscriber.get_count()
 
+def get_subscription_counts():
+    """Get the subscriber counters: total, active, special_pending and
+    awaiting_renewal"""
+    return Subscriber.get_counts()
+
 def update_mail_sent():
     """Update mail_sent_field when sbscriber list for mailing is exported"""
     Subscriber.update_mail_sent()
 
+class SearchResultModel(object):
+    """Result of a search, read by pages when the rows are asked. It is used
+    by the virtual list of the search panel, which only asks for the visible
+    rows. Only the page of an asked row is read and the last pages read are
+    kept in a bounded cache, so a far row costs the same as a near one. The
+    ids of a free text search are read with the count."""
+
+    def __init__(self, parameters, page_size=None, cached_pages=None):
+        if page_size is None:
+            page_size = gaabo_conf.search_page_size
+        if cached_pages is None:
+            cached_pages = gaabo_conf.search_cached_pages
+        self.parameters = parameters
+        self.page_size = page_size
+        # (rows, cursor of the next page) of each page number
+        self.pages = LruCache(cached_pages)
+        self.ranked_ids = None
+        self.count = None
+        self.loaded_pages = 0
+
+    def get_count(self):
+        """Return the number of rows of the whole result"""
+        if self.count is None:
+            if self.parameters.get('text'):
+                self.count = len(self.get_ranked_ids())
+            else:
+                self.count = get_search_count(self.parameters)
+        return self.count
+
+    def get_ranked_ids(self):
+        """Return the ids of the free text search, read once"""
+        if self.ranked_ids is None:
+            self.ranked_ids = get_full_text_ids(self.parameters['text'])
+        return self.ranked_ids
+
+    def get_row(self, index):
+        """Return the summary dict of the row, None if index is out of the
+        result"""
+        if index < 0 or index >= self.get_count():
+            return None
+        number, position = divmod(index, self.page_size)
+        rows = self.get_page(number)[0]
+        if position < len(rows):
+            return rows[position]
+        return None
+
+    def prefetch(self, progress=None):
+        """Read the count and the first page, so the result can be displayed
+        without querying the database. It is run as a task by the window."""
+        if progress is not None:
+            progress.set_total(self.get_count())
+        else:
+            self.get_count()
+        rows = self.get_page(0)[0]
+        if progress is not None:
+            progress.advance(len(rows))
+        return self
+
+    def get_page(self, number):
+        """Return the rows of the page and the cursor of the next one, from
+        the cache or from the database"""
+        page = self.pages.get(number)
+        if page is None:
+            page = self.load_page(number)
+            self.pages.put(number, page)
+        return page
+
+    def load_page(self, number):
+        """Read a page of the result"""
+        self.loaded_pages += 1
+        start = number * self.page_size
+        if self.parameters.get('text'):
+            identifiers = self.get_ranked_ids()[start:start + self.page_size]
+            return get_summary_list(identifiers), None
+        cursor = None
+        if number > 0:
+            cursor = self.get_page_cursor(number)
+            if cursor is None:
+                return [], None
+        return get_search_page(self.parameters, cursor, self.page_size)
+
+    def get_page_cursor(self, number):
+        """Return the cursor of a page after the first one, None if the
+        result ends before it. It is given by the previous page when it is
+        cached, otherwise it is looked up with a single query."""
+        previous = self.pages.get(number - 1)
+        if previous is not None:
+            return previous[1]
+        return get_search_cursor(self.parameters, number * self.page_size)
+
 class Controler(object):
     """Controler called from the view to make the link with model classes"""
 
@@ -121,11 +334,17 @@ class SubscriberAdapter(object):
     def save_subscriber(self):
         """Save subscriber information in db and return the subscriber dict
         with generated new subscriber id"""
+        self.build_subscriber()
+        self._save_and_retrieve_id()
+        return self.sub
+
+    def build_subscriber(self):
+        """Convert the subscriber dict to the Subscriber object without saving
+        it"""
         self._set_naming_info()
         self._set_address_info()
         self._set_subscription_info()
-        self._save_and_retrieve_id()
-        return self.sub
+        return self.db_sub
 
     def _set_naming_info(self):
         """Sets the information on name, email, etc."""
@@ -144,7 +363,7 @@ class SubscriberAdapter(object):
         """Return True if the field is defined in the dict and if it is not
         empty"""
         return \
-                field in self.sub.keys() \
+                field in self.sub \
                 and unicode(self.sub[field]).strip() != ''
 
     def _set_address_info(self):
@@ -191,41 +410,23 @@ class SubscriberAdapter(object):
 
     def _set_pricing_info(self):
         """Sets the information about subscription and membership pricing"""
-        new_sub_price = \
-            self._convert_field_to_float_str('subscription_price')
-        new_membership_price = \
-            self._convert_field_to_float_str('membership_price')
-        
-        try:
-            self.db_sub.subscription_price = float(new_sub_price)
-        except ValueError:
-            self.db_sub.subscription_price = 0.0
-            
-        try:
-            self.db_sub.membership_price = float(new_membership_price)
-        except ValueError:
-            self.db_sub.membership_price = 0.0
+        self.db_sub.subscription_price = self._get_price('subscription_price')
+        self.db_sub.membership_price = self._get_price('membership_price')
 
-    def _convert_field_to_float_str(self, field_key):
-        """Converts a french typed float string to a python float"""
+    def _get_price(self, field_key):
+        """Converts a french typed float field to a python float"""
         if self._is_defined(field_key):
-            return self.sub[field_key].replace(',', '.')
+            return float_from_french(self.sub[field_key])
         else:
-            return '0'
+            return 0.0
 
     def _set_date_info(self):
         """Converts a French format date field (dd/mm/YYYY) to a python date"""
         if self._is_defined('subscription_date'):
-            try:
-                day, month, year = self.sub['subscription_date'].split('/')
-                self.db_sub.subscription_date = date(
-                        int(year),
-                        int(month),
-                        int(day)
-                        )
-            except ValueError:
-                # We keep the default value, which is current date
-                pass
+            subscription_date = date_from_french(self.sub['subscription_date'])
+            # Otherwise we keep the default value, which is current date
+            if subscription_date is not None:
+                self.db_sub.subscription_date = subscription_date
 
     def _set_misc_info(self):
         """Sets the rest of the information for the subscriber"""
@@ -261,6 +462,29 @@ class SubscriberAdapter(object):
         sub_list = Subscriber.get_subscribers_from_email(email)
         return SubscriberAdapter._build_dict_list(sub_list)
 
+    @classmethod
+    def get_from_id(cls, subscriber_id):
+        """Retrieve the subscriber dict from the id, None if the subscriber
+        does not exist"""
+        sub = Subscriber.get_from_id(subscriber_id)
+        if sub is None:
+            return None
+        return SubscriberAdapter(db_sub=sub).build_dict()
+
+    @classmethod
+    def _build_summary_list(cls, summaries):
+        """Build the dicts displayed in the search result from the
+        (id, lastname, firstname, company) tuples"""
+        summary_list = []
+        for subscriber_id, lastname, firstname, company in summaries:
+            summary_list.append({
+                'subscriber_id': subscriber_id,
+                'lastname': lastname,
+                'firstname': firstname,
+                'company': company
+                })
+        return summary_list
+
     @classmethod
     def _build_dict_list(cls, sub_list):
         """Build the dictionary list from retrieved subscribers"""
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+'''This module decodes the dates stored in the database. The subscription
+dates are read for each fetched or exported subscriber, but there are only a
+few thousand different dates, so the decoded values are cached.
+
+The connections opened with connect_options() in their arguments get the
+decoded dates directly from sqlite3, through the DATE converter.'''
+
+import datetime
+import sqlite3
+
+# Date given to the subscribers whose date is missing or wrong
+DEFAULT_DATE = datetime.date(1900, 01, 01)
+
+# Number of decoded dates kept in the cache
+CACHE_SIZE = 10000
+
+_cache = {}
+
+def decode_date(iso_date_string):
+    """Return the datetime.date of a date stored in the database. A value
+    that is not a well formed date from 1900, which strftime cannot format,
+    is returned as a unicode string so that the exports can still print it.
+    This is registered as the sqlite3 converter of the DATE columns."""
+    value = _cache.get(iso_date_string)
+    if value is None:
+        value = _parse_iso_date(iso_date_string)
+        if len(_cache) >= CACHE_SIZE:
+            _cache.clear()
+        _cache[iso_date_string] = value
+    return value
+
+def _parse_iso_date(iso_date_string):
+    """Uncached decoding of decode_date"""
+    try:
+        (year, month, day) = iso_date_string.split('-')
+        value = datetime.date(int(year), int(month), int(day))
+    except (ValueError, TypeError):
+        return unicode(iso_date_string)
+    if value.year < 1900 or value.isoformat() != iso_date_string:
+        return unicode(iso_date_string)
+    return value
+
+def register_converter():
+    """Make sqlite3 decode the DATE columns with decode_date. The dates are
+    already stored in ISO format by the default adapter of sqlite3."""
+    sqlite3.register_converter('DATE', decode_date)
+
+def connect_options():
+    """Keyword arguments of sqlite3.connect to get decoded dates"""
+    return {'detect_types': sqlite3.PARSE_DECLTYPES}
+
+def date_from_iso(iso_date_string):
+    """Return the date of a subscriber from the value read in the database,
+    DEFAULT_DATE if there is none or if it cannot be formatted"""
+    if iso_date_string is None:
+        return DEFAULT_DATE
+    if not isinstance(iso_date_string, datetime.date):
+        iso_date_string = decode_date(iso_date_string)
+    if isinstance(iso_date_string, datetime.date):
+        return iso_date_string
+    # Not stored by sqlite3, like 2011-7-12
+    items = iso_date_string.split('-')
+    if len(items) == 3 and is_correct_date(*items):
+        return datetime.date(int(items[0]), int(items[1]), int(items[2]))
+    return DEFAULT_DATE
+
+def french_date_from_iso(iso_date_string):
+    """Return the date as dd/mm/YYYY from the value read in the database. The
+    wrong dates are printed as they are stored, with the items reversed."""
+    if iso_date_string is None:
+        return None
+    if not isinstance(iso_date_string, datetime.date):
+        iso_date_string = decode_date(iso_date_string)
+    if isinstance(iso_date_string, datetime.date):
+        return '%02d/%02d/%04d' % (
+                iso_date_string.day,
+                iso_date_string.month,
+                iso_date_string.year
+                )
+    items = iso_date_string.split('-')
+    items.reverse()
+    return '/'.join(items)
+
+def is_correct_date(year, month, day):
+    """Show is the year can be transforme to a datetime.date and formatted"""
+
+    if cannot_be_formatted(year):
+        return False
+    elif cannot_create_date(year, month, day):
+        return False
+    else:
+        return True
+
+def cannot_be_formatted(year):
+    """Years bellow 1900 cannot be formatted by strftime"""
+    if str(year).isdigit() and int(year) < 1900:
+        return True
+    else:
+        return False
+
+def cannot_create_date(year, month, day):
+    """Try to create a date to check that the params are correct"""
+    try:
+        datetime.date(int(year), int(month), int(day))
+        return False
+    except (ValueError, TypeError):
+        return True
+
+register_converter()
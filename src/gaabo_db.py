@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+'''This module shares the sqlite connections used by gaabo. Opening a
+connection for each Subscriber or each DAO call is expensive, so the
+connections are kept and reused for a given database file.'''
+
+import os
+import sqlite3
+import threading
+import urllib
+
+import gaabo_conf
+import gaabo_dates
+from gaabo_cache import LruCache
+
+_managers = {}
+_managers_lock = threading.Lock()
+# Whether sqlite understands the URI file names, checked once
+_uri_support = []
+
+# Module functions definitions
+
+def get_db_path():
+    """Return the path of the database file chosen in gaabo_conf"""
+    return os.path.join(gaabo_conf.db_directory, gaabo_conf.db_name)
+
+def get_manager(db_path=None):
+    """Return the ConnectionManager of the database file. The default file is
+    the one defined in gaabo_conf."""
+    if db_path is None:
+        db_path = get_db_path()
+    _managers_lock.acquire()
+    try:
+        if db_path not in _managers:
+            _managers[db_path] = ConnectionManager(db_path)
+        return _managers[db_path]
+    finally:
+        _managers_lock.release()
+
+def get_connection(db_path=None):
+    """Return the connection of the current thread to the database"""
+    return get_manager(db_path).get_connection()
+
+def get_cache(name, max_size, db_path=None):
+    """Return the LruCache called name of the database file. It is dropped
+    with the connections by close_connections."""
+    return get_manager(db_path).get_cache(name, max_size)
+
+def connect(db_path, **options):
+    """Open a connection decoding the DATE columns with the shared and
+    cached gaabo_dates decoder"""
+    options.update(gaabo_dates.connect_options())
+    return sqlite3.connect(db_path, **options)
+
+def connect_read_only(db_path):
+    """Open a connection that cannot write the database. It is opened from a
+    read-only URI when sqlite was built to understand them, otherwise the
+    query_only pragma forbids the writes."""
+    if has_uri_support():
+        conn = connect('file:%s?mode=ro'
+                % urllib.pathname2url(os.path.abspath(db_path)))
+    else:
+        conn = connect(db_path)
+        conn.execute('PRAGMA query_only = ON')
+    return conn
+
+def has_uri_support():
+    """Return True if sqlite opens the file: URIs as such. The python 2
+    module cannot ask for them, so sqlite must be built with them."""
+    if not _uri_support:
+        conn = sqlite3.connect(':memory:')
+        options = [row[0] for row in conn.execute('PRAGMA compile_options')]
+        conn.close()
+        _uri_support.append('USE_URI' in options)
+    return _uri_support[0]
+
+def close_thread_connection(db_path=None):
+    """Close the connection of the current thread to the database. Worker
+    threads call it before they end."""
+    if db_path is None:
+        db_path = get_db_path()
+    _managers_lock.acquire()
+    try:
+        manager = _managers.get(db_path)
+    finally:
+        _managers_lock.release()
+    if manager is not None:
+        manager.close_connection()
+
+def close_connections(db_path=None):
+    """Close every connection opened on the database file. This must be done
+    before removing or replacing the file."""
+    if db_path is None:
+        db_path = get_db_path()
+    _managers_lock.acquire()
+    try:
+        manager = _managers.pop(db_path, None)
+    finally:
+        _managers_lock.release()
+    if manager is not None:
+        manager.close_all()
+
+class ConnectionManager(object):
+    """Hands out the connections to one database file. Each thread gets its
+    own connection with get_connection. The caches of the objects read from
+    the file are kept with the connections, so they are dropped when the file
+    is replaced."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+        self.caches = {}
+
+    def get_connection(self):
+        """Return the connection of the current thread, open it if needed"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self._open()
+            self.local.conn = conn
+        return conn
+
+    def close_connection(self):
+        """Close the connection of the current thread, if it has one"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            return
+        self.local.conn = None
+        self.lock.acquire()
+        try:
+            if conn in self.connections:
+                self.connections.remove(conn)
+        finally:
+            self.lock.release()
+        conn.close()
+
+    def get_cache(self, name, max_size):
+        """Return the LruCache called name, create it if needed"""
+        self.lock.acquire()
+        try:
+            if name not in self.caches:
+                self.caches[name] = LruCache(max_size)
+            return self.caches[name]
+        finally:
+            self.lock.release()
+
+    def close_all(self):
+        """Close all the connections opened by the manager"""
+        self.lock.acquire()
+        try:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+            for cache in self.caches.values():
+                cache.clear()
+        finally:
+            self.lock.release()
+        self.local = threading.local()
+
+    def _open(self):
+        """Open a new connection and keep track of it"""
+        conn = connect(self.db_path, check_same_thread=False)
+        self.lock.acquire()
+        try:
+            self.connections.append(conn)
+        finally:
+            self.lock.release()
+        return conn
@@ -5,10 +5,27 @@ import os
 import sqlite3
 import sys
 import gaabo_conf
+import gaabo_db
+
+def _count_case(condition, row):
+    '''Return 1 if the row (NEW or OLD in a trigger) matches the counter
+    condition, 0 otherwise'''
+    return 'CASE WHEN %s THEN 1 ELSE 0 END' % condition.format(row=row + '.')
+
+def _range_count(column, lower, upper, condition=''):
+    '''Count the subscribers whose column is in the ]lower, upper] range. The
+    range is read from the indexes of the column.'''
+    return '''(SELECT COUNT(*) FROM subscribers
+            WHERE %s > %s AND %s <= %s%s)''' % (
+                    column, lower, column, upper, condition)
 
 class SqliteDbOperator(object):
     '''This class provide everything to operate a sqllite base'''
 
+    # Version of the schema created by create_db, stored in the user_version
+    # pragma. bootstrap.DbUpdater migrates the older databases to it.
+    SCHEMA_VERSION = 9
+
     SUBSCRIBERS_CREATE = '''
     CREATE TABLE subscribers (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -35,8 +52,250 @@ class SqliteDbOperator(object):
         comment TEXT,
         bank TEXT,
         ordering_type TEXT,
-        mail_sent INTEGER
+        mail_sent INTEGER,
+        last_issue INTEGER DEFAULT 0,
+        last_special_issue INTEGER DEFAULT 0,
+        lastname_key TEXT,
+        company_key TEXT,
+        lastname_phonetic TEXT,
+        updated_at TEXT
+    )'''
+
+    # Shipping an issue only increments these counters. A subscriber receives
+    # the regular issues up to last_issue and the special issues up to
+    # last_special_issue, the remaining issues are computed from the counters.
+    # The issues_to_receive and hors_serie1 columns are only kept for the
+    # databases migrated from the former model.
+    ISSUE_COUNTER_CREATE = '''
+    CREATE TABLE IF NOT EXISTS issue_counter (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        regular_issue INTEGER NOT NULL,
+        special_issue INTEGER NOT NULL
+    )'''
+    ISSUE_COUNTER_INIT = '''
+    INSERT OR IGNORE INTO issue_counter (id, regular_issue, special_issue)
+    VALUES (1, 0, 0)'''
+
+    # Counters displayed in the status bar. They are maintained by the
+    # triggers below, so reading them does not scan the subscribers table.
+    SUBSCRIBER_STATS_CREATE = '''
+    CREATE TABLE IF NOT EXISTS subscriber_stats (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        total INTEGER NOT NULL,
+        active INTEGER NOT NULL,
+        special_pending INTEGER NOT NULL,
+        awaiting_renewal INTEGER NOT NULL
+    )'''
+    # Counter -> condition on a subscribers row, the same as the exports
+    SUBSCRIBER_STATS_CONDITIONS = [
+    ('active', '{row}last_issue > (SELECT regular_issue FROM issue_counter)'),
+    ('special_pending',
+        '{row}last_special_issue > (SELECT special_issue FROM issue_counter)'),
+    ('awaiting_renewal',
+        '{row}last_issue <= (SELECT regular_issue FROM issue_counter)'
+        ' AND {row}mail_sent = 0'),
+    ]
+    SUBSCRIBER_STATS_BACKFILL = '''
+    INSERT OR REPLACE INTO subscriber_stats
+    (id, total, active, special_pending, awaiting_renewal)
+    SELECT 1, COUNT(*), %s FROM subscribers''' % ', '.join(
+            'COUNT(CASE WHEN %s THEN 1 END)' % condition.format(row='')
+            for name, condition in SUBSCRIBER_STATS_CONDITIONS)
+    SUBSCRIBER_STATS_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS subscriber_stats_insert
+    AFTER INSERT ON subscribers BEGIN
+        UPDATE subscriber_stats SET total = total + 1, %s;
+    END''' % ', '.join(
+            '%s = %s + (%s)' % (name, name, _count_case(condition, 'NEW'))
+            for name, condition in SUBSCRIBER_STATS_CONDITIONS),
+    '''CREATE TRIGGER IF NOT EXISTS subscriber_stats_delete
+    AFTER DELETE ON subscribers BEGIN
+        UPDATE subscriber_stats SET total = total - 1, %s;
+    END''' % ', '.join(
+            '%s = %s - (%s)' % (name, name, _count_case(condition, 'OLD'))
+            for name, condition in SUBSCRIBER_STATS_CONDITIONS),
+    '''CREATE TRIGGER IF NOT EXISTS subscriber_stats_update
+    AFTER UPDATE OF last_issue, last_special_issue, mail_sent ON subscribers
+    BEGIN
+        UPDATE subscriber_stats SET %s;
+    END''' % ', '.join(
+            '%s = %s + (%s) - (%s)' % (
+                name,
+                name,
+                _count_case(condition, 'NEW'),
+                _count_case(condition, 'OLD'))
+            for name, condition in SUBSCRIBER_STATS_CONDITIONS),
+    # Shipping an issue only changes the subscribers whose last issue is
+    # between the former and the new counter
+    '''CREATE TRIGGER IF NOT EXISTS subscriber_stats_regular_issue
+    AFTER UPDATE OF regular_issue ON issue_counter BEGIN
+        UPDATE subscriber_stats SET
+        active = active - %s + %s,
+        awaiting_renewal = awaiting_renewal + %s - %s;
+    END''' % (
+            _range_count(
+                'last_issue', 'OLD.regular_issue', 'NEW.regular_issue'),
+            _range_count(
+                'last_issue', 'NEW.regular_issue', 'OLD.regular_issue'),
+            _range_count(
+                'last_issue', 'OLD.regular_issue', 'NEW.regular_issue',
+                ' AND mail_sent = 0'),
+            _range_count(
+                'last_issue', 'NEW.regular_issue', 'OLD.regular_issue',
+                ' AND mail_sent = 0')),
+    '''CREATE TRIGGER IF NOT EXISTS subscriber_stats_special_issue
+    AFTER UPDATE OF special_issue ON issue_counter BEGIN
+        UPDATE subscriber_stats SET
+        special_pending = special_pending - %s + %s;
+    END''' % (
+            _range_count('last_special_issue',
+                'OLD.special_issue', 'NEW.special_issue'),
+            _range_count('last_special_issue',
+                'NEW.special_issue', 'OLD.special_issue')),
+    ]
+
+    # Full text index of the free text search. It is an external content
+    # table: the text is read from the subscribers table, only the index is
+    # stored. The triggers keep it in sync with the subscribers rows.
+    FULL_TEXT_COLUMNS = ['lastname', 'firstname', 'company', 'name_addition',
+            'address', 'city', 'email_address', 'comment']
+    SUBSCRIBERS_FTS_CREATE = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS subscribers_fts USING fts5(
+        %s,
+        content='subscribers',
+        content_rowid='id',
+        prefix='2 3'
+    )''' % ', '.join(FULL_TEXT_COLUMNS)
+    SUBSCRIBERS_FTS_REBUILD = '''
+    INSERT INTO subscribers_fts (subscribers_fts) VALUES ('rebuild')'''
+    SUBSCRIBERS_FTS_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS subscribers_fts_insert
+    AFTER INSERT ON subscribers BEGIN
+        INSERT INTO subscribers_fts (rowid, %s) VALUES (NEW.id, %s);
+    END''' % (', '.join(FULL_TEXT_COLUMNS),
+            ', '.join('NEW.' + column for column in FULL_TEXT_COLUMNS)),
+    '''CREATE TRIGGER IF NOT EXISTS subscribers_fts_delete
+    AFTER DELETE ON subscribers BEGIN
+        INSERT INTO subscribers_fts (subscribers_fts, rowid, %s)
+        VALUES ('delete', OLD.id, %s);
+    END''' % (', '.join(FULL_TEXT_COLUMNS),
+            ', '.join('OLD.' + column for column in FULL_TEXT_COLUMNS)),
+    '''CREATE TRIGGER IF NOT EXISTS subscribers_fts_update
+    AFTER UPDATE OF %s ON subscribers BEGIN
+        INSERT INTO subscribers_fts (subscribers_fts, rowid, %s)
+        VALUES ('delete', OLD.id, %s);
+        INSERT INTO subscribers_fts (rowid, %s) VALUES (NEW.id, %s);
+    END''' % (', '.join(FULL_TEXT_COLUMNS),
+            ', '.join(FULL_TEXT_COLUMNS),
+            ', '.join('OLD.' + column for column in FULL_TEXT_COLUMNS),
+            ', '.join(FULL_TEXT_COLUMNS),
+            ', '.join('NEW.' + column for column in FULL_TEXT_COLUMNS)),
+    ]
+
+    # The lastname and company are searched through their key, folded to
+    # upper case ASCII by transliteration.to_search_key when the DAO writes
+    # them. The rows written by other means get a key from these triggers,
+    # which only fold ASCII with upper(): an update done outside of the DAO
+    # must set the keys to NULL to get one.
+    SEARCH_KEY_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS subscribers_search_key_insert
+    AFTER INSERT ON subscribers
+    WHEN NEW.lastname_key IS NULL OR NEW.company_key IS NULL BEGIN
+        UPDATE subscribers SET
+        lastname_key = COALESCE(NEW.lastname_key, upper(NEW.lastname)),
+        company_key = COALESCE(NEW.company_key, upper(NEW.company))
+        WHERE id = NEW.id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS subscribers_search_key_update
+    AFTER UPDATE OF lastname, company, lastname_key, company_key
+    ON subscribers
+    WHEN NEW.lastname_key IS NULL OR NEW.company_key IS NULL BEGIN
+        UPDATE subscribers SET
+        lastname_key = COALESCE(NEW.lastname_key, upper(NEW.lastname)),
+        company_key = COALESCE(NEW.company_key, upper(NEW.company))
+        WHERE id = NEW.id;
+    END''',
+    ]
+    SEARCH_KEY_INDEXES = [
+    '''CREATE INDEX IF NOT EXISTS subscribers_lastname_key_idx
+    ON subscribers (lastname_key)''',
+    '''CREATE INDEX IF NOT EXISTS subscribers_company_key_idx
+    ON subscribers (company_key)''',
+    ]
+
+    # French phonetic key of the lastname, computed by
+    # phonetic.french_phonetic_key when the DAO writes the subscriber. The
+    # "sounds like" search looks it up in this index.
+    PHONETIC_KEY_INDEXES = [
+    '''CREATE INDEX IF NOT EXISTS subscribers_lastname_phonetic_idx
+    ON subscribers (lastname_phonetic)''',
+    ]
+
+    # Change tracking of the delta export. The DAO sets updated_at, in UTC
+    # with milliseconds, each time it writes a subscriber. The watermark is
+    # the time and the issue counters of the last delta export: shipping an
+    # issue changes the remaining issues of the subscribers still receiving
+    # them without writing their rows. The deleted subscribers are kept as
+    # tombstones until the next delta export.
+    EXPORT_WATERMARK_CREATE = '''
+    CREATE TABLE IF NOT EXISTS export_watermark (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        exported_at TEXT,
+        regular_issue INTEGER,
+        special_issue INTEGER
     )'''
+    EXPORT_WATERMARK_INIT = '''
+    INSERT OR IGNORE INTO export_watermark (id) VALUES (1)'''
+    DELETED_SUBSCRIBERS_CREATE = '''
+    CREATE TABLE IF NOT EXISTS deleted_subscribers (
+        id INTEGER PRIMARY KEY,
+        deleted_at TEXT NOT NULL
+    )'''
+    DELETED_SUBSCRIBERS_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS subscribers_tombstone
+    AFTER DELETE ON subscribers BEGIN
+        INSERT OR REPLACE INTO deleted_subscribers (id, deleted_at)
+        VALUES (OLD.id, strftime('%Y-%m-%d %H:%M:%f', 'now'));
+    END'''
+    CHANGE_TRACKING_INDEXES = [
+    '''CREATE INDEX IF NOT EXISTS subscribers_updated_at_idx
+    ON subscribers (updated_at)''',
+    ]
+
+    # Case insensitive search columns. The NOCASE collation folds ASCII like
+    # lower() does, so the search queries can use these indexes.
+    SUBSCRIBERS_INDEXES = [
+    '''CREATE INDEX IF NOT EXISTS subscribers_email_idx
+    ON subscribers (email_address COLLATE NOCASE)''',
+    # The exports read the active slice of the table from these indexes. The
+    # address columns are included so the routing and re-subscription files
+    # are written from the index only, and the partial indexes leave out the
+    # rows the exports never read.
+    '''CREATE INDEX IF NOT EXISTS subscribers_issue_address_idx
+    ON subscribers (last_issue, lastname, firstname, company, name_addition,
+    address, address_addition, post_code, city)''',
+    '''CREATE INDEX IF NOT EXISTS subscribers_special_issue_address_idx
+    ON subscribers (last_special_issue, lastname, firstname, company,
+    name_addition, address, address_addition, post_code, city)''',
+    '''CREATE INDEX IF NOT EXISTS subscribers_resubscribe_idx
+    ON subscribers (last_issue, firstname, lastname, company, name_addition,
+    address, address_addition, post_code, city, mail_sent)
+    WHERE mail_sent = 0''',
+    """CREATE INDEX IF NOT EXISTS subscribers_email_export_idx
+    ON subscribers (last_issue, email_address)
+    WHERE email_address != ''""",
+    # The presorted routing export reads the rows in the order of the post
+    # codes from this index, which ends with the id, so it needs no sort.
+    '''CREATE INDEX IF NOT EXISTS subscribers_post_code_idx
+    ON subscribers (post_code)''',
+    ]
+    # Indexes replaced by the ones above
+    OBSOLETE_INDEXES = [
+    'subscribers_last_issue_idx',
+    'subscribers_last_special_issue_idx',
+    'subscribers_lastname_idx',
+    'subscribers_company_idx',
+    ]
 
 
     def __init__(self):
@@ -53,6 +312,7 @@ class SqliteDbOperator(object):
 
     def remove_db(self):
         '''Removes a previous existing DB with the same name'''
+        gaabo_db.close_connections(self.db_full_path)
         if os.path.isfile(self.db_full_path):
             os.remove(self.db_full_path)
 
@@ -62,5 +322,46 @@ class SqliteDbOperator(object):
         conn = sqlite3.connect(self.db_full_path)
         cursor = conn.cursor()
         cursor.execute(self.SUBSCRIBERS_CREATE)
+        cursor.execute(self.ISSUE_COUNTER_CREATE)
+        cursor.execute(self.ISSUE_COUNTER_INIT)
+        cursor.execute(self.SUBSCRIBER_STATS_CREATE)
+        cursor.execute(self.SUBSCRIBER_STATS_BACKFILL)
+        for trigger_create in self.SUBSCRIBER_STATS_TRIGGERS:
+            cursor.execute(trigger_create)
+        for index_create in self.SUBSCRIBERS_INDEXES:
+            cursor.execute(index_create)
+        for index_create in self.SEARCH_KEY_INDEXES:
+            cursor.execute(index_create)
+        for index_create in self.PHONETIC_KEY_INDEXES:
+            cursor.execute(index_create)
+        for trigger_create in self.SEARCH_KEY_TRIGGERS:
+            cursor.execute(trigger_create)
+        self.create_change_tracking(cursor)
+        self.create_full_text_index(cursor)
+        cursor.execute('PRAGMA user_version = %d' % self.SCHEMA_VERSION)
+        conn.commit()
         cursor.close()
         conn.close()
+
+    def create_change_tracking(self, cursor):
+        '''Create the watermark, the tombstones and the index of the delta
+        export'''
+        cursor.execute(self.EXPORT_WATERMARK_CREATE)
+        cursor.execute(self.EXPORT_WATERMARK_INIT)
+        cursor.execute(self.DELETED_SUBSCRIBERS_CREATE)
+        cursor.execute(self.DELETED_SUBSCRIBERS_TRIGGER)
+        for index_create in self.CHANGE_TRACKING_INDEXES:
+            cursor.execute(index_create)
+
+    def create_full_text_index(self, cursor):
+        '''Create the full text index and its triggers if needed, then fill
+        it from the subscribers table. False is returned if sqlite was built
+        without FTS5: the free text search then scans the table.'''
+        try:
+            cursor.execute(self.SUBSCRIBERS_FTS_CREATE)
+        except sqlite3.OperationalError:
+            return False
+        cursor.execute(self.SUBSCRIBERS_FTS_REBUILD)
+        for trigger_create in self.SUBSCRIBERS_FTS_TRIGGERS:
+            cursor.execute(trigger_create)
+        return True
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+'''This module runs the long operations of gaabo, like the exports, on a
+worker thread so the window keeps repainting. It does not depend on wx: the
+callbacks are given to a dispatch function, wx.CallAfter in the application,
+which calls them on the thread of the window.
+
+An operation is a callable receiving a TaskProgress:
+
+    def operation(progress):
+        progress.set_total(row_count)
+        for chunk in chunks:
+            progress.advance(len(chunk))
+        return result
+
+TaskProgress.advance raises TaskCancelled once the task is cancelled, so the
+operation stops at its next chunk.'''
+
+import threading
+
+import gaabo_db
+
+class TaskCancelled(Exception):
+    """Raised in the operation of a cancelled task"""
+
+def call_now(callback, *args):
+    """Default dispatch function, calls the callback on the worker thread"""
+    callback(*args)
+
+class TaskProgress(object):
+    """Progress of a task, in rows processed over the estimated total. The
+    total is None while it is unknown. Each change is reported with
+    report(done, total)."""
+
+    def __init__(self, report=None):
+        self.report = report
+        self.total = None
+        self.done = 0
+        self.cancelled = threading.Event()
+
+    def set_total(self, total):
+        """Set the estimated number of rows of the operation"""
+        self.total = total
+        self._report()
+
+    def advance(self, count=1):
+        """Record count more processed rows. TaskCancelled is raised if the
+        task was cancelled."""
+        self.check_cancelled()
+        self.done += count
+        self._report()
+
+    def cancel(self):
+        """Ask the operation to stop"""
+        self.cancelled.set()
+
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+
+    def check_cancelled(self):
+        """Raise TaskCancelled if the task was cancelled"""
+        if self.cancelled.is_set():
+            raise TaskCancelled()
+
+    def _report(self):
+        if self.report is not None:
+            self.report(self.done, self.total)
+
+class Task(object):
+    """An operation running on its own thread. The thread reads the database
+    with its own connection. When the operation fails or is cancelled, the
+    pending transaction of this connection is rolled back before on_error or
+    on_cancelled is called."""
+
+    def __init__(self, operation, dispatch=None, on_progress=None,
+            on_done=None, on_error=None, on_cancelled=None):
+        if dispatch is None:
+            dispatch = call_now
+        self.operation = operation
+        self.dispatch = dispatch
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_cancelled = on_cancelled
+        self.progress = TaskProgress(self._report_progress)
+        self.result = None
+        self.error = None
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        """Stop the operation at its next progress report"""
+        self.progress.cancel()
+
+    def join(self, timeout=None):
+        """Wait for the end of the operation. Return False if it is still
+        running after timeout seconds."""
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    def is_running(self):
+        return self.thread.is_alive()
+
+    def _run(self):
+        try:
+            try:
+                self.result = self.operation(self.progress)
+            except TaskCancelled:
+                self._rollback()
+                self._dispatch(self.on_cancelled)
+            except Exception, error:
+                self._rollback()
+                self.error = error
+                self._dispatch(self.on_error, error)
+            else:
+                self._dispatch(self.on_done, self.result)
+        finally:
+            gaabo_db.close_thread_connection()
+
+    def _rollback(self):
+        """Roll back what the operation left uncommitted"""
+        gaabo_db.get_connection().rollback()
+
+    def _report_progress(self, done, total):
+        self._dispatch(self.on_progress, done, total)
+
+    def _dispatch(self, callback, *args):
+        if callback is not None:
+            self.dispatch(callback, *args)
+
+class TaskRunner(object):
+    """Starts the tasks of an application with its dispatch function. Only
+    one task runs at a time, the current one can be cancelled."""
+
+    def __init__(self, dispatch=None):
+        self.dispatch = dispatch
+        self.current = None
+
+    def run(self, operation, on_progress=None, on_done=None, on_error=None,
+            on_cancelled=None):
+        """Start the operation on a worker thread and return its Task.
+        ValueError is raised if a task is already running."""
+        if self.is_busy():
+            raise ValueError('A task is already running')
+        self.current = Task(
+                operation,
+                self.dispatch,
+                on_progress,
+                on_done,
+                on_error,
+                on_cancelled
+                )
+        self.current.start()
+        return self.current
+
+    def is_busy(self):
+        return self.current is not None and self.current.is_running()
+
+    def cancel(self):
+        """Cancel the running task, if any"""
+        if self.current is not None:
+            self.current.cancel()
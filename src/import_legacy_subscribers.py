@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+
+from subscriber_importer import LegacyImporter
+
+def main():
+    if len(sys.argv) < 2:
+        print u'Usage : %s fichier [encodage]' % sys.argv[0]
+        sys.exit(1)
+    file_name = sys.argv[1]
+    if len(sys.argv) > 2:
+        importer = LegacyImporter(file_name, sys.argv[2])
+    else:
+        importer = LegacyImporter(file_name)
+    print u'Import des abonnés de %s...' % file_name
+
+    count = importer.do_import()
+
+    print u'%d abonnés importés en %.1f s (%d lignes/s).' % (
+            count,
+            importer.elapsed_time,
+            importer.get_rate()
+            )
+
+if __name__ == '__main__':
+    main()
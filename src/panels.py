@@ -176,14 +176,18 @@ class SearchPanel(wx.Panel):
     def generate_search_box(self):
         """Generate the search part of the search panel"""
         self.box.Add(wx.StaticText(self, -1, u'Entrer les critères de recherche :\n'))
-        grid = wx.FlexGridSizer(3, 2, 5, 5)
+        grid = wx.FlexGridSizer(5, 2, 5, 5)
 
         self._add_name_search_field(grid)
 
+        self._add_sounds_like_field(grid)
+
         self._add_company_search_field(grid)
 
         self._add_email_search_field(grid)
 
+        self._add_text_search_field(grid)
+
         self.box.Add(grid)
         search_button = wx.Button(self, -1, u'Rechercher')
         self.frame.Bind(wx.EVT_BUTTON, self.frame.search_subscriber, id=search_button.GetId())
@@ -194,6 +198,14 @@ class SearchPanel(wx.Panel):
         self.frame.searched_name_in = self._get_common_search_field('name')
         grid.Add(self.frame.searched_name_in, flag=wx.ALIGN_CENTER_VERTICAL)
 
+    def _add_sounds_like_field(self, grid):
+        grid.Add(wx.StaticText(self, -1, u'Nom approchant'), flag=wx.ALIGN_CENTER_VERTICAL)
+        self.frame.searched_sounds_like_in = wx.CheckBox(
+                self, -1, u'Chercher les noms qui se prononcent pareil')
+        self.frame.searched_sounds_like_in.SetValue(
+                self.frame.searched_params.get('sounds_like', False))
+        grid.Add(self.frame.searched_sounds_like_in, flag=wx.ALIGN_CENTER_VERTICAL)
+
     def _add_company_search_field(self, grid):
         grid.Add(wx.StaticText(self, -1, u'Nom société'), flag=wx.ALIGN_CENTER_VERTICAL)
         self.frame.searched_company_in = self._get_common_search_field('company')
@@ -204,6 +216,13 @@ class SearchPanel(wx.Panel):
         self.frame.searched_email_in = self._get_common_search_field('email')
         grid.Add(self.frame.searched_email_in, flag=wx.ALIGN_CENTER_VERTICAL)
 
+    def _add_text_search_field(self, grid):
+        grid.Add(wx.StaticText(self, -1, u'Recherche libre'), flag=wx.ALIGN_CENTER_VERTICAL)
+        self.frame.searched_text_in = self._get_common_search_field('text')
+        self.frame.searched_text_in.SetToolTipString(
+                u'Mots du nom, de l\'adresse, de l\'email ou du commentaire')
+        grid.Add(self.frame.searched_text_in, flag=wx.ALIGN_CENTER_VERTICAL)
+
     def _get_common_search_field(self, key):
         """We assume that field_position is > 0. No control implemented."""
         sizing_pair = (200, FIELD_HEIGHT)
@@ -218,11 +237,11 @@ class SearchPanel(wx.Panel):
             field = wx.TextCtrl(self, -1, size=sizing_pair)
         return field
 
-    def add_result(self, subscriber_list):
-        """Public method to add the result part made of the subscribers objects
-        in the subscriber list"""
+    def add_result(self, result_model):
+        """Public method to add the result part, read from the
+        SearchResultModel of the search"""
         self.add_separation_to_box()
-        self.add_result_to_box(subscriber_list)
+        self.add_result_to_box(result_model)
         self.SetSizer(self.box)
 
     def add_separation_to_box(self):
@@ -231,64 +250,85 @@ class SearchPanel(wx.Panel):
         self.box.Add(wx.StaticLine(self, wx.HORIZONTAL, size=(350, 1)))
         self.box.Add(wx.StaticText(self, -1, ''))
 
-    def add_result_to_box(self, subscriber_list):
-        """Add the result grid to the box, member of SearchPanel instance."""
-        self.result_grid = wx.FlexGridSizer(len(subscriber_list) + 1, 5, 5, 5)
-        self.add_heading_to_result_grid()
-        self.add_subscriber_to_result_grid(subscriber_list)
-        self.box.Add(self.result_grid)
-
-    def add_heading_to_result_grid(self):
-        """Add the header line to the result grid"""
-        self.result_grid.Add(self.get_heading_text('Nom'))
-        self.result_grid.Add(self.get_heading_text(u'Prénom'))
-        self.result_grid.Add(self.get_heading_text(u'Société'))
-        self.result_grid.Add(self.get_heading_text('Action'))
-        self.result_grid.Add(wx.StaticText(self, -1, ''))
-
-    def get_heading_text(self, text):
-        """Returns a StaticText with a heading style"""
-        heading_text = wx.StaticText(self, -1, text)
-        heading_font = wx.Font(10, wx.DEFAULT, wx.NORMAL, wx.BOLD)
-        heading_text.SetFont(heading_font)
-        return heading_text
-
-    def add_subscriber_to_result_grid(self, subscriber_list):
-        "Add content of the list to the result grid"""
-        # Dictionnaire pour stocker les paires button_id / subscriber
-        self.frame.subs_dict = {}
-        for subscriber in subscriber_list:
-            modify_button = wx.Button(self, -1, 'Modifier')
-            delete_button = wx.Button(self, -1, 'Supprimer')
-            modify_button_id = modify_button.GetId()
-            delete_button_id = delete_button.GetId()
-            self.frame.subs_dict[modify_button_id] = subscriber
-            self.frame.subs_dict[delete_button_id] = subscriber
-            self.frame.Bind(
-                    wx.EVT_BUTTON,
-                    self.frame.modify_subscriber_form,
-                    id=modify_button_id
-                    )
-            self.frame.Bind(
-                    wx.EVT_BUTTON,
-                    self.frame.delete_subscriber,
-                    id=delete_button_id
-                    )
+    def add_result_to_box(self, result_model):
+        """Add the result list and its actions to the box, member of
+        SearchPanel instance."""
+        self.box.Add(wx.StaticText(
+            self,
+            -1,
+            u'%d abonné(s) trouvé(s)' % result_model.get_count()
+            ))
+        self.result_list = SearchResultList(self, result_model)
+        self.frame.Bind(
+                wx.EVT_LIST_ITEM_ACTIVATED,
+                self.frame.modify_subscriber_form,
+                self.result_list
+                )
+        self.box.Add(self.result_list)
+        self.add_actions_to_box()
+
+    def add_actions_to_box(self):
+        """Add the buttons acting on the selected subscriber. They are bound
+        once whatever the number of results."""
+        action_box = wx.BoxSizer(wx.HORIZONTAL)
+        modify_button = wx.Button(self, -1, 'Modifier')
+        delete_button = wx.Button(self, -1, 'Supprimer')
+        self.frame.Bind(
+                wx.EVT_BUTTON,
+                self.frame.modify_subscriber_form,
+                id=modify_button.GetId()
+                )
+        self.frame.Bind(
+                wx.EVT_BUTTON,
+                self.frame.delete_subscriber,
+                id=delete_button.GetId()
+                )
+        action_box.Add(modify_button)
+        action_box.Add(delete_button)
+        self.box.Add(action_box)
+
+    def get_selected_subscriber(self):
+        """Return the summary dict of the selected subscriber, None if no
+        subscriber is selected"""
+        return self.result_list.get_selected_subscriber()
+
+class SearchResultList(wx.ListCtrl):
+    """Virtual list displaying the search result. Only the visible rows are
+    asked to the model, which reads them by pages."""
+
+    COLUMNS = [
+            ('lastname', 'Nom', 150),
+            ('firstname', u'Prénom', 150),
+            ('company', u'Société', 200),
+            ]
+
+    def __init__(self, panel, result_model):
+        wx.ListCtrl.__init__(
+                self,
+                panel,
+                -1,
+                size=(520, 400),
+                style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_SINGLE_SEL
+                )
+        self.model = result_model
+        for position, (key, heading, width) in enumerate(self.COLUMNS):
+            self.InsertColumn(position, heading, width=width)
+        self.SetItemCount(result_model.get_count())
+
+    def OnGetItemText(self, item, column):
+        """Called by wx for each visible cell"""
+        subscriber = self.model.get_row(item)
+        if subscriber is None:
+            return ''
+        return subscriber[self.COLUMNS[column][0]]
+
+    def get_selected_subscriber(self):
+        """Return the summary dict of the selected row"""
+        item = self.GetNextItem(-1, wx.LIST_NEXT_ALL, wx.LIST_STATE_SELECTED)
+        if item == -1:
+            return None
+        return self.model.get_row(item)
 
-            self.result_grid.Add(
-                    wx.StaticText(self, -1, subscriber['lastname']),
-                    flag=wx.ALIGN_CENTER_VERTICAL
-                    )
-            self.result_grid.Add(
-                    wx.StaticText(self, -1, subscriber['firstname']),
-                    flag=wx.ALIGN_CENTER_VERTICAL
-                    )
-            self.result_grid.Add(
-                    wx.StaticText(self, -1, subscriber['company']),
-                    flag=wx.ALIGN_CENTER_VERTICAL
-                    )
-            self.result_grid.Add(modify_button, flag=wx.ALIGN_CENTER_VERTICAL)
-            self.result_grid.Add(delete_button, flag=wx.ALIGN_CENTER_VERTICAL)
 #####
 
 class ExporterPanel(wx.Panel):
@@ -307,6 +347,15 @@ class ExporterPanel(wx.Panel):
         hbox.Add(browse_button)
 
         box.Add(hbox)
+        self.presorted_checkbox = wx.CheckBox(self, -1,
+                u'Trier par code postal (avec résumé par département)')
+        box.Add(self.presorted_checkbox)
+        self.sharded_checkbox = wx.CheckBox(self, -1,
+                u'Un fichier par département (avec manifeste)')
+        box.Add(self.sharded_checkbox)
+        self.resubscription_checkbox = wx.CheckBox(self, -1,
+                u'Générer aussi les listes de réabonnement (une seule lecture)')
+        box.Add(self.resubscription_checkbox)
         button_box = wx.BoxSizer(wx.HORIZONTAL)
         ok_button = wx.Button(self, -1, 'Ok')
         button_box.Add(ok_button)
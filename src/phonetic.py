@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''This module computes the French phonetic key of the names, so a name can
+be found from its sound whatever its spelling: Faullummel and Folummel, or
+Gicqueau and Giqueau, have the same key.'''
+
+import re
+
+from transliteration import to_search_key
+
+# Substitutions applied in order on the folded upper case name. Each one
+# replaces the spellings of a sound by one of them.
+RULES = [(re.compile(pattern), replacement) for pattern, replacement in [
+    (r'[^A-Z]', ''),
+    # Silent final X, the other ones are pronounced KS
+    (r'(?<=.)X$', ''),
+    (r'X', 'KS'),
+    # CH and SH sound alike, C and G are soft before E, I and Y
+    (r'S?CH|SH', 'X'),
+    (r'PH', 'F'),
+    (r'BV', 'V'),
+    (r'C(?=[EIY])', 'S'),
+    (r'G(?=[EIY])', 'J'),
+    (r'GU(?=[AEIOY])', 'G'),
+    (r'CQU|QU|CK|CQ|Q|C', 'K'),
+    (r'H', ''),
+    (r'W', 'V'),
+    (r'Z', 'S'),
+    (r'Y', 'I'),
+    # Vowel groups
+    (r'EAU|AU', 'O'),
+    (r'OU', 'U'),
+    (r'[AE]?I[NM](?=[^AEIOU]|$)', 'IN'),
+    (r'AI|EI', 'E'),
+    (r'[AE][NM](?=[^AEIOU]|$)', 'A'),
+    # Silent final letters
+    (r'(?<=.)[DPST]+$', ''),
+    (r'(?<=.)E$', ''),
+    (r'(.)\1+', r'\1'),
+    ]]
+
+def french_phonetic_key(name):
+    """Return the phonetic key of name, None if name is None"""
+    if name is None:
+        return None
+    key = to_search_key(name)
+    for pattern, replacement in RULES:
+        key = pattern.sub(replacement, key)
+    return key
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+import gaabo_conf
+import gaabo_db
+from gaabo_exploit_db import SqliteDbOperator
+
+def main():
+    db_path = os.path.join(gaabo_conf.db_directory, gaabo_conf.db_name)
+    print u'Reconstruction de l\'index de recherche de %s...' % db_path
+
+    start = time.time()
+    conn = gaabo_db.connect(db_path)
+    cursor = conn.cursor()
+    created = SqliteDbOperator().create_full_text_index(cursor)
+    conn.commit()
+    conn.close()
+
+    if created:
+        print u'Fait en %.1f s.' % (time.time() - start)
+    else:
+        print u'ERREUR : sqlite ne gère pas la recherche plein texte (FTS5).'
+
+if __name__ == '__main__':
+    main()
@@ -2,18 +2,28 @@
 # -*- coding: utf-8 -*-
 '''Object to manipulate a subscriber'''
 
-import sqlite3
-import os
 import datetime
+import itertools
+import re
 import gaabo_conf
+import gaabo_db
+from gaabo_exploit_db import SqliteDbOperator
+from transliteration import to_search_key
+from phonetic import french_phonetic_key
+# The date functions used to be defined here
+from gaabo_dates import date_from_iso
+from gaabo_dates import is_correct_date
+from gaabo_dates import cannot_be_formatted
+from gaabo_dates import cannot_create_date
 
 
 class Subscriber(object):
     '''Object to manipulate a subscriber'''
     ISSUES_IN_A_YEAR = 6
 
-    def __init__(self):
-        '''First constructor to create a named subscriber'''
+    def __init__(self, dao=None):
+        '''First constructor to create a named subscriber. The DAO can be
+        given, otherwise it is created when it is needed'''
         self.identifier = -1
         self.lastname = '' 
         self.firstname = ''
@@ -36,7 +46,18 @@ class Subscriber(object):
         self.bank = ''
         self.ordering_type  = ''
         self.mail_sent = 0
-        self.dao = SubscriberDAO()
+        self._dao = dao
+
+    def _get_dao(self):
+        '''Create the DAO on first use'''
+        if self._dao is None:
+            self._dao = SubscriberDAO()
+        return self._dao
+
+    def _set_dao(self, dao):
+        self._dao = dao
+
+    dao = property(_get_dao, _set_dao)
 
     def order_new_subscription(self):
         '''Add a new year of subscription to this subscriber'''
@@ -58,6 +79,63 @@ class Subscriber(object):
         adhoc_dao = SubscriberDAO()
         return adhoc_dao.search_from_email(email)
 
+    @classmethod
+    def get_subscribers_sounding_like(cls, lastname):
+        """Returns the subscribers whose lastname sounds like lastname"""
+        adhoc_dao = SubscriberDAO()
+        return adhoc_dao.search_from_lastname_sound(lastname)
+
+    @classmethod
+    def search_summaries(cls, lastname=None, company=None, email=None,
+            after_id=None, limit=None, sounds_like=False):
+        """Returns the (id, lastname, firstname, company) tuples of the
+        subscribers matching one of the criteria"""
+        adhoc_dao = SubscriberDAO()
+        return adhoc_dao.search_summaries(
+                lastname, company, email, after_id, limit, sounds_like)
+
+    @classmethod
+    def search_summary_id(cls, position, lastname=None, company=None,
+            email=None, sounds_like=False):
+        """Returns the id of the subscriber at position in the result of
+        search_summaries, None if the result is shorter"""
+        adhoc_dao = SubscriberDAO()
+        return adhoc_dao.search_summary_id(
+                position, lastname, company, email, sounds_like)
+
+    @classmethod
+    def count_summaries(cls, lastname=None, company=None, email=None,
+            sounds_like=False):
+        adhoc_dao = SubscriberDAO()
+        return adhoc_dao.count_summaries(lastname, company, email, sounds_like)
+
+    @classmethod
+    def full_text_ids(cls, text):
+        """Returns the ids of the subscribers having all the words of text,
+        best matches first"""
+        adhoc_dao = SubscriberDAO()
+        return adhoc_dao.full_text_ids(text)
+
+    @classmethod
+    def get_summaries(cls, identifiers):
+        """Returns the (id, lastname, firstname, company) tuples of the
+        subscribers, in the order of identifiers"""
+        adhoc_dao = SubscriberDAO()
+        return adhoc_dao.get_summaries(identifiers)
+
+    @classmethod
+    def get_from_id(cls, identifier):
+        """Returns the whole subscriber, None if it does not exist"""
+        adhoc_dao = SubscriberDAO()
+        return adhoc_dao.get_from_id(identifier)
+
+    @classmethod
+    def get_cache(cls):
+        """Returns the cache of the subscribers read by id, its hits and
+        misses attributes count the calls of get_from_id"""
+        adhoc_dao = SubscriberDAO()
+        return adhoc_dao.cache
+
     @classmethod
     def decrement_issues_to_receive(cls):
         adhoc_dao = SubscriberDAO()
@@ -73,11 +151,31 @@ class Subscriber(object):
         adhoc_dao = SubscriberDAO()
         return adhoc_dao.get_end_of_subscribtion()
 
+    @classmethod
+    def get_end_of_subscribtion_records(cls):
+        """Same as get_end_of_subscribtion, with read only SubscriberRecord
+        objects using less memory"""
+        adhoc_dao = SubscriberDAO()
+        return adhoc_dao.get_end_of_subscribtion_records()
+
+    @classmethod
+    def iter_records(cls):
+        """Iterate over all the subscribers as SubscriberRecord objects"""
+        adhoc_dao = SubscriberDAO()
+        return adhoc_dao.iter_records()
+
     @classmethod
     def get_count(cls):
         adhoc_dao = SubscriberDAO()
         return adhoc_dao.get_count()
 
+    @classmethod
+    def get_counts(cls):
+        """Return the dict of the subscriber counters: total, active,
+        special_pending and awaiting_renewal"""
+        adhoc_dao = SubscriberDAO()
+        return adhoc_dao.get_counts()
+
     @classmethod
     def delete_from_id(cls, identifier):
         """Delete a sbscriber from the db using provided id"""
@@ -93,15 +191,37 @@ class Subscriber(object):
         adhoc_dao = SubscriberDAO()
         adhoc_dao.update_mail_sent()
 
+    @classmethod
+    def save_all(cls, subscribers, batch_size=None):
+        """Save a list of subscribers with few transactions. The new
+        subscribers get their generated identifier."""
+        new_subscribers = []
+        known_subscribers = []
+        for subscriber in subscribers:
+            subscriber.update_mail_sent_flag()
+            if subscriber.identifier == -1:
+                new_subscribers.append(subscriber)
+            else:
+                known_subscribers.append(subscriber)
+        adhoc_dao = SubscriberDAO()
+        identifiers = adhoc_dao.save_many(new_subscribers, batch_size)
+        for subscriber, identifier in zip(new_subscribers, identifiers):
+            subscriber.identifier = identifier
+        adhoc_dao.update_many(known_subscribers, batch_size)
+
     def save(self):
-        if self.issues_to_receive > 0 or self.hors_serie1 > 0 :
-            self.mail_sent = 0
+        self.update_mail_sent_flag()
         if self.identifier == -1:
-            self.dao.save(self)
-            self.identifier = self.dao.get_new_subscriber_id()
+            self.identifier = self.dao.save(self)
         else:
             self.dao.update(self)
 
+    def update_mail_sent_flag(self):
+        """A subscriber that has issues to receive must get the next
+        re-subscription mail"""
+        if self.issues_to_receive > 0 or self.hors_serie1 > 0 :
+            self.mail_sent = 0
+
     def delete(self):
         self.dao.delete(self.identifier)
 
@@ -120,6 +240,8 @@ class Subscriber(object):
 class Address(object):
     """Class that represent the subscriber address. It's a simple data
     structure"""
+    __slots__ = ('address1', 'address2', 'post_code', 'city')
+
     def __init__(self):
         self.address1 = ''
         self.address2 = ''
@@ -129,43 +251,395 @@ class Address(object):
     def to_tuple(self):
         return (self.address1, self.address2, self.post_code, self.city)
 
+def _row_field(position):
+    """Property reading a column of the row of a SubscriberRecord"""
+    return property(lambda record: record.row[position])
+
+class SubscriberRecord(object):
+    """Read only view of a row of SubscriberDAO.SELECT_COLUMNS with the
+    attributes of a Subscriber. It only keeps the row, the address and the
+    date are decoded when they are read. It is used when many subscribers are
+    read at once, to_subscriber gives a Subscriber that can be modified."""
+    __slots__ = ('row', )
+
+    identifier = _row_field(0)
+    lastname = _row_field(1)
+    firstname = _row_field(2)
+    company = _row_field(3)
+    name_addition = _row_field(4)
+    email_address = _row_field(9)
+    subscriber_since_issue = _row_field(10)
+    issues_to_receive = _row_field(12)
+    subs_beginning_issue = _row_field(13)
+    member = _row_field(14)
+    subscription_price = _row_field(15)
+    membership_price = _row_field(16)
+    hors_serie1 = _row_field(17)
+    hors_serie2 = _row_field(18)
+    hors_serie3 = _row_field(19)
+    sticker_sent = _row_field(20)
+    comment = _row_field(21)
+    bank = _row_field(22)
+    ordering_type = _row_field(23)
+    mail_sent = _row_field(24)
+
+    def __init__(self, row):
+        self.row = row
+
+    @property
+    def address(self):
+        address = Address()
+        address.address1 = self.row[5]
+        address.address2 = self.row[6]
+        address.post_code = self.row[7]
+        address.city = self.row[8]
+        return address
+
+    @property
+    def subscription_date(self):
+        return date_from_iso(self.row[11])
+
+    def to_subscriber(self, dao=None):
+        """Return the Subscriber of the row"""
+        sub = Subscriber(dao)
+        sub.identifier = self.identifier
+        sub.lastname = self.lastname
+        sub.firstname = self.firstname
+        sub.company = self.company
+        sub.name_addition = self.name_addition
+        sub.address = self.address
+        sub.email_address = self.email_address
+        sub.subscriber_since_issue = self.subscriber_since_issue
+        sub.subscription_date = self.subscription_date
+        sub.issues_to_receive = self.issues_to_receive
+        sub.subs_beginning_issue = self.subs_beginning_issue
+        sub.member = self.member
+        sub.subscription_price = self.subscription_price
+        sub.membership_price = self.membership_price
+        sub.hors_serie1 = self.hors_serie1
+        sub.sticker_sent = self.sticker_sent
+        sub.comment = self.comment
+        sub.ordering_type = self.ordering_type
+        sub.mail_sent = self.mail_sent
+        return sub
+
 ################################################################################
 
 class SubscriberDAO(object):
     '''Data Access Object that acts with Subscribers from a DB'''
 
-    def __init__(self):
-        '''Initialise the dao with a database connection'''
+    # The columns are selected in the table order. The remaining issues are
+    # computed from the last issue of the subscription and the issue counter.
+    SELECT_COLUMNS = """SELECT subscribers.id, lastname, firstname, company,
+        name_addition, address, address_addition, post_code, city,
+        email_address, subscriber_since_issue, subscription_date,
+        MAX(last_issue - regular_issue, 0),
+        subs_beginning_issue, member, subscription_price, membership_price,
+        MAX(last_special_issue - special_issue, 0),
+        hors_serie2, hors_serie3, sticker_sent, comment, bank, ordering_type,
+        mail_sent"""
+    SELECT_SUBSCRIBERS = SELECT_COLUMNS + """
+        FROM subscribers, issue_counter"""
+
+    # Only the columns displayed in the search results
+    SELECT_SUMMARIES = """SELECT id, lastname, firstname, company
+        FROM subscribers"""
+
+    # The lastname and company are searched through their folded keys, so
+    # the case and the accents are ignored. The searches are written so that
+    # sqlite uses the indexes of the keys: the prefix is looked up as a
+    # range, LIKE only keeps the exact semantic.
+    LASTNAME_CONDITION = """
+        WHERE lastname_key >= ?
+        AND lastname_key < ?
+        AND lastname_key LIKE ?"""
+    COMPANY_CONDITION = """
+        WHERE company_key >= ?
+        AND company_key < ?
+        AND company_key LIKE ?"""
+    EMAIL_CONDITION = """
+        WHERE email_address = ? COLLATE NOCASE"""
+    # The "sounds like" search looks the phonetic key up in its index
+    LASTNAME_SOUND_CONDITION = """
+        WHERE lastname_phonetic = ?"""
+    LASTNAME_SEARCH = SELECT_SUBSCRIBERS + LASTNAME_CONDITION
+    COMPANY_SEARCH = SELECT_SUBSCRIBERS + COMPANY_CONDITION
+    EMAIL_SEARCH = SELECT_SUBSCRIBERS + EMAIL_CONDITION
+    LASTNAME_SOUND_SEARCH = SELECT_SUBSCRIBERS + LASTNAME_SOUND_CONDITION
+    # The free text search reads the full text index. bm25 ranks the
+    # matches, the identity columns weigh more than the address and the
+    # comment. The weights follow SqliteDbOperator.FULL_TEXT_COLUMNS.
+    FULL_TEXT_SEARCH = """SELECT rowid FROM subscribers_fts
+        WHERE subscribers_fts MATCH ?
+        ORDER BY bm25(subscribers_fts, 10.0, 5.0, 10.0, 2.0, 3.0, 3.0, 5.0,
+            1.0), rowid"""
+    # The full text index is only created when sqlite has FTS5
+    FULL_TEXT_TABLE = 'subscribers_fts'
+    FULL_TEXT_TABLE_QUERY = """SELECT COUNT(*) FROM sqlite_master
+        WHERE type = 'table' AND name = ?"""
+    ID_SEARCH = SELECT_SUBSCRIBERS + """
+        WHERE subscribers.id = ?"""
+    STATS_COLUMNS = ('total', 'active', 'special_pending', 'awaiting_renewal')
+    STATS_QUERY = """SELECT %s FROM subscriber_stats""" % (
+            ', '.join(STATS_COLUMNS))
+    END_OF_SUBSCRIBTION_QUERY = SELECT_COLUMNS + """
+        FROM subscribers INDEXED BY subscribers_issue_address_idx,
+        issue_counter
+        WHERE last_issue < (SELECT regular_issue FROM issue_counter) + 2
+        ORDER BY subscribers.id"""
+    INSERT_QUERY = """INSERT INTO subscribers (
+        lastname, firstname, company,
+        name_addition, address, address_addition, post_code, city,
+        email_address, subscriber_since_issue, subscription_date, last_issue,
+        subs_beginning_issue, member, subscription_price,
+        membership_price, last_special_issue, hors_serie2, hors_serie3,
+        sticker_sent, comment, bank, ordering_type, mail_sent,
+        lastname_key, company_key, lastname_phonetic, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+        ? + (SELECT regular_issue FROM issue_counter),
+        ?, ?, ?, ?,
+        ? + (SELECT special_issue FROM issue_counter),
+        ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+        strftime('%Y-%m-%d %H:%M:%f', 'now'))"""
+    UPDATE_QUERY = """UPDATE subscribers
+        SET
+        lastname = ?,
+        firstname = ?,
+        company = ?,
+        name_addition = ?,
+        address = ?,
+        address_addition = ?,
+        post_code = ?,
+        city = ?,
+        email_address = ?,
+        subscriber_since_issue = ?,
+        subscription_date = ?,
+        last_issue = ? + (SELECT regular_issue FROM issue_counter),
+        subs_beginning_issue = ?,
+        member = ?,
+        subscription_price = ?,
+        membership_price = ?,
+        last_special_issue = ? + (SELECT special_issue FROM issue_counter),
+        hors_serie2 = ?,
+        hors_serie3 = ?,
+        sticker_sent = ?,
+        comment = ?,
+        bank = ?,
+        ordering_type = ?,
+        mail_sent = ?,
+        lastname_key = ?,
+        company_key = ?,
+        lastname_phonetic = ?,
+        updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+        WHERE id = ?
+        """
 
-        self.db_full_path = os.path.join(gaabo_conf.db_directory, gaabo_conf.db_name)
-        self.conn = sqlite3.Connection(self.db_full_path)
+    # Name of the cache of the subscribers read by id in gaabo_db
+    CACHE_NAME = 'subscribers'
+    # Name of the cache of the full text index presence in gaabo_db
+    FULL_TEXT_CACHE_NAME = 'full_text_index'
+
+    def __init__(self, conn=None, cache=None):
+        '''Initialise the dao with a database connection. The connection of
+        the current thread is reused when none is given. The cache is the
+        identity map of the subscribers read by id, shared by all the DAOs of
+        the database.'''
+
+        if conn is None:
+            conn = gaabo_db.get_connection()
+        if cache is None:
+            cache = gaabo_db.get_cache(
+                    self.CACHE_NAME,
+                    gaabo_conf.subscriber_cache_size
+                    )
+        self.conn = conn
         self.cursor = self.conn.cursor()
+        self.cache = cache
 
     def search_from_lastname(self, lastname):
         '''Return a list of subs from a search in the DB based on a lastname'''
 
-        sql = """SELECT * FROM subscribers
-        WHERE lower(lastname) LIKE lower(?)"""
-        self.result = self.cursor.execute(sql, (lastname + '%', ))
+        self.result = self.cursor.execute(
+                self.LASTNAME_SEARCH,
+                prefix_search_parameters(lastname)
+                )
         return self.fetch_result()
 
     def search_from_company(self, company):
         '''Return a list of subs from a search in the DB based on a company'''
 
-        sql = """SELECT * FROM subscribers
-        WHERE lower(company) LIKE lower(?)"""
-        self.result = self.cursor.execute(sql, (company + '%', ))
+        self.result = self.cursor.execute(
+                self.COMPANY_SEARCH,
+                prefix_search_parameters(company)
+                )
         return self.fetch_result()
 
     def search_from_email(self, email):
         """Return a list of subscribers from a search in the DB based on the
         email address. *Warning:* only EXACT matches are returned"""
 
-        sql = """SELECT * FROM subscribers WHERE lower(email_address) =
-        lower(?)"""
-        self.result = self.cursor.execute(sql, (email, ))
+        self.result = self.cursor.execute(self.EMAIL_SEARCH, (email, ))
+        return self.fetch_result()
+
+    def search_from_lastname_sound(self, lastname):
+        """Return the subscribers whose lastname has the same French phonetic
+        key as lastname"""
+        self.result = self.cursor.execute(
+                self.LASTNAME_SOUND_SEARCH,
+                (french_phonetic_key(lastname), )
+                )
         return self.fetch_result()
 
+    def search_summaries(self, lastname=None, company=None, email=None,
+            after_id=None, limit=None, sounds_like=False):
+        """Return the (id, lastname, firstname, company) tuples of the
+        subscribers matching one of the given criteria, ordered by id. The
+        criteria are searched in one query: each one uses its index and the
+        UNION removes the subscribers found several times. Only the
+        subscribers with an id greater than after_id are returned, at most
+        limit of them, so the result can be read by pages. With sounds_like,
+        the lastname is searched by its phonetic key instead of its
+        prefix."""
+        sql, parameters = self.compile_summary_search(
+                lastname, company, email, after_id, sounds_like)
+        if sql is None:
+            return []
+        sql += '\n        ORDER BY id'
+        if limit is not None:
+            sql += '\n        LIMIT ?'
+            parameters.append(limit)
+        return self.cursor.execute(sql, parameters).fetchall()
+
+    def search_summary_id(self, position, lastname=None, company=None,
+            email=None, sounds_like=False):
+        """Return the id of the subscriber at position in the result of
+        search_summaries, None if the result is shorter. A page far in the
+        result starts after this id without reading the previous pages."""
+        sql, parameters = self.compile_summary_search(
+                lastname, company, email, None, sounds_like)
+        if sql is None:
+            return None
+        sql = 'SELECT id FROM (%s)\n        ORDER BY id LIMIT 1 OFFSET ?' % sql
+        parameters.append(position)
+        row = self.cursor.execute(sql, parameters).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def count_summaries(self, lastname=None, company=None, email=None,
+            sounds_like=False):
+        """Return the number of subscribers matching one of the criteria"""
+        sql, parameters = self.compile_summary_search(
+                lastname, company, email, None, sounds_like)
+        if sql is None:
+            return 0
+        sql = 'SELECT COUNT(*) FROM (%s)' % sql
+        return self.cursor.execute(sql, parameters).fetchone()[0]
+
+    def compile_summary_search(self, lastname=None, company=None, email=None,
+            after_id=None, sounds_like=False):
+        """Return the UNION query and parameters of search_summaries, None as
+        query if there is no criteria"""
+        criteria = []
+        if lastname and sounds_like:
+            criteria.append((self.LASTNAME_SOUND_CONDITION,
+                (french_phonetic_key(lastname), )))
+        elif lastname:
+            criteria.append(
+                    (self.LASTNAME_CONDITION, prefix_search_parameters(lastname))
+                    )
+        if company:
+            criteria.append(
+                    (self.COMPANY_CONDITION, prefix_search_parameters(company))
+                    )
+        if email:
+            criteria.append((self.EMAIL_CONDITION, (email, )))
+        queries = []
+        parameters = []
+        for condition, condition_parameters in criteria:
+            query = self.SELECT_SUMMARIES + condition
+            parameters.extend(condition_parameters)
+            if after_id is not None:
+                query += '\n        AND id > ?'
+                parameters.append(after_id)
+            queries.append(query)
+        if not queries:
+            return None, parameters
+        sql = '\n        UNION\n        '.join(queries)
+        return sql, parameters
+
+    def full_text_ids(self, text):
+        """Return the ids of the subscribers having all the words of text, as
+        word prefixes, in one of the indexed columns. The best matches come
+        first. Without the full text index, the columns are scanned and the
+        ids are in their order. The ranking sorts every match, so the ids
+        are read once and the pages with get_summaries."""
+        words = full_text_words(text)
+        if not words:
+            return []
+        if self.has_full_text_index():
+            rows = self.cursor.execute(
+                    self.FULL_TEXT_SEARCH, (full_text_query(words), ))
+        else:
+            sql, parameters = self.compile_full_text_scan(words)
+            sql = 'SELECT id FROM subscribers' + sql + """
+        ORDER BY id"""
+            rows = self.cursor.execute(sql, parameters)
+        return [row[0] for row in rows]
+
+    def get_summaries(self, identifiers):
+        """Return the (id, lastname, firstname, company) tuples of the
+        subscribers, in the order of identifiers. The deleted subscribers
+        are skipped."""
+        if not identifiers:
+            return []
+        sql = self.SELECT_SUMMARIES + """
+        WHERE id IN (%s)""" % ', '.join(['?'] * len(identifiers))
+        summaries = dict((row[0], row)
+                for row in self.cursor.execute(sql, list(identifiers)))
+        return [summaries[identifier] for identifier in identifiers
+                if identifier in summaries]
+
+    def has_full_text_index(self):
+        """Return True if the database has the full text index. It is looked
+        up once, then kept with the connections of the database."""
+        cache = gaabo_db.get_cache(self.FULL_TEXT_CACHE_NAME, 1)
+        present = cache.get(self.FULL_TEXT_TABLE)
+        if present is None:
+            present = self.cursor.execute(
+                    self.FULL_TEXT_TABLE_QUERY, (self.FULL_TEXT_TABLE, )
+                    ).fetchone()[0] > 0
+            cache.put(self.FULL_TEXT_TABLE, present)
+        return present
+
+    def compile_full_text_scan(self, words):
+        """Return the WHERE clause and parameters finding the words in the
+        indexed columns without the full text index. The wildcards of the
+        words are escaped."""
+        conditions = []
+        parameters = []
+        for word in words:
+            conditions.append('(%s)' % ' OR '.join(
+                "%s LIKE ? ESCAPE '\\'" % column
+                for column in SqliteDbOperator.FULL_TEXT_COLUMNS))
+            parameters.extend(['%' + escape_like(word) + '%']
+                    * len(SqliteDbOperator.FULL_TEXT_COLUMNS))
+        return '\n        WHERE ' + ' AND '.join(conditions), parameters
+
+    def get_from_id(self, identifier):
+        """Return the subscriber with the given id, None if it does not
+        exist. The subscriber is kept in the cache until it is modified, so
+        the same object is returned by the next calls."""
+        sub = self.cache.get(identifier)
+        if sub is not None:
+            return sub
+        self.result = self.cursor.execute(self.ID_SEARCH, (identifier, ))
+        sublist = self.fetch_result()
+        if sublist:
+            self.cache.put(identifier, sublist[0])
+            return sublist[0]
+        return None
+
     def get_new_subscriber_id(self):
         """Get the ID of last inserted subscriber"""
         sql = "SELECT seq FROM SQLITE_SEQUENCE WHERE name='subscribers'"
@@ -175,160 +649,175 @@ class SubscriberDAO(object):
 
     def fetch_result(self):
         '''Fetch class variable result into a list of Subscriber'''
-        sublist = []
-        for row in self.result:
-            sub = Subscriber()
-            address = Address()
-            sub.identifier = row[0]
-            sub.lastname = row[1]
-            sub.firstname = row[2]
-            sub.company = row[3]
-            sub.name_addition = row[4]
-            address.address1 = row[5]
-            address.address2 = row[6]
-            address.post_code = row[7]
-            address.city = row[8]
-            sub.email_address = row[9] 
-            sub.subscriber_since_issue = row[10] 
-            iso_date_string = row[11]
-            sub.issues_to_receive = row[12] 
-            sub.subs_beginning_issue = row[13] 
-            sub.member = row[14] 
-            sub.subscription_price = row[15] 
-            sub.membership_price = row[16]
-            sub.hors_serie1 = row[17]
-            sub.sticker_sent = row[20]
-            sub.comment = row[21]
-            sub.ordering_type = row[23]
-            sub.mail_sent = row[24]
-            
-            sub.subscription_date = date_from_iso(iso_date_string)
-            sub.address = address
-            sublist.append(sub)
-        return sublist
-
+        return [SubscriberRecord(row).to_subscriber(self)
+                for row in self.result]
+
+    def fetch_records(self):
+        """Fetch class variable result into a list of SubscriberRecord"""
+        return [SubscriberRecord(row) for row in self.result]
+
+    def iter_records(self):
+        """Generator of the SubscriberRecord of all the subscribers, read by
+        chunks of gaabo_conf.db_batch_size rows"""
+        cursor = self.conn.cursor()
+        cursor.execute(self.SELECT_SUBSCRIBERS + """
+        ORDER BY subscribers.id""")
+        rows = cursor.fetchmany(gaabo_conf.db_batch_size)
+        while rows:
+            for row in rows:
+                yield SubscriberRecord(row)
+            rows = cursor.fetchmany(gaabo_conf.db_batch_size)
 
     def save(self, subscriber):
-        sql = """INSERT INTO subscribers (
-        lastname, firstname, company,
-        name_addition, address, address_addition, post_code, city,
-        email_address, subscriber_since_issue, subscription_date, issues_to_receive,
-        subs_beginning_issue, member, subscription_price,
-        membership_price, hors_serie1, hors_serie2, hors_serie3,
-        sticker_sent, comment, bank, ordering_type, mail_sent)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
-        ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
-        self.cursor.execute(sql, subscriber.get_attribute_sequence())
+        """Insert the subscriber and return its generated id"""
+        self.cursor.execute(self.INSERT_QUERY,
+                self.get_insert_sequence(subscriber))
         self.conn.commit()
+        return self.cursor.lastrowid
 
     def update(self, subscriber):
-        sql = """UPDATE subscribers
-        SET
-        lastname = ?,
-        firstname = ?,
-        company = ?,
-        name_addition = ?,
-        address = ?,
-        address_addition = ?,
-        post_code = ?,
-        city = ?,
-        email_address = ?,
-        subscriber_since_issue = ?,
-        subscription_date = ?,
-        issues_to_receive = ?,
-        subs_beginning_issue = ?,
-        member = ?,
-        subscription_price = ?,
-        membership_price = ?,
-        hors_serie1 = ?,
-        hors_serie2 = ?,
-        hors_serie3 = ?,
-        sticker_sent = ?,
-        comment = ?,
-        bank = ?,
-        ordering_type = ?,
-        mail_sent = ?
-        WHERE id = ?
-        """
-        self.cursor.execute(
-                sql,
-                subscriber.get_attribute_sequence() +
-                (subscriber.identifier,))
+        self.cursor.execute(self.UPDATE_QUERY,
+                self.get_update_sequence(subscriber))
         self.conn.commit()
+        self.cache.remove(subscriber.identifier)
+
+    def save_many(self, subscribers, batch_size=None):
+        """Insert the subscribers by chunks of batch_size rows. Each chunk is
+        written in one transaction, which is rolled back if it fails. Returns
+        the list of generated ids."""
+        identifiers = []
+        for chunk in chunks(subscribers, batch_size):
+            with self.conn:
+                self.cursor.executemany(
+                        self.INSERT_QUERY,
+                        [self.get_insert_sequence(sub) for sub in chunk]
+                        )
+                last_identifier = self.get_new_subscriber_id()
+            # The transaction holds the write lock and ids are autoincremented
+            # so the chunk got consecutive ids
+            identifiers.extend(
+                    range(last_identifier - len(chunk) + 1,
+                        last_identifier + 1)
+                    )
+        return identifiers
+
+    def update_many(self, subscribers, batch_size=None):
+        """Update the subscribers by chunks of batch_size rows, each chunk in
+        one transaction"""
+        for chunk in chunks(subscribers, batch_size):
+            with self.conn:
+                self.cursor.executemany(
+                        self.UPDATE_QUERY,
+                        [self.get_update_sequence(sub) for sub in chunk]
+                        )
+            for sub in chunk:
+                self.cache.remove(sub.identifier)
+
+    def get_insert_sequence(self, subscriber):
+        """Return the parameters of INSERT_QUERY for subscriber: its
+        attributes and the keys of its searched columns"""
+        return subscriber.get_attribute_sequence() + (
+                to_search_key(subscriber.lastname),
+                to_search_key(subscriber.company),
+                french_phonetic_key(subscriber.lastname))
+
+    def get_update_sequence(self, subscriber):
+        """Return the parameters of UPDATE_QUERY for subscriber"""
+        return self.get_insert_sequence(subscriber) + (subscriber.identifier,)
 
     def delete(self, identifier):
         sql = """DELETE FROM subscribers WHERE id = ?"""
         self.cursor.execute(sql, (identifier, ))
         self.conn.commit()
+        self.cache.remove(identifier)
         
     def decrement_issues_to_receive(self):
-        sql = """UPDATE subscribers
-        SET issues_to_receive = issues_to_receive - 1
-        WHERE issues_to_receive > 0"""
-        self.cursor.execute(sql)
-        self.conn.commit()
+        """Ship a regular issue: every subscriber has one issue less to
+        receive"""
+        self.common_decrementor('regular_issue')
+        self.cache.remove_if(lambda sub: sub.issues_to_receive > 0)
 
     def decrement_special_issues_to_receive(self):
-        sql = """UPDATE subscribers
-        SET hors_serie1 = hors_serie1 - 1
-        WHERE hors_serie1 > 0"""
+        """Ship a special issue"""
+        self.common_decrementor('special_issue')
+        self.cache.remove_if(lambda sub: sub.hors_serie1 > 0)
+
+    def common_decrementor(self, counter_name):
+        """Increment the issue counter. The subscribers rows are untouched,
+        the delta export finds the ones whose remaining issues changed from
+        the counter it saved."""
+        sql = """UPDATE issue_counter SET %s = %s + 1""" % (
+                counter_name,
+                counter_name
+                )
         self.cursor.execute(sql)
         self.conn.commit()
 
-    def common_decrementor(self, field_name):
-        pass
-
     def get_end_of_subscribtion(self):
-        sql = """SELECT * FROM subscribers WHERE issues_to_receive < 2"""
-        self.result = self.cursor.execute(sql)
+        self.result = self.cursor.execute(self.END_OF_SUBSCRIBTION_QUERY)
         return self.fetch_result()
 
+    def get_end_of_subscribtion_records(self):
+        """Same as get_end_of_subscribtion with SubscriberRecord objects"""
+        self.result = self.cursor.execute(self.END_OF_SUBSCRIBTION_QUERY)
+        return self.fetch_records()
+
     def get_count(self):
-        sql = """SELECT COUNT(*) FROM subscribers"""
-        result = self.cursor.execute(sql)
-        for row in result: return row[0]
+        return self.get_counts()['total']
+
+    def get_counts(self):
+        """Read the counters maintained by the triggers of the
+        subscriber_stats table"""
+        row = self.cursor.execute(self.STATS_QUERY).fetchone()
+        return dict(zip(self.STATS_COLUMNS, row))
 
     def update_mail_sent(self):
-        sql = """UPDATE subscribers SET mail_sent = 1 WHERE issues_to_receive = 0"""
+        sql = """UPDATE subscribers SET mail_sent = 1,
+        updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+        WHERE last_issue <= (SELECT regular_issue FROM issue_counter)
+        AND mail_sent IS NOT 1"""
         self.cursor.execute(sql)
         self.conn.commit()
+        self.cache.remove_if(
+                lambda sub: sub.issues_to_receive == 0 and sub.mail_sent != 1)
 
 # Module Functions
-# TODO extract ! Subscriber does not care about this date stuff!
-
-def date_from_iso(iso_date_string):
-    default_date = datetime.date(1900, 01, 01)
-    if iso_date_string is None:
-        return default_date
-    (year, month, day) = iso_date_string.split('-')
-    if is_correct_date(year, month, day):
-        return datetime.date(int(year), int(month), int(day))
-    else:
-        return default_date
-
-def is_correct_date(year, month, day):
-    # TODO this can be reused in the UI
-    """Show is the year can be transforme to a datetime.date and formatted"""
-
-    if cannot_be_formatted(year):
-        return False
-    elif cannot_create_date(year, month, day):
-        return False
-    else:
-        return True
-
-def cannot_be_formatted(year):
-    """Years bellow 1900 cannot be formatted by strftime"""
-    if str(year).isdigit() and int(year) < 1900:
-        return True
-    else:
-        return False
-
-def cannot_create_date(year, month, day):
-    """Try to create a date to check that the params are correct"""
-    try:
-        datetime.date(int(year), int(month), int(day))
-        return False
-    except:
-        return True
 
+def chunks(iterable, size=None):
+    """Split the iterable into lists of size items. The default size is
+    gaabo_conf.db_batch_size."""
+    if size is None:
+        size = gaabo_conf.db_batch_size
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+def prefix_search_parameters(prefix):
+    """Return the parameters of a prefix search in a key column: the range
+    bounds of the index lookup and the LIKE pattern, folded like the keys.
+    The range stops at the first wildcard typed by the user."""
+    prefix = to_search_key(prefix)
+    fixed_part = prefix
+    for wildcard in ('%', '_'):
+        if wildcard in fixed_part:
+            fixed_part = fixed_part[:fixed_part.find(wildcard)]
+    return (fixed_part, fixed_part + u'\U0010ffff', prefix + '%')
+
+def escape_like(text):
+    """Escape the LIKE wildcards of text with a backslash"""
+    for character in ('\\', '%', '_'):
+        text = text.replace(character, '\\' + character)
+    return text
+
+def full_text_words(text):
+    """Split the typed text in words. The punctuation is ignored, like the
+    full text index does."""
+    return re.findall(r'\w+', text, re.UNICODE)
+
+def full_text_query(words):
+    """Return the MATCH expression of the subscribers having all the words,
+    each one as a prefix. The words are quoted, so what the user typed is
+    never read as FTS5 syntax."""
+    return u' '.join([u'"%s"*' % word for word in words])
@@ -5,20 +5,20 @@ routage, checks,...'''
 
 import os
 import sqlite3
-import sys
-import codecs
-import unicodedata
+import io
+import itertools
+import multiprocessing
 import gaabo_conf
+import gaabo_db
+from gaabo_dates import french_date_from_iso
+from gaabo_tasks import TaskCancelled
+from transliteration import to_routing_ascii
 
 # Module functions definitions
 
 def date_string_from_iso(iso_date_string):
-    if iso_date_string is not None:
-        items = iso_date_string.split('-')
-        items.reverse()
-        return '/'.join(items)
-    else:
-        return None
+    """Format a date read in the database as dd/mm/YYYY"""
+    return french_date_from_iso(iso_date_string)
 
 
 def format_postcode(postcode):
@@ -31,41 +31,247 @@ def format_postcode(postcode):
     except TypeError:
         return ''
 
+def department_from_postcode(postcode):
+    """Return the department of a post code: its first 2 digits, 3 for the
+    overseas departments, and 2A or 2B in Corsica"""
+    postcode = format_postcode(postcode)
+    if postcode[0:2] == '20':
+        if postcode < '20200':
+            return '2A'
+        return '2B'
+    if postcode[0:2] in ('97', '98'):
+        return postcode[0:3]
+    return postcode[0:2]
+
+def routage_zones():
+    """Return the (zone, lowest post code, post code after the zone) of the
+    zones of the sharded routing export, in the order of the post codes. The
+    zones are the departments, and cover every post code: the first one
+    also has the missing post codes and the last one ends with no bound."""
+    zones = [('00', None, 1000)]
+    for number in range(1, 97):
+        if number == 20:
+            zones.append(('2A', 20000, 20200))
+            zones.append(('2B', 20200, 21000))
+        else:
+            zones.append(('%02d' % number, number * 1000, (number + 1) * 1000))
+    for number in range(970, 990):
+        zones.append(('%d' % number, number * 100, (number + 1) * 100))
+    zones.append(('99', 99000, None))
+    return zones
+
+def zone_condition(lower, upper):
+    """Return the condition and the parameters selecting the post codes from
+    lower to upper excluded. None is no bound."""
+    if lower is None:
+        return '(post_code IS NULL OR post_code < ?)', (upper,)
+    if upper is None:
+        return 'post_code >= ?', (lower,)
+    return 'post_code >= ? AND post_code < ?', (lower, upper)
+
+def export_routage_zone(arguments):
+    """Write the routing file of a zone and return its number of lines. The
+    file is removed if the zone has no line. It runs in the processes of the
+    pool of ShardedRoutageExporter, with its own read-only connection."""
+    db_path, file_path, query, parameters = arguments
+    exporter = RoutageExporter(file_path)
+    exporter.conn = gaabo_db.connect_read_only(db_path)
+    line_count = [0]
+    def format_row(row):
+        line_count[0] += 1
+        return exporter.format_row(row)
+    try:
+        exporter.write_query(query, format_row, parameters)
+    finally:
+        exporter.close_resources()
+    if line_count[0] == 0:
+        os.remove(file_path)
+    return line_count[0]
+
+# Predicates used by the sinks of the IssueExporter. They mirror the WHERE
+# clauses of the exporters queries.
+
+def has_regular_issue(row):
+    """The subscriber will receive the next regular issue"""
+    return row['last_issue'] > row['regular_issue']
+
+def has_special_issue(row):
+    """The subscriber will receive the next special issue"""
+    return row['last_special_issue'] > row['special_issue']
+
+def is_ending(row):
+    """The subscriber has no regular issue left to receive"""
+    return row['last_issue'] <= row['regular_issue']
+
+def is_resubscribing(row):
+    """The subscription is over and the paper mail was not sent yet"""
+    return is_ending(row) and row['mail_sent'] == 0
+
+def is_resubscribing_by_email(row):
+    """The subscription is over and the subscriber has an email address,
+    neither empty nor NULL"""
+    return is_ending(row) and bool(row['email_address'])
+
+def accept_all(row):
+    """Every subscriber is exported"""
+    return True
+
+class ExportSink(object):
+    """Receives the rows of an IssueExporter. The rows accepted by the
+    predicate are given to format_row with the columns in the order the
+    exporter reads them. The lines are given to write_lines by chunks of
+    chunk_size lines."""
+
+    def __init__(self, columns, predicate, format_row, write_lines,
+            write_header=None, close=None, chunk_size=None, discard=None):
+        self.columns = columns
+        self.predicate = predicate
+        self.format_row = format_row
+        self.write_lines = write_lines
+        self.write_header = write_header
+        self.close = close
+        self.discard = discard
+        if chunk_size is None:
+            chunk_size = gaabo_conf.export_chunk_size
+        self.chunk_size = chunk_size
+        self.positions = None
+        self.lines = []
+
+    def bind(self, column_names):
+        """Compute the position of the sink columns in the rows of the
+        query"""
+        self.positions = [column_names.index(column)
+                for column in self.columns]
+
+    def start(self):
+        """Called before the first row is received"""
+        if self.write_header is not None:
+            self.write_header()
+
+    def receive(self, row):
+        """Format the row if the sink is interested in it"""
+        if self.predicate(row):
+            self.lines.append(self.format_row(tuple([row[position]
+                for position in self.positions])))
+            if len(self.lines) >= self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        """Write the pending lines"""
+        if self.lines:
+            self.write_lines(self.lines)
+            self.lines = []
+
+    def cancel(self):
+        """Drop the pending lines and remove the file, the export was
+        cancelled"""
+        self.lines = []
+        if self.discard is not None:
+            self.discard()
+
+    def finish(self):
+        """Called after the last row"""
+        try:
+            self.flush()
+        finally:
+            if self.close is not None:
+                self.close()
+
 class AbstractExporter(object):
-    """Object parent of all the exporters. It's useless to instanciate it"""
-    def __init__(self, file_path):
+    """Object parent of all the exporters. It's useless to instanciate it.
+    The connection is only opened when a query is run, so an exporter used as
+    a sink of an IssueExporter never opens one.
+    The rows are fetched and written by chunks of gaabo_conf.export_chunk_size
+    rows, in a file buffered with gaabo_conf.export_buffer_size bytes, so the
+    memory used does not depend on the number of rows.
+    When a gaabo_tasks.TaskProgress is given, it is advanced after each chunk
+    and the partial file is removed if the task is cancelled."""
+    def __init__(self, file_path=None, progress=None):
         self.db_file = os.path.join(gaabo_conf.db_directory, gaabo_conf.db_name)
-        self.file_pointer = codecs.open(file_path, 'w', 'utf-8')
-        self.conn = sqlite3.Connection(self.db_file)
+        self.chunk_size = gaabo_conf.export_chunk_size
+        self.file_path = file_path
+        self.progress = progress
+        self.file_pointer = None
+        if file_path is not None:
+            self.file_pointer = io.open(
+                    file_path,
+                    'w',
+                    encoding='utf-8',
+                    newline='',
+                    buffering=gaabo_conf.export_buffer_size
+                    )
+        self._conn = None
+
+    def _get_conn(self):
+        if self._conn is None:
+            self._conn = gaabo_db.connect(self.db_file)
+        return self._conn
+
+    def _set_conn(self, conn):
+        self._conn = conn
+
+    conn = property(_get_conn, _set_conn)
+
+    def write_query(self, query, format_row, parameters=()):
+        """Write in the file the lines returned by format_row for each row of
+        the query"""
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(query, parameters)
+            rows = cursor.fetchmany(self.chunk_size)
+            while rows:
+                self.write_lines([format_row(row) for row in rows])
+                if self.progress is not None:
+                    self.progress.advance(len(rows))
+                rows = cursor.fetchmany(self.chunk_size)
+        except TaskCancelled:
+            self.discard()
+            raise
+
+    def write_lines(self, lines):
+        """Write a chunk of lines with a single call"""
+        self.file_pointer.write(u''.join(lines))
 
     def close_resources(self):
         """Close resources used to generate the file"""
-        self.conn.close()
-        self.file_pointer.close()
-
-class RoutageExporter(AbstractExporter):
-    """This class exports the DB in the format expected by the routing service.
-    Only the subscribers that have issues to receive are exported. It works for
-    regular and special issues."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self.file_pointer is not None:
+            self.file_pointer.close()
+
+    def discard(self):
+        """Close the resources and remove the partial file"""
+        self.close_resources()
+        if self.file_path is not None and os.path.isfile(self.file_path):
+            os.remove(self.file_path)
+
+class SinkExporterMixin(object):
+    """Mixin of the exporters whose file can be written from the rows of an
+    IssueExporter. The exporter lists the COLUMNS its format_row reads and
+    its get_sink returns the sink made by make_sink."""
+
+    def make_sink(self, predicate, format_row, write_header=None):
+        """Return a sink writing the rows accepted by predicate in the file
+        of this exporter"""
+        return ExportSink(
+                self.COLUMNS,
+                predicate,
+                format_row,
+                self.write_lines,
+                write_header,
+                self.close_resources,
+                self.chunk_size,
+                self.discard
+                )
+
+class AbstractRoutageExporter(AbstractExporter):
+    """Writes the subscribers in the format expected by the routing service.
+    The subclasses give the queries of the regular and special issues, which
+    select the COLUMNS of RoutageExporter."""
 
     OUTPUT_LEFT_PADDING = 2
     OUTPUT_RIGHT_PADDING = 6
-    QUERY_BASE = """SELECT
-            lastname,
-            firstname,
-            company,
-            name_addition,
-            address,
-            address_addition,
-            post_code,
-            city
-            FROM subscribers
-            WHERE %s > 0"""
-
-    def __init__(self, file_path):
-        """Init method open a file with ascii encoding, expected by routing
-        service."""
-        AbstractExporter.__init__(self, file_path)
 
     def do_export(self):
         """Export method to build a routage file for regular issue sending"""
@@ -78,30 +284,23 @@ class RoutageExporter(AbstractExporter):
         self.query = self.get_special_issue_query()
         self.export_common()
 
-    def get_regular_issue_query(self):
-        """Generate the sql query to export routage file for special issue"""
-        field = 'issues_to_receive'
-        query = self.QUERY_BASE % field
-        return query
-
-    def get_special_issue_query(self):
-        """Generate the sql query to export routage file for special issue"""
-        field = 'hors_serie1'
-        query = self.QUERY_BASE % field
-        return query
-
     def export_common(self):
-        """Common code to export for routage service"""
-        cursor = self.conn.cursor()
+        """Common code to export for routage service. The partial file is
+        removed if the export fails."""
         try:
-            result = cursor.execute(self.query)
-            for row in result:
-                line = self.generate_output_line(row)
-                self.file_pointer.write('\t'.join(line) + '\n')
+            self.write_body()
         except:
-            print 'ERROR: Exception caught\n\t%s' % sys.exc_info()[1]
-        else:
-            self.close_resources()
+            self.discard()
+            raise
+        self.close_resources()
+
+    def write_body(self):
+        """Write the lines of the subscribers"""
+        self.write_query(self.query, self.format_row)
+
+    def format_row(self, sql_row):
+        """Return the routage line of a row"""
+        return u'\t'.join(self.generate_output_line(sql_row)) + u'\n'
 
     def generate_output_line(self, sql_row):
         """Generate a line as a list from the list sql_row extracted from the
@@ -122,25 +321,286 @@ class RoutageExporter(AbstractExporter):
 
     def format_string(self, string):
         """Remove non ascii chars and set string to uppercase"""
-        new_string = unicodedata.normalize('NFKD', unicode(string))
-        new_string = ''.join([c for c in new_string if not unicodedata.combining(c)])
-        new_string = new_string.encode('ascii', 'ignore')
-        return new_string.upper()
+        return to_routing_ascii(string)
+
+class RoutageExporter(SinkExporterMixin, AbstractRoutageExporter):
+    """This class exports the DB in the format expected by the routing service.
+    Only the subscribers that have issues to receive are exported. It works for
+    regular and special issues. The rows are read from the covering index on
+    the last issue, then written in the order they were created."""
+
+    COLUMNS = ['lastname', 'firstname', 'company', 'name_addition',
+            'address', 'address_addition', 'post_code', 'city']
+    QUERY_BASE = """SELECT
+            lastname,
+            firstname,
+            company,
+            name_addition,
+            address,
+            address_addition,
+            post_code,
+            city
+            FROM subscribers INDEXED BY %s
+            WHERE %s > (SELECT %s FROM issue_counter)
+            ORDER BY id"""
+
+    def __init__(self, file_path, progress=None):
+        """Init method open a file with ascii encoding, expected by routing
+        service."""
+        AbstractExporter.__init__(self, file_path, progress)
+
+    def get_regular_issue_query(self):
+        """Generate the sql query to export routage file for regular issue"""
+        query = self.QUERY_BASE % (
+                'subscribers_issue_address_idx',
+                'last_issue',
+                'regular_issue'
+                )
+        return query
+
+    def get_special_issue_query(self):
+        """Generate the sql query to export routage file for special issue"""
+        query = self.QUERY_BASE % (
+                'subscribers_special_issue_address_idx',
+                'last_special_issue',
+                'special_issue'
+                )
+        return query
+
+    def get_sink(self, special_issue=False):
+        """Return the sink that writes this routage file from the rows of an
+        IssueExporter"""
+        if special_issue:
+            return self.make_sink(has_special_issue, self.format_row)
+        return self.make_sink(has_regular_issue, self.format_row)
+
+class DepartmentSummary(object):
+    """Counts, for each department, the post codes, the copies and the
+    bundles of a routing file read in the order of the post codes. Only the
+    copies of the current post code are counted apart, so the counts are
+    computed while the file is written."""
+
+    SEPARATOR = u';'
+    EOL = u'\r\n'
+
+    def __init__(self, bundle_size=None):
+        if bundle_size is None:
+            bundle_size = gaabo_conf.routage_bundle_size
+        self.bundle_size = bundle_size
+        # [department, post codes, copies, bundles], in the file order
+        self.departments = []
+        self.postcode = None
+        self.postcode_copies = 0
+
+    def add(self, postcode):
+        """Count the copy of the next line of the file"""
+        if not self.postcode_copies or postcode != self.postcode:
+            self.close_postcode()
+            department = department_from_postcode(postcode)
+            if not self.departments or self.departments[-1][0] != department:
+                self.departments.append([department, 0, 0, 0])
+            self.departments[-1][1] += 1
+            self.postcode = postcode
+        self.postcode_copies += 1
+        self.departments[-1][2] += 1
+
+    def close_postcode(self):
+        """Count the bundles of the current post code"""
+        if self.postcode_copies:
+            self.departments[-1][3] += (
+                    (self.postcode_copies + self.bundle_size - 1)
+                    / self.bundle_size)
+        self.postcode_copies = 0
+
+    def get_rows(self):
+        """Return the (department, post codes, copies, bundles) of the
+        departments and the total"""
+        self.close_postcode()
+        rows = [tuple(department) for department in self.departments]
+        total = [sum([row[column] for row in rows]) for column in (1, 2, 3)]
+        rows.append(tuple([u'total'] + total))
+        return rows
+
+    def write(self, file_path):
+        """Write the summary in a CSV file"""
+        summary = io.open(file_path, 'w', encoding='utf-8', newline='')
+        try:
+            summary.write(self.SEPARATOR.join([u'département',
+                u'codes postaux', u'exemplaires', u'liasses']) + self.EOL)
+            for row in self.get_rows():
+                summary.write(self.SEPARATOR.join(
+                    [unicode(value) for value in row]) + self.EOL)
+        finally:
+            summary.close()
+
+class PostCodeRoutageExporter(AbstractRoutageExporter):
+    """Base of the routing exports presorted by post code, for the
+    discounted rate of the routing service. The lines are the ones of
+    RoutageExporter, read from the post code index in the order of the post
+    codes then of the creation. The IssueExporter reads the rows in the
+    order of their creation, so it cannot feed these files: there is no
+    sink for them."""
+
+    # The condition, if any, restricts the post codes read
+    QUERY_BASE = """SELECT
+            lastname,
+            firstname,
+            company,
+            name_addition,
+            address,
+            address_addition,
+            post_code,
+            city
+            FROM subscribers INDEXED BY subscribers_post_code_idx
+            WHERE %s > (SELECT %s FROM issue_counter)%s
+            ORDER BY post_code, id"""
+
+    def get_regular_issue_query(self, condition=''):
+        return self.QUERY_BASE % ('last_issue', 'regular_issue', condition)
+
+    def get_special_issue_query(self, condition=''):
+        return self.QUERY_BASE % (
+                'last_special_issue',
+                'special_issue',
+                condition
+                )
+
+class PresortedRoutageExporter(PostCodeRoutageExporter):
+    """Routing export presorted by post code. The copies and bundles of each
+    department are written in a summary file, by default next to the
+    routing file:
+
+        exporter = PresortedRoutageExporter('routage.txt')
+        exporter.do_export()    # also writes routage_departements.csv
+    """
+
+    SUMMARY_SUFFIX = '_departements.csv'
+
+    def __init__(self, file_path, progress=None, summary_path=None):
+        PostCodeRoutageExporter.__init__(self, file_path, progress)
+        if summary_path is None:
+            summary_path = os.path.splitext(file_path)[0] + self.SUMMARY_SUFFIX
+        self.summary_path = summary_path
+        self.summary = None
+
+    def write_body(self):
+        """Write the lines, then the summary counted meanwhile"""
+        self.summary = DepartmentSummary()
+        self.write_query(self.query, self.format_row)
+        self.summary.write(self.summary_path)
+
+    def format_row(self, sql_row):
+        self.summary.add(sql_row[6])
+        return PostCodeRoutageExporter.format_row(self, sql_row)
+
+class ShardedRoutageExporter(PostCodeRoutageExporter):
+    """Presorted routing export split in one file per zone, see
+    routage_zones. The zone files are written at the same time by a pool of
+    processes, each reading its range of the post code index. For the
+    routing file routage.txt, the zone 75 is written in routage_75.txt and
+    the manifest routage_manifeste.csv lists the files and their number of
+    lines. The zones without subscriber have no file. Concatenated in the
+    order of the manifest, the files are the PresortedRoutageExporter
+    file."""
+
+    MANIFEST_SUFFIX = '_manifeste.csv'
+    SEPARATOR = u';'
+    EOL = u'\r\n'
+
+    def __init__(self, file_path, progress=None, pool_size=None):
+        self.base_path, self.extension = os.path.splitext(file_path)
+        PostCodeRoutageExporter.__init__(
+                self,
+                self.base_path + self.MANIFEST_SUFFIX,
+                progress
+                )
+        if pool_size is None:
+            pool_size = gaabo_conf.export_pool_size
+        self.pool_size = pool_size
+        self.zone_files = []
+
+    def get_regular_issue_query(self):
+        """The zone condition is added by get_zone_query"""
+        return PostCodeRoutageExporter.get_regular_issue_query(self, ' AND %s')
+
+    def get_special_issue_query(self):
+        return PostCodeRoutageExporter.get_special_issue_query(self, ' AND %s')
+
+    def get_zone_path(self, zone):
+        """Return the path of the file of a zone"""
+        return u'%s_%s%s' % (self.base_path, zone, self.extension)
+
+    def get_zone_query(self, lower, upper):
+        """Return the query and the parameters of the lines of a zone"""
+        condition, parameters = zone_condition(lower, upper)
+        return self.query % condition, parameters
+
+    def write_body(self):
+        """Write the zone files, then the manifest"""
+        zones = routage_zones()
+        tasks = []
+        for zone, lower, upper in zones:
+            query, parameters = self.get_zone_query(lower, upper)
+            tasks.append(
+                    (self.db_file, self.get_zone_path(zone), query, parameters))
+        try:
+            pool = multiprocessing.Pool(self.pool_size)
+            try:
+                self.write_manifest(
+                        zones, pool.imap(export_routage_zone, tasks))
+            finally:
+                pool.terminate()
+                pool.join()
+        except:
+            self.discard()
+            raise
+
+    def write_manifest(self, zones, line_counts):
+        """Write the manifest line of each zone file as soon as it is
+        written"""
+        self.write_lines([self.SEPARATOR.join(
+            [u'fichier', u'zone', u'exemplaires']) + self.EOL])
+        total = 0
+        for (zone, lower, upper), line_count in itertools.izip(
+                zones, line_counts):
+            if line_count == 0:
+                continue
+            zone_path = self.get_zone_path(zone)
+            self.zone_files.append(zone_path)
+            self.write_lines([self.SEPARATOR.join([os.path.basename(zone_path),
+                zone, unicode(line_count)]) + self.EOL])
+            total += line_count
+            if self.progress is not None:
+                self.progress.advance(line_count)
+        self.write_lines([self.SEPARATOR.join(
+            [u'total', u'', unicode(total)]) + self.EOL])
+
+    def discard(self):
+        """Remove the manifest and the zone files"""
+        PostCodeRoutageExporter.discard(self)
+        for zone, lower, upper in routage_zones():
+            if os.path.isfile(self.get_zone_path(zone)):
+                os.remove(self.get_zone_path(zone))
 
 
 #####
 
-class ReSubscribeExporter(AbstractExporter):
+class ReSubscribeExporter(SinkExporterMixin, AbstractExporter):
     """This class extact a CSV file for the re-subscribing mailing campaign"""
 
     QUERY = """SELECT firstname, lastname, company,
     name_addition, address, address_addition,
-    post_code, city FROM subscribers WHERE issues_to_receive = 0
-    AND mail_sent = 0"""
-
-    def __init__(self, file_path):
+    post_code, city
+    FROM subscribers INDEXED BY subscribers_resubscribe_idx
+    WHERE last_issue <= (SELECT regular_issue FROM issue_counter)
+    AND mail_sent = 0
+    ORDER BY id"""
+    COLUMNS = ['firstname', 'lastname', 'company', 'name_addition',
+            'address', 'address_addition', 'post_code', 'city']
+
+    def __init__(self, file_path, progress=None):
         """This constructor open a file descriptor to realize the export"""
-        AbstractExporter.__init__(self, file_path)
+        AbstractExporter.__init__(self, file_path, progress)
 
     def do_export(self):
         """Perform the export in the file given as parameter of object
@@ -149,6 +609,15 @@ class ReSubscribeExporter(AbstractExporter):
         self._write_body()
         self.close_resources()
 
+    def get_sink(self):
+        """Return the sink that writes this file from the rows of an
+        IssueExporter"""
+        return self.make_sink(
+                is_resubscribing,
+                self._format_line,
+                self._write_header
+                )
+
     def _write_header(self):
         """Write header line in export file"""
         header = u'Destinataire;Adresse1;Adresse2;Adresse3;' + \
@@ -157,17 +626,10 @@ class ReSubscribeExporter(AbstractExporter):
 
     def _write_body(self):
         """Write the body of the export file"""
-        self.conn = sqlite3.Connection(self.db_file)
-        for row in self._execute_query():
-            self._write_in_file(row)
+        self.write_query(self.QUERY, self._format_line)
 
-    def _execute_query(self):
-        """Execute the query that provides the data to the export file"""
-        cursor = self.conn.cursor()
-        return cursor.execute(self.QUERY)
-
-    def _write_in_file(self, row):
-        """Write a data row in the file"""
+    def _format_line(self, row):
+        """Return the file line of a data row"""
         line = []
         line.append(self._get_recipient(row))
         line.append(self._get_name_addition(row))
@@ -175,7 +637,7 @@ class ReSubscribeExporter(AbstractExporter):
         line.append(self._get_address_addition(row))
         line.append(self._get_post_code(row))
         line.append(self._get_city(row))
-        self.file_pointer.write(';'.join(line) + '\n') 
+        return u';'.join(line) + u'\n'
 
     def _get_recipient(self, row):
         """Extract recipient field from a data row"""
@@ -208,24 +670,15 @@ class ReSubscribeExporter(AbstractExporter):
 
 #####
 
-class CsvExporter(object):
-    """This class allows to export the whole database as a CSV"""
-
-    QUERY = """SELECT firstname, lastname, company, city,
-    issues_to_receive, hors_serie1,
-    subscription_price, membership_price, subscription_date
-    FROM subscribers"""
+class AbstractCsvExporter(AbstractExporter):
+    """Writes the subscribers as CSV lines of the management format, read by
+    get_fields from the columns of CsvExporter"""
 
     SEPARATOR = ';'
     EOL = '\r\n'
 
-    def __init__(self, file_name):
-        self.export_file = codecs.open(file_name, 'w', 'utf-8')
-
-    def do_export(self):
-        self.write_header()
-        self.write_rows()
-        self.close_resources()
+    def __init__(self, file_name, progress=None):
+        AbstractExporter.__init__(self, file_name, progress)
 
     def write_header(self):
         header_list = []
@@ -241,20 +694,16 @@ class CsvExporter(object):
         self.print_list(header_list)
 
     def print_list(self, list_to_print):
-        self.export_file.write(self.SEPARATOR.join(list_to_print))
-        self.export_file.write(self.EOL)
+        self.file_pointer.write(self.format_list(list_to_print))
 
-    def write_rows(self):
-        for row in self.get_rows():
-            self.print_current(row)
+    def format_list(self, list_to_print):
+        return self.SEPARATOR.join(list_to_print) + self.EOL
 
-    def get_rows(self):
-        db_file = os.path.join(gaabo_conf.db_directory, gaabo_conf.db_name)
-        self.conn = sqlite3.Connection(db_file)
-        cursor = self.conn.cursor()
-        return cursor.execute(self.QUERY)
+    def format_current(self, row):
+        return self.format_list(self.get_fields(row))
 
-    def print_current(self, row):
+    def get_fields(self, row):
+        """Return the fields of the file line of a row"""
         printed_row_array = []
         printed_row_array.append(unicode(' '.join([row[0], row[1]])))
         printed_row_array.append(unicode(row[2]))
@@ -265,30 +714,218 @@ class CsvExporter(object):
         printed_row_array.append(unicode(row[7]))
         printed_row_array.append(date_string_from_iso(row[8]))
 
-        self.print_list(printed_row_array)
+        return printed_row_array
 
-    def close_resources(self):
-        self.export_file.close()
-        self.conn.close()
+class CsvExporter(SinkExporterMixin, AbstractCsvExporter):
+    """This class allows to export the whole database as a CSV"""
 
-class EmailExporter(AbstractExporter):
-    QUERY = """SELECT email_address
-    FROM subscribers
-    WHERE email_address != ''
-    AND issues_to_receive = 0"""
+    QUERY = """SELECT firstname, lastname, company, city,
+    MAX(last_issue - regular_issue, 0),
+    MAX(last_special_issue - special_issue, 0),
+    subscription_price, membership_price, subscription_date
+    FROM subscribers, issue_counter"""
+
+    COLUMNS = ['firstname', 'lastname', 'company', 'city',
+            'remaining_issues', 'remaining_special_issues',
+            'subscription_price', 'membership_price', 'subscription_date']
+
+    def do_export(self):
+        self.write_header()
+        self.write_rows()
+        self.close_resources()
+
+    def get_sink(self):
+        """Return the sink that writes this file from the rows of an
+        IssueExporter"""
+        return self.make_sink(accept_all, self.format_current, self.write_header)
 
-    def __init__(self, file_name):
-        AbstractExporter.__init__(self, file_name)
+    def write_rows(self):
+        self.write_query(self.QUERY, self.format_current)
+
+class DeltaCsvExporter(AbstractCsvExporter):
+    """Exports the subscribers changed since the previous delta export, in
+    the CsvExporter format preceded by the id and the kind of change. The
+    deleted subscribers only have their id. The first delta export writes
+    every subscriber. The IssueExporter reads every subscriber, so it cannot
+    feed this file: there is no sink for it.
+
+    The changed subscribers are the ones written since the watermark time,
+    and the ones whose remaining issues changed because an issue was shipped
+    since then. An export takes the changes from the previous watermark
+    included to its own excluded, so a change done during the millisecond
+    of the watermark is in the next export. The watermark is saved once the
+    file is complete, so a failed export is done again by the next one."""
+
+    WATERMARK_QUERY = """SELECT exported_at, regular_issue, special_issue
+    FROM export_watermark"""
+    # The time of this export and the counters, read in the same statement
+    CURRENT_WATERMARK_QUERY = """SELECT
+    strftime('%Y-%m-%d %H:%M:%f', 'now'), regular_issue, special_issue
+    FROM issue_counter"""
+    SAVE_WATERMARK_QUERY = """UPDATE export_watermark
+    SET exported_at = ?, regular_issue = ?, special_issue = ?"""
+    # The remaining issues are computed from the counters of the current
+    # watermark. Without the join on issue_counter, and when the rows are
+    # not sorted from the table (+id), sqlite reads each condition of the OR
+    # from its index.
+    CHANGED_QUERY = """SELECT id, firstname, lastname, company, city,
+    MAX(last_issue - ?, 0),
+    MAX(last_special_issue - ?, 0),
+    subscription_price, membership_price, subscription_date
+    FROM subscribers
+    WHERE %s
+    ORDER BY %s"""
+    DELETED_QUERY = """SELECT id FROM deleted_subscribers
+    WHERE deleted_at >= ? AND deleted_at < ?
+    ORDER BY id"""
+    PURGE_DELETED_QUERY = """DELETE FROM deleted_subscribers
+    WHERE deleted_at < ?"""
+
+    CHANGED = u'modifié'
+    DELETED = u'supprimé'
+    # Number of fields of a CsvExporter line
+    FIELD_COUNT = 8
+
+    def __init__(self, file_name, progress=None):
+        AbstractCsvExporter.__init__(self, file_name, progress)
+        self.changed_count = 0
+        self.deleted_count = 0
 
     def do_export(self):
+        """Write the changes and save the watermark of this export"""
         cursor = self.conn.cursor()
-        result = cursor.execute(self.QUERY)
-        file_content = []
-        for row in result:
-            file_content.append(row[0].lower())
+        previous = cursor.execute(self.WATERMARK_QUERY).fetchone()
+        current = cursor.execute(self.CURRENT_WATERMARK_QUERY).fetchone()
+        self.write_header()
+        query, parameters = self.get_changed_query(previous, current)
+        self.write_query(query, self.format_changed, parameters)
+        if previous[0] is not None:
+            self.write_query(self.DELETED_QUERY, self.format_deleted,
+                    (previous[0], current[0]))
+        self.file_pointer.close()
+        cursor.execute(self.SAVE_WATERMARK_QUERY, current)
+        cursor.execute(self.PURGE_DELETED_QUERY, (current[0],))
+        self.conn.commit()
+        self.close_resources()
+
+    def get_changed_query(self, previous, current):
+        """Return the query and the parameters of the subscribers changed
+        between the previous and the current watermarks"""
+        exported_at, regular_issue, special_issue = previous
+        parameters = [current[1], current[2]]
+        if exported_at is None:
+            parameters.append(current[0])
+            return (self.CHANGED_QUERY % (
+                'updated_at IS NULL OR updated_at < ?', 'id'),
+                tuple(parameters))
+        conditions = ['updated_at >= ? AND updated_at < ?']
+        parameters.extend([exported_at, current[0]])
+        if current[1] != regular_issue:
+            conditions.append('last_issue > ?')
+            parameters.append(regular_issue)
+        if current[2] != special_issue:
+            conditions.append('last_special_issue > ?')
+            parameters.append(special_issue)
+        condition = ' OR '.join(['(%s)' % cond for cond in conditions])
+        return self.CHANGED_QUERY % (condition, '+id'), tuple(parameters)
+
+    def write_header(self):
+        self.file_pointer.write(u'id' + self.SEPARATOR
+                + u'modification' + self.SEPARATOR)
+        AbstractCsvExporter.write_header(self)
+
+    def format_changed(self, row):
+        self.changed_count += 1
+        return self.format_list([unicode(row[0]), self.CHANGED]
+                + self.get_fields(row[1:]))
+
+    def format_deleted(self, row):
+        self.deleted_count += 1
+        return self.format_list([unicode(row[0]), self.DELETED]
+                + [u''] * self.FIELD_COUNT)
+
+class EmailExporter(SinkExporterMixin, AbstractExporter):
+    QUERY = """SELECT email_address
+    FROM subscribers INDEXED BY subscribers_email_export_idx
+    WHERE email_address != ''
+    AND last_issue <= (SELECT regular_issue FROM issue_counter)
+    ORDER BY id"""
+    COLUMNS = ['email_address']
 
-        if file_content != []:
-            self.file_pointer.write('\n'.join(file_content) + '\n')
+    def __init__(self, file_name, progress=None):
+        AbstractExporter.__init__(self, file_name, progress)
 
+    def do_export(self):
+        self.write_query(self.QUERY, self.format_row)
         self.close_resources()
 
+    def format_row(self, row):
+        """Return the line of the email address of a row"""
+        return row[0].lower() + u'\n'
+
+    def get_sink(self):
+        """Return the sink that writes this file from the rows of an
+        IssueExporter"""
+        return self.make_sink(is_resubscribing_by_email, self.format_row)
+
+class IssueExporter(AbstractExporter):
+    """Produces several export files with a single read of the subscribers
+    table. Each row is given to every registered sink, which keeps the rows
+    matching its predicate and formats them with the code of its exporter:
+
+        exporter = IssueExporter()
+        exporter.add_sink(RoutageExporter(routage_path).get_sink())
+        exporter.add_sink(EmailExporter(email_path).get_sink())
+        exporter.do_export()
+
+    The rows are read in the order they were created, like the other
+    exporters. When the task of the given progress is cancelled, the files
+    of the sinks are removed."""
+
+    QUERY = """SELECT subscribers.id AS id,
+    lastname, firstname, company, name_addition,
+    address, address_addition, post_code, city,
+    email_address, mail_sent, last_issue, last_special_issue,
+    MAX(last_issue - regular_issue, 0) AS remaining_issues,
+    MAX(last_special_issue - special_issue, 0) AS remaining_special_issues,
+    subscription_price, membership_price, subscription_date,
+    regular_issue, special_issue
+    FROM subscribers, issue_counter
+    ORDER BY subscribers.id"""
+
+    def __init__(self, progress=None):
+        AbstractExporter.__init__(self, progress=progress)
+        self.sinks = []
+
+    def add_sink(self, sink):
+        """Register a sink that receives the rows of the export"""
+        self.sinks.append(sink)
+
+    def do_export(self):
+        """Read the subscribers once and feed every sink. The sinks are
+        closed even if the export fails."""
+        try:
+            cursor = self.conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute(self.QUERY)
+            column_names = [column[0] for column in cursor.description]
+            for sink in self.sinks:
+                sink.bind(column_names)
+                sink.start()
+            rows = cursor.fetchmany(self.chunk_size)
+            while rows:
+                for row in rows:
+                    for sink in self.sinks:
+                        sink.receive(row)
+                if self.progress is not None:
+                    self.progress.advance(len(rows))
+                rows = cursor.fetchmany(self.chunk_size)
+        except TaskCancelled:
+            for sink in self.sinks:
+                sink.cancel()
+            raise
+        finally:
+            for sink in self.sinks:
+                sink.finish()
+            self.close_resources()
+
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''This module loads the subscribers of the legacy spreadsheet, saved as a
+tab separated file, in the database'''
+
+import io
+import time
+
+from subscriber import Subscriber
+from subscriber import Address
+from subscriber import chunks
+from gaabo_controler import date_from_french
+from gaabo_controler import float_from_french
+
+class LegacyImporter(object):
+    """Imports the legacy tab separated file line by line and saves the
+    subscribers in large transactions, so the memory used does not depend on
+    the file size. Dates and prices are converted like the ones typed in the
+    UI."""
+
+    SEPARATOR = u'\t'
+    DEFAULT_BATCH_SIZE = 10000
+
+    # Legacy column title -> Subscriber attribute
+    TEXT_COLUMNS = {
+            u'paiement': 'ordering_type',
+            u'banque': 'bank',
+            u'nom': 'lastname',
+            u'prenom': 'firstname',
+            u'société': 'company',
+            u'complement nom': 'name_addition',
+            u'commentaire': 'comment',
+            u'mail': 'email_address',
+            }
+    INT_COLUMNS = {
+            u'numéros restants': 'issues_to_receive',
+            u'à partir du numéro': 'subs_beginning_issue',
+            u'reab': 'subscriber_since_issue',
+            u'autocollant envoyé': 'sticker_sent',
+            }
+    PRICE_COLUMNS = {
+            u'règlement': 'subscription_price',
+            u'reglement adhésion': 'membership_price',
+            }
+    ADDRESS_TEXT_COLUMNS = {
+            u'adresse': 'address1',
+            u'complement adresse': 'address2',
+            u'ville': 'city',
+            }
+    DATE_COLUMN = u'date'
+    POST_CODE_COLUMN = u'cp'
+    MEMBER_COLUMN = u'adhésion'
+    SPECIAL_ISSUE_COLUMNS = [u'HS 1', u'hs2', u'hs3']
+    IDENTITY_COLUMNS = [u'nom', u'prenom', u'société']
+    SUBSCRIBER = 0
+    ADDRESS = 1
+
+    def __init__(self, file_path, encoding='utf-8', batch_size=None):
+        self.file_path = file_path
+        self.encoding = encoding
+        if batch_size is None:
+            batch_size = self.DEFAULT_BATCH_SIZE
+        self.batch_size = batch_size
+        self.positions = {}
+        self.fields = []
+        self.imported_count = 0
+        self.elapsed_time = 0.0
+
+    def do_import(self):
+        """Load the whole file and return the number of imported
+        subscribers"""
+        start = time.time()
+        for chunk in chunks(self.read_subscribers(), self.batch_size):
+            Subscriber.save_all(chunk, self.batch_size)
+            self.imported_count += len(chunk)
+        self.elapsed_time = time.time() - start
+        return self.imported_count
+
+    def get_rate(self):
+        """Return the number of imported subscribers per second"""
+        if self.elapsed_time == 0:
+            return 0.0
+        return self.imported_count / self.elapsed_time
+
+    def read_subscribers(self):
+        """Generator of the Subscriber objects read from the file. Lines
+        without name nor company are skipped."""
+        legacy_file = io.open(self.file_path, 'r', encoding=self.encoding)
+        try:
+            self._read_header(legacy_file.readline())
+            identity_positions = self._get_positions(self.IDENTITY_COLUMNS)
+            for line in legacy_file:
+                values = self._split(line)
+                if self._has_value(values, identity_positions):
+                    yield self.build_subscriber(values)
+        finally:
+            legacy_file.close()
+
+    def build_subscriber(self, values):
+        """Convert the list of values of a line to a Subscriber. A value that
+        cannot be converted keeps the default one."""
+        subscriber = Subscriber()
+        address = Address()
+        targets = (subscriber, address)
+        value_count = len(values)
+        for position, target, attribute, converter in self.fields:
+            if position >= value_count or values[position] == u'':
+                continue
+            value = values[position]
+            if converter is int:
+                if not value.isdigit():
+                    continue
+                value = int(value)
+            elif converter is not None:
+                value = converter(value)
+                if value is None:
+                    continue
+            setattr(targets[target], attribute, value)
+        subscriber.address = address
+
+        if self._get_value(values, self.MEMBER_COLUMN).lower() == u'oui':
+            subscriber.member = 1
+        subscriber.hors_serie1 = self._get_special_issue_count(values)
+        return subscriber
+
+    def _get_special_issue_count(self, values):
+        """Each filled special issue column is a special issue ordered"""
+        count = 0
+        for column in self.SPECIAL_ISSUE_COLUMNS:
+            if self._get_value(values, column) != u'':
+                count += 1
+        return count
+
+    def _read_header(self, line):
+        """Store the position of each column title and compute the list of
+        fields to convert"""
+        self.positions = {}
+        for position, title in enumerate(self._split(line)):
+            self.positions[title] = position
+        self.fields = []
+        self._add_fields(self.SUBSCRIBER, self.TEXT_COLUMNS, None)
+        self._add_fields(self.SUBSCRIBER, self.INT_COLUMNS, int)
+        self._add_fields(
+                self.SUBSCRIBER, self.PRICE_COLUMNS, float_from_french)
+        self._add_fields(
+                self.SUBSCRIBER,
+                {self.DATE_COLUMN: 'subscription_date'},
+                date_from_french
+                )
+        self._add_fields(self.ADDRESS, self.ADDRESS_TEXT_COLUMNS, None)
+        self._add_fields(
+                self.ADDRESS, {self.POST_CODE_COLUMN: 'post_code'}, int)
+
+    def _add_fields(self, target, columns, converter):
+        """Add the columns found in the header to the fields to convert"""
+        for column, attribute in columns.items():
+            if column in self.positions:
+                self.fields.append(
+                        (self.positions[column], target, attribute, converter)
+                        )
+
+    def _get_positions(self, columns):
+        """Return the positions of the columns found in the header"""
+        return [self.positions[column] for column in columns
+                if column in self.positions]
+
+    def _get_value(self, values, column):
+        """Return the value of the column, an empty string if it is
+        missing"""
+        position = self.positions.get(column)
+        if position is None or position >= len(values):
+            return u''
+        return values[position]
+
+    def _has_value(self, values, positions):
+        """Check if one of the positions has a value"""
+        for position in positions:
+            if position < len(values) and values[position] != u'':
+                return True
+        return False
+
+    def _split(self, line):
+        """Split a file line in stripped fields"""
+        return [field.strip() for field in
+                line.rstrip(u'\r\n').split(self.SEPARATOR)]
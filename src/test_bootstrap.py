@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''This module tests the database updates done at startup'''
+
+import unittest
+import sqlite3
+
+import gaabo_conf
+import bootstrap
+from subscriber import Subscriber
+from gaabo_exploit_db import SqliteDbOperator
+
+TEST_DB = 'test_bootstrap.db'
+
+# The subscribers table as it was created by the first versions
+LEGACY_SUBSCRIBERS_CREATE = '''
+    CREATE TABLE subscribers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        lastname TEXT,
+        firstname TEXT,
+        company TEXT,
+        name_addition TEXT,
+        address TEXT,
+        address_addition TEXT,
+        post_code INTEGER,
+        city TEXT,
+        email_address TEXT,
+        subscriber_since_issue INTEGER,
+        subscription_date DATE,
+        issues_to_receive INTEGER,
+        subs_beginning_issue INTEGER,
+        member INTEGER,
+        subscription_price REAL,
+        membership_price REAL,
+        hors_serie1 INTEGER,
+        hors_serie2 INTEGER,
+        hors_serie3 INTEGER,
+        sticker_sent INTEGER,
+        comment TEXT,
+        bank TEXT,
+        ordering_type TEXT
+    )'''
+
+class DbUpdaterTest(unittest.TestCase):
+    '''Tests the DbUpdater class on a database without the latest changes'''
+
+    def setUp(self):
+        gaabo_conf.db_name = TEST_DB
+        operator = SqliteDbOperator()
+        operator.remove_db()
+        self.conn = sqlite3.Connection(operator.db_full_path)
+        self.cursor = self.conn.cursor()
+        self.cursor.execute(LEGACY_SUBSCRIBERS_CREATE)
+        self.conn.commit()
+
+    def tearDown(self):
+        self.cursor.close()
+        self.conn.close()
+        SqliteDbOperator().remove_db()
+
+    def get_index_names(self):
+        '''Return the names of the indexes of the subscribers table'''
+        sql = """SELECT name FROM sqlite_master
+        WHERE type = 'index' AND tbl_name = 'subscribers'"""
+        return [row[0] for row in self.cursor.execute(sql)]
+
+    def test_add_search_indexes(self):
+        '''The search indexes are created on an existing database'''
+        self.assertFalse(
+                'subscribers_lastname_key_idx' in self.get_index_names())
+        bootstrap.run()
+        index_names = self.get_index_names()
+        self.assertTrue('subscribers_lastname_key_idx' in index_names)
+        self.assertTrue('subscribers_company_key_idx' in index_names)
+        self.assertTrue('subscribers_email_idx' in index_names)
+        self.assertFalse('subscribers_lastname_idx' in index_names)
+
+    def test_run_twice(self):
+        '''Updating an up to date database changes nothing'''
+        bootstrap.run()
+        bootstrap.run()
+        self.assertEqual(
+                len(SqliteDbOperator.SUBSCRIBERS_INDEXES)
+                + len(SqliteDbOperator.SEARCH_KEY_INDEXES)
+                + len(SqliteDbOperator.PHONETIC_KEY_INDEXES)
+                + len(SqliteDbOperator.CHANGE_TRACKING_INDEXES),
+                len(self.get_index_names())
+                )
+
+    def test_issue_counter_migration(self):
+        '''The remaining issues are kept when moving to the issue counter'''
+        self.cursor.execute("""INSERT INTO subscribers
+        (lastname, issues_to_receive, hors_serie1) VALUES ('toto', 3, 1)""")
+        self.cursor.execute("""INSERT INTO subscribers
+        (lastname, issues_to_receive, hors_serie1) VALUES ('tata', 0, NULL)""")
+        self.conn.commit()
+        bootstrap.run()
+
+        toto = Subscriber.get_subscribers_from_lastname('toto')[0]
+        tata = Subscriber.get_subscribers_from_lastname('tata')[0]
+        self.assertEqual(3, toto.issues_to_receive)
+        self.assertEqual(1, toto.hors_serie1)
+        self.assertEqual(0, tata.issues_to_receive)
+        self.assertEqual(0, tata.hors_serie1)
+
+        Subscriber.decrement_issues_to_receive()
+        toto = Subscriber.get_subscribers_from_lastname('toto')[0]
+        self.assertEqual(2, toto.issues_to_receive)
+
+    def test_subscriber_stats_backfill(self):
+        '''The counters are computed from the existing subscribers and kept
+        up to date afterwards'''
+        self.cursor.execute("""INSERT INTO subscribers
+        (lastname, issues_to_receive, hors_serie1) VALUES ('toto', 3, 1)""")
+        self.cursor.execute("""INSERT INTO subscribers
+        (lastname, issues_to_receive, hors_serie1) VALUES ('tata', 0, NULL)""")
+        self.conn.commit()
+        bootstrap.run()
+        expected = {'total': 2, 'active': 1, 'special_pending': 1,
+                'awaiting_renewal': 1}
+        self.assertEqual(expected, Subscriber.get_counts())
+
+        bootstrap.run()
+        self.assertEqual(expected, Subscriber.get_counts())
+        Subscriber.decrement_special_issues_to_receive()
+        self.assertEqual(0, Subscriber.get_counts()['special_pending'])
+
+    def test_search_keys_backfill(self):
+        '''The keys of the existing subscribers are folded like the ones
+        written by the DAO'''
+        self.cursor.execute(u"""INSERT INTO subscribers (lastname, company)
+        VALUES ('Lefèvre', NULL)""")
+        self.conn.commit()
+        bootstrap.run()
+        result = Subscriber.get_subscribers_from_lastname(u'lefevre')
+        self.assertEqual([u'Lefèvre'], [sub.lastname for sub in result])
+        result = Subscriber.get_subscribers_sounding_like(u'Lefebvre')
+        self.assertEqual([u'Lefèvre'], [sub.lastname for sub in result])
+
+    def test_schema_version(self):
+        '''The database reaches the version of the created databases'''
+        self.assertEqual(0, bootstrap.DbUpdater().get_version())
+        bootstrap.run()
+        self.assertEqual(
+                SqliteDbOperator.SCHEMA_VERSION,
+                bootstrap.DbUpdater().get_version()
+                )
+        self.assertEqual(
+                SqliteDbOperator.SCHEMA_VERSION,
+                bootstrap.DbUpdater.MIGRATIONS[-1][0]
+                )
+
+    def test_current_schema_not_migrated(self):
+        '''No migration runs on an up to date database'''
+        bootstrap.run()
+        updater = FailingDbUpdater()
+        updater.migrate()
+        self.assertEqual(
+                SqliteDbOperator.SCHEMA_VERSION, updater.get_version())
+
+    def test_partial_migration(self):
+        '''Only the migrations after the version of the database run'''
+        bootstrap.run()
+        self.cursor.execute("PRAGMA user_version = 3")
+        self.cursor.execute("DROP TRIGGER subscriber_stats_insert")
+        self.conn.commit()
+        bootstrap.run()
+        self.cursor.execute("""INSERT INTO subscribers (lastname)
+        VALUES ('toto')""")
+        self.conn.commit()
+        self.assertEqual(1, Subscriber.get_count())
+
+class FailingDbUpdater(bootstrap.DbUpdater):
+    '''DbUpdater whose migrations fail'''
+
+    def __init__(self):
+        bootstrap.DbUpdater.__init__(self)
+        for version, method_name in self.MIGRATIONS:
+            setattr(self, method_name, self.fail)
+
+    def fail(self):
+        raise AssertionError('migration run on an up to date database')
+
+class CreatedDbTest(unittest.TestCase):
+    '''Tests the migrations on a database created by SqliteDbOperator'''
+
+    def setUp(self):
+        gaabo_conf.db_name = TEST_DB
+        SqliteDbOperator().create_db()
+
+    def tearDown(self):
+        SqliteDbOperator().remove_db()
+
+    def test_created_db_up_to_date(self):
+        updater = FailingDbUpdater()
+        self.assertEqual(SqliteDbOperator.SCHEMA_VERSION, updater.get_version())
+        updater.migrate()
+
+if __name__ == '__main__':
+    unittest.main()
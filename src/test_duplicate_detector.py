@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""This module tests the detection of the duplicate subscribers"""
+
+import unittest
+import os
+import io
+import sqlite3
+
+import gaabo_conf
+from gaabo_exploit_db import SqliteDbOperator
+from subscriber import Subscriber
+from duplicate_detector import DuplicateDetector, score_pair
+
+TEST_FILE = 'duplicates_test.csv'
+
+class DuplicateDetectorTest(unittest.TestCase):
+    """Tests the DuplicateDetector class"""
+
+    def setUp(self):
+        gaabo_conf.db_name = 'test.db'
+        conn = sqlite3.Connection('../databases/test.db')
+        conn.execute('DELETE FROM subscribers')
+        conn.commit()
+        conn.close()
+        self.faullummel = self.save_subscriber(u'Faullummel', u'Hélène',
+                u'12 rue Victor Hugo', 42000, u'Saint-Étienne',
+                u'helene@example.com')
+        self.folummel = self.save_subscriber(u'Folummel', u'Helene',
+                u'12 r Victor Hugo', 42000, u'St Etienne', None)
+        self.martin = self.save_subscriber(u'Martin', u'Jean',
+                u'3 place Bellecour', 69002, u'Lyon', u'jean@example.com')
+        self.moved = self.save_subscriber(u'Martin', u'Jean',
+                u'8 rue de la Paix', 75002, u'Paris', u'JEAN@example.com')
+        self.neighbour = self.save_subscriber(u'Martinez', u'Paul',
+                u'5 place Bellecour', 69002, u'Lyon')
+        self.spouse = self.save_subscriber(u'Martin', u'Marie',
+                u'3 place Bellecour', 69002, u'Lyon')
+        self.detector = DuplicateDetector(pool_size=2)
+
+    def tearDown(self):
+        if os.path.isfile(TEST_FILE):
+            os.remove(TEST_FILE)
+
+    def save_subscriber(self, lastname, firstname, address, post_code, city,
+            email=u''):
+        sub = Subscriber()
+        sub.lastname = lastname
+        sub.firstname = firstname
+        sub.address.address1 = address
+        sub.address.post_code = post_code
+        sub.address.city = city
+        sub.email_address = email
+        sub.save()
+        return sub.identifier
+
+    def get_pairs(self, duplicates):
+        return [(first[0], second[0]) for score, first, second in duplicates]
+
+    def test_find_duplicates(self):
+        """The misspelled name and the shared email are found, the
+        neighbour and the spouse are not"""
+        duplicates = self.detector.find_duplicates()
+        self.assertEqual(
+                sorted([(self.faullummel, self.folummel),
+                    (self.martin, self.moved)]),
+                sorted([tuple(sorted(pair))
+                    for pair in self.get_pairs(duplicates)])
+                )
+        scores = [duplicate[0] for duplicate in duplicates]
+        self.assertEqual(sorted(scores, reverse=True), scores)
+
+    def test_large_bucket_skipped(self):
+        detector = DuplicateDetector(pool_size=1, max_bucket_size=1)
+        self.assertEqual([], detector.find_duplicates())
+        self.assertTrue(detector.skipped_buckets > 0)
+
+    def test_score(self):
+        same = (1, u'Dupont', u'Jean', u'', u'1 rue', 1000, u'Bourg', u'', u'')
+        self.assertAlmostEqual(1.0, score_pair(same, same))
+        other = (2, u'Durand', u'Marc', u'', u'9 avenue', 1000, u'Bourg',
+                u'', u'')
+        self.assertTrue(score_pair(same, other) < 0.8)
+
+    def test_score_missing_email(self):
+        """A missing email is not the same as an email"""
+        first = (1, u'Dupont', u'Jean', u'', u'1 rue', 1000, u'Bourg',
+                u'jean@example.com', u'')
+        second = (2, u'Dupont', u'Jean', u'', u'1 rue', 1000, u'Bourg',
+                None, u'')
+        self.assertAlmostEqual(1.0, score_pair(first, second))
+        self.assertAlmostEqual(1.0, score_pair(second, first))
+
+    def test_report(self):
+        duplicates = self.detector.find_duplicates()
+        self.detector.write_report(TEST_FILE, duplicates)
+        report = io.open(TEST_FILE, encoding='utf-8', newline='')
+        lines = report.readlines()
+        report.close()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[0].startswith(u'score;id 1;'))
+        self.assertTrue(u'Hélène Faullummel' in u''.join(lines))
+
+if __name__ == '__main__':
+    gaabo_conf.db_name = 'test.db'
+    exploiter = SqliteDbOperator()
+    exploiter.create_db()
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+'''This module tests the LruCache class'''
+
+import unittest
+
+from gaabo_cache import LruCache
+
+class LruCacheTest(unittest.TestCase):
+    '''Tests the LruCache class'''
+
+    def setUp(self):
+        self.cache = LruCache(2)
+
+    def test_get_and_counters(self):
+        self.cache.put(1, 'one')
+        self.assertEqual('one', self.cache.get(1))
+        self.assertEqual(None, self.cache.get(2))
+        self.assertEqual(1, self.cache.hits)
+        self.assertEqual(1, self.cache.misses)
+
+    def test_least_recently_used_removed(self):
+        '''The entry that was not read for the longest time is removed'''
+        self.cache.put(1, 'one')
+        self.cache.put(2, 'two')
+        self.cache.get(1)
+        self.cache.put(3, 'three')
+        self.assertTrue(1 in self.cache)
+        self.assertFalse(2 in self.cache)
+        self.assertEqual(2, len(self.cache))
+
+    def test_remove_if(self):
+        '''Only the matching entries are removed'''
+        self.cache.put(1, 'one')
+        self.cache.put(2, 'two')
+        self.assertEqual(1, self.cache.remove_if(lambda value: value == 'two'))
+        self.assertTrue(1 in self.cache)
+        self.assertFalse(2 in self.cache)
+
+    def test_no_size(self):
+        '''A cache of size 0 keeps nothing'''
+        cache = LruCache(0)
+        cache.put(1, 'one')
+        self.assertEqual(0, len(cache))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,8 +5,11 @@
 __author__ = 'romain.touze@gmail.com'
 
 import unittest
+import os
 from datetime import date
 
+import gaabo_controler
+from gaabo_tasks import TaskProgress
 from gaabo_controler import SubscriberAdapter
 import gaabo_conf
 from subscriber import Subscriber
@@ -390,6 +393,199 @@ class SubscriberRetrievalTest(SubscriberAdapterAbstractTest):
         self.assertEquals('Machin.corp', new_sub['company'])
         self.assertEquals(sub.identifier, new_sub['subscriber_id'])
 
+class SubscriberRecordAdapterTest(SubscriberAdapterAbstractTest):
+    """The adapter builds the same dict from a record and a Subscriber"""
+
+    def test_record_dict(self):
+        sub = Subscriber()
+        sub.lastname = 'toto'
+        sub.subscription_price = 12.5
+        sub.issues_to_receive = 1
+        sub.save()
+
+        record = Subscriber.get_end_of_subscribtion_records()[0]
+        expected = Subscriber.get_end_of_subscribtion()[0]
+        self.assertEqual(
+                SubscriberAdapter(db_sub=expected).build_dict(),
+                SubscriberAdapter(db_sub=record).build_dict()
+                )
+
+class SubscriberSearchTest(SubscriberAdapterAbstractTest):
+    """Tests the search of the subscribers from the search panel criteria"""
+
+    def setUp(self):
+        SubscriberAdapterAbstractTest.setUp(self)
+        self.sub = Subscriber()
+        self.sub.lastname = 'toto'
+        self.sub.firstname = 'tata'
+        self.sub.company = 'Machin.corp'
+        self.sub.email_address = 'toto@machin.com'
+        self.sub.issues_to_receive = 3
+        self.sub.save()
+
+    def test_search_summaries(self):
+        """The search only returns the fields displayed in the result"""
+        result, cursor = gaabo_controler.get_search_page(
+                {'name': 'to', 'company': '', 'email': ''}
+                )
+        self.assertEqual(
+                [{
+                    'subscriber_id': self.sub.identifier,
+                    'lastname': 'toto',
+                    'firstname': 'tata',
+                    'company': 'Machin.corp'
+                    }],
+                result
+                )
+
+    def test_sounds_like_search(self):
+        """The name is searched by its sound when asked"""
+        parameters = {'name': 'tautau', 'company': '', 'email': ''}
+        self.assertEqual([], gaabo_controler.get_search_page(parameters)[0])
+        parameters['sounds_like'] = True
+        result, cursor = gaabo_controler.get_search_page(parameters)
+        self.assertEqual([self.sub.identifier],
+                [summary['subscriber_id'] for summary in result])
+        self.assertEqual(1, gaabo_controler.get_search_count(parameters))
+
+    def test_full_text_search(self):
+        """The free text replaces the other criteria"""
+        other = Subscriber()
+        other.lastname = 'titi'
+        other.comment = 'cousin de toto'
+        other.save()
+        parameters = {'name': 'zzz', 'company': '', 'email': '',
+                'text': 'toto'}
+        model = gaabo_controler.SearchResultModel(parameters, 1)
+        self.assertEqual(2, model.get_count())
+        self.assertEqual(self.sub.identifier,
+                model.get_row(0)['subscriber_id'])
+        self.assertEqual(other.identifier, model.get_row(1)['subscriber_id'])
+        self.assertEqual(None, model.get_row(2))
+
+    def test_full_text_ids_read_once(self):
+        """The ranked ids are read with the count, the pages only read the
+        summaries"""
+        parameters = {'name': '', 'company': '', 'email': '', 'text': 'toto'}
+        model = gaabo_controler.SearchResultModel(parameters, 1)
+        model.prefetch()
+        ranked_ids = model.ranked_ids
+        self.assertEqual([self.sub.identifier], ranked_ids)
+        model.get_row(0)
+        self.assertTrue(ranked_ids is model.ranked_ids)
+
+    def test_get_subscriber_values(self):
+        """The whole subscriber is retrieved for the edition"""
+        values = gaabo_controler.get_subscriber_values(self.sub.identifier)
+        self.assertEqual('toto@machin.com', values['email_address'])
+        self.assertEqual('3', values['issues_to_receive'])
+        self.assertEqual(self.sub.identifier, values['subscriber_id'])
+
+class SearchResultModelTest(SubscriberAdapterAbstractTest):
+    """Tests the paginated search result, without display"""
+
+    PARAMETERS = {'name': 'page', 'company': '', 'email': ''}
+
+    def setUp(self):
+        SubscriberAdapterAbstractTest.setUp(self)
+        subscribers = []
+        for i in range(25):
+            sub = Subscriber()
+            sub.lastname = 'Page%02d' % i
+            subscribers.append(sub)
+        sub = Subscriber()
+        sub.lastname = 'Other'
+        subscribers.append(sub)
+        Subscriber.save_all(subscribers)
+        self.model = gaabo_controler.SearchResultModel(self.PARAMETERS, 10)
+
+    def test_count(self):
+        self.assertEqual(25, self.model.get_count())
+
+    def test_rows_loaded_on_demand(self):
+        """Only the page of the asked row is read"""
+        self.assertEqual('Page00', self.model.get_row(0)['lastname'])
+        self.assertEqual(1, self.model.loaded_pages)
+        self.assertEqual('Page09', self.model.get_row(9)['lastname'])
+        self.assertEqual(1, self.model.loaded_pages)
+        self.assertEqual('Page10', self.model.get_row(10)['lastname'])
+        self.assertEqual(2, self.model.loaded_pages)
+        self.assertEqual(None, self.model.get_row(25))
+        self.assertEqual(2, self.model.loaded_pages)
+
+    def test_far_row(self):
+        """A far row does not read the pages before it"""
+        self.assertEqual('Page24', self.model.get_row(24)['lastname'])
+        self.assertEqual(1, self.model.loaded_pages)
+        self.assertEqual('Page15', self.model.get_row(15)['lastname'])
+        self.assertEqual(2, self.model.loaded_pages)
+
+    def test_bounded_pages(self):
+        """Only the last pages read are kept"""
+        model = gaabo_controler.SearchResultModel(self.PARAMETERS, 5, 2)
+        lastnames = [model.get_row(index)['lastname'] for index in range(25)]
+        self.assertEqual(['Page%02d' % i for i in range(25)], lastnames)
+        self.assertEqual(5, model.loaded_pages)
+        self.assertEqual(2, len(model.pages.entries))
+        self.assertEqual('Page00', model.get_row(0)['lastname'])
+        self.assertEqual(6, model.loaded_pages)
+
+    def test_prefetch(self):
+        """The count and the first page are read before the display"""
+        progress = TaskProgress()
+        self.assertTrue(self.model is self.model.prefetch(progress))
+        self.assertEqual(1, self.model.loaded_pages)
+        self.assertEqual(25, progress.total)
+        self.assertEqual(10, progress.done)
+
+    def test_pages_follow_each_other(self):
+        """The cursor gives the next page and is None on the last one"""
+        lastnames = []
+        page, cursor = gaabo_controler.get_search_page(self.PARAMETERS, None, 10)
+        lastnames.extend([summary['lastname'] for summary in page])
+        while cursor is not None:
+            self.assertTrue(isinstance(cursor, str))
+            page, cursor = gaabo_controler.get_search_page(
+                    self.PARAMETERS, cursor, 10)
+            lastnames.extend([summary['lastname'] for summary in page])
+        self.assertEqual(['Page%02d' % i for i in range(25)], lastnames)
+
+class IssueFilesTest(SubscriberAdapterAbstractTest):
+    """Tests the confirmation of the files written for an issue"""
+
+    FILES = ['issue_routage.txt', 'issue_email.txt', 'issue_resubscribe.csv']
+
+    def setUp(self):
+        SubscriberAdapterAbstractTest.setUp(self)
+        for lastname, issues_to_receive in (('Last', 1), ('Ended', 0)):
+            sub = Subscriber()
+            sub.lastname = lastname
+            sub.issues_to_receive = issues_to_receive
+            sub.save()
+
+    def tearDown(self):
+        for file_name in self.FILES:
+            if os.path.isfile(file_name):
+                os.remove(file_name)
+
+    def get_mail_sent(self, lastname):
+        return self.cursor.execute(
+                'SELECT mail_sent FROM subscribers WHERE lastname = ?',
+                (lastname,)).fetchone()[0]
+
+    def test_ship_then_mark(self):
+        """The subscribers of the shipped issue were not in the paper list,
+        so they are not marked and are in the next one"""
+        gaabo_controler.export_issue_files(*self.FILES)
+        self.assertFalse('LAST' in open(self.FILES[2]).read().upper())
+        gaabo_controler.confirm_issue_files(True, True)
+        self.assertEqual(1, self.get_mail_sent('Ended'))
+        self.assertEqual(0, self.get_mail_sent('Last'))
+        gaabo_controler.export_paper_resubscription_file(self.FILES[2])
+        content = open(self.FILES[2]).read().upper()
+        self.assertTrue('LAST' in content)
+        self.assertFalse('ENDED' in content)
+
 class SubscriberDeletionTest(SubscriberAdapterAbstractTest):
     """Test class to check if created subscriber can be deleted with the adapter"""
     def test_create_and_delete_subscriber(self):
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+'''This module tests the decoding of the dates stored in the database'''
+
+import unittest
+import datetime
+import sqlite3
+
+import gaabo_conf
+import gaabo_db
+import gaabo_dates
+from gaabo_dates import decode_date
+from gaabo_dates import date_from_iso
+from gaabo_dates import french_date_from_iso
+from gaabo_exploit_db import SqliteDbOperator
+
+class DecodeDateTest(unittest.TestCase):
+    '''Tests the cached decoder'''
+
+    def test_iso_date(self):
+        self.assertEqual(datetime.date(2011, 7, 12), decode_date('2011-07-12'))
+
+    def test_cached(self):
+        '''The same date object is returned for the same value'''
+        self.assertTrue(decode_date('2011-07-13') is decode_date('2011-07-13'))
+
+    def test_bounded_cache(self):
+        '''The cache never keeps more than CACHE_SIZE dates'''
+        day = datetime.date(1900, 1, 1)
+        for i in range(gaabo_dates.CACHE_SIZE + 10):
+            decode_date((day + datetime.timedelta(i)).isoformat())
+        self.assertTrue(len(gaabo_dates._cache) <= gaabo_dates.CACHE_SIZE)
+
+    def test_wrong_dates_kept(self):
+        '''Values that are not formattable dates are kept as strings'''
+        for value in ['0211-07-12', '2011-02-29', 'garbage', '2011-7-12']:
+            self.assertEqual(value, decode_date(value))
+
+class DateFunctionsTest(unittest.TestCase):
+    '''Tests the conversions used by the DAO and the exporters'''
+
+    def test_date_from_iso(self):
+        self.assertEqual(
+                datetime.date(2011, 7, 12),
+                date_from_iso(datetime.date(2011, 7, 12))
+                )
+        self.assertEqual(datetime.date(2011, 7, 12), date_from_iso('2011-7-12'))
+        self.assertEqual(gaabo_dates.DEFAULT_DATE, date_from_iso('0211-07-12'))
+        self.assertEqual(gaabo_dates.DEFAULT_DATE, date_from_iso('garbage'))
+        self.assertEqual(gaabo_dates.DEFAULT_DATE, date_from_iso(None))
+
+    def test_french_date_from_iso(self):
+        self.assertEqual('12/07/2011', french_date_from_iso('2011-07-12'))
+        self.assertEqual(
+                '12/07/2011',
+                french_date_from_iso(datetime.date(2011, 7, 12))
+                )
+        self.assertEqual('12/07/0211', french_date_from_iso('0211-07-12'))
+        self.assertEqual(None, french_date_from_iso(None))
+
+class ConverterTest(unittest.TestCase):
+    '''Tests the dates read by the shared connections'''
+
+    def setUp(self):
+        gaabo_conf.db_name = 'test.db'
+        self.conn = sqlite3.Connection('../databases/test.db')
+        self.conn.execute('DELETE FROM subscribers')
+        self.conn.execute("""INSERT INTO subscribers
+            (lastname, subscription_date) VALUES ('date', '2011-07-12')""")
+        self.conn.execute("""INSERT INTO subscribers
+            (lastname, subscription_date) VALUES ('wrong', '0211-07-12')""")
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_decoded_by_sqlite(self):
+        '''The DATE column is decoded by the connections of gaabo_db'''
+        rows = gaabo_db.get_connection().execute(
+                'SELECT subscription_date FROM subscribers ORDER BY id'
+                ).fetchall()
+        self.assertEqual(datetime.date(2011, 7, 12), rows[0][0])
+        self.assertEqual(u'0211-07-12', rows[1][0])
+
+if __name__ == '__main__':
+    gaabo_conf.db_name = 'test.db'
+    exploiter = SqliteDbOperator()
+    exploiter.create_db()
+    unittest.main()
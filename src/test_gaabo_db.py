@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+'''This module tests the connection sharing of gaabo_db'''
+
+import unittest
+import threading
+import sqlite3
+
+import gaabo_conf
+import gaabo_db
+from gaabo_exploit_db import SqliteDbOperator
+
+class ConnectionManagerTest(unittest.TestCase):
+    '''Tests the ConnectionManager class'''
+
+    def setUp(self):
+        gaabo_conf.db_name = 'test.db'
+        self.manager = gaabo_db.ConnectionManager(gaabo_db.get_db_path())
+
+    def tearDown(self):
+        self.manager.close_all()
+
+    def test_same_connection_in_thread(self):
+        '''The connection is reused in the same thread'''
+        conn = self.manager.get_connection()
+        self.assertTrue(conn is self.manager.get_connection())
+
+    def test_other_connection_in_other_thread(self):
+        '''Each thread has its own connection'''
+        main_conn = self.manager.get_connection()
+        thread_conns = []
+        thread = threading.Thread(
+                target=lambda: thread_conns.append(
+                    self.manager.get_connection())
+                )
+        thread.start()
+        thread.join()
+        self.assertFalse(main_conn is thread_conns[0])
+
+    def test_close_all(self):
+        '''A new connection is opened after the manager was closed'''
+        conn = self.manager.get_connection()
+        self.manager.close_all()
+        self.assertFalse(conn is self.manager.get_connection())
+
+class ModuleFunctionsTest(unittest.TestCase):
+    '''Tests the module level helpers'''
+
+    def setUp(self):
+        gaabo_conf.db_name = 'test.db'
+
+    def test_manager_keyed_on_conf(self):
+        '''The manager depends on the database chosen in gaabo_conf'''
+        manager = gaabo_db.get_manager()
+        self.assertTrue(manager is gaabo_db.get_manager())
+        gaabo_conf.db_name = 'other_test.db'
+        self.assertFalse(manager is gaabo_db.get_manager())
+        gaabo_db.close_connections()
+
+    def test_close_connections(self):
+        '''Closing the connections gives a new manager'''
+        conn = gaabo_db.get_connection()
+        gaabo_db.close_connections()
+        self.assertFalse(conn is gaabo_db.get_connection())
+
+    def test_connect_read_only(self):
+        '''The read-only connection reads the database but cannot write it'''
+        self.assert_read_only()
+
+    def test_connect_read_only_without_uri(self):
+        '''The query_only pragma is used when sqlite ignores the URIs'''
+        uri_support = gaabo_db.has_uri_support()
+        gaabo_db._uri_support[:] = [False]
+        try:
+            self.assert_read_only()
+        finally:
+            gaabo_db._uri_support[:] = [uri_support]
+
+    def assert_read_only(self):
+        conn = gaabo_db.connect_read_only(gaabo_db.get_db_path())
+        try:
+            conn.execute('SELECT COUNT(*) FROM subscribers').fetchone()
+            self.assertRaises(
+                    sqlite3.OperationalError,
+                    conn.execute,
+                    'DELETE FROM subscribers'
+                    )
+        finally:
+            conn.close()
+
+if __name__ == '__main__':
+    gaabo_conf.db_name = 'test.db'
+    exploiter = SqliteDbOperator()
+    exploiter.create_db()
+    unittest.main()
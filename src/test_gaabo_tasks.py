@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+'''This module tests the task runner of gaabo_tasks without any window'''
+
+import unittest
+import os
+import threading
+import Queue
+
+import gaabo_conf
+import gaabo_db
+import gaabo_controler
+from gaabo_tasks import TaskRunner, TaskProgress, TaskCancelled
+from gaabo_exploit_db import SqliteDbOperator
+from subscriber import Subscriber
+from subscriber_exporter import RoutageExporter
+
+TEST_FILE = 'task_test.txt'
+TIMEOUT = 10
+
+class QueueDispatcher(object):
+    '''Dispatch function keeping the callbacks until the test runs them, like
+    the event loop of a window does'''
+
+    def __init__(self):
+        self.calls = Queue.Queue()
+
+    def __call__(self, callback, *args):
+        self.calls.put((callback, args))
+
+    def run_pending(self):
+        while not self.calls.empty():
+            callback, args = self.calls.get()
+            callback(*args)
+
+class FailingRoutageExporter(RoutageExporter):
+    '''Routing export failing after a part of the file is written'''
+
+    def write_body(self):
+        self.write_lines([u'partial\n'])
+        raise IOError('disk full')
+
+class TaskRunnerTest(unittest.TestCase):
+    '''Tests the Task and TaskRunner classes'''
+
+    def setUp(self):
+        gaabo_conf.db_name = 'test.db'
+        conn = gaabo_db.get_connection()
+        conn.execute('DELETE FROM subscribers')
+        conn.commit()
+        self.dispatcher = QueueDispatcher()
+        self.runner = TaskRunner(self.dispatcher)
+        self.events = []
+
+    def tearDown(self):
+        if os.path.isfile(TEST_FILE):
+            os.remove(TEST_FILE)
+
+    def run_and_wait(self, operation):
+        task = self.runner.run(
+                operation,
+                on_progress=lambda done, total: self.events.append(
+                    ('progress', done, total)),
+                on_done=lambda result: self.events.append(('done', result)),
+                on_error=lambda error: self.events.append(('error', error)),
+                on_cancelled=lambda: self.events.append(('cancelled', ))
+                )
+        self.assertTrue(task.join(TIMEOUT))
+        self.dispatcher.run_pending()
+        return task
+
+    def test_done(self):
+        '''The progress and the result are given to the dispatcher'''
+        def operation(progress):
+            progress.set_total(4)
+            progress.advance(2)
+            progress.advance(2)
+            return 'result'
+        self.run_and_wait(operation)
+        self.assertEqual([('progress', 0, 4), ('progress', 2, 4),
+            ('progress', 4, 4), ('done', 'result')], self.events)
+
+    def test_callbacks_not_called_before_dispatch(self):
+        '''The callbacks only run when the dispatcher calls them'''
+        task = self.runner.run(lambda progress: 1,
+                on_done=lambda result: self.events.append(result))
+        task.join(TIMEOUT)
+        self.assertEqual([], self.events)
+        self.dispatcher.run_pending()
+        self.assertEqual([1], self.events)
+
+    def test_error(self):
+        '''An exception of the operation is given to on_error'''
+        def operation(progress):
+            raise ValueError('broken')
+        task = self.run_and_wait(operation)
+        self.assertEqual('error', self.events[-1][0])
+        self.assertTrue(isinstance(task.error, ValueError))
+
+    def test_cancel_rolls_back(self):
+        '''The uncommitted changes of a cancelled operation are rolled
+        back'''
+        started = threading.Event()
+        def operation(progress):
+            conn = gaabo_db.get_connection()
+            conn.execute("INSERT INTO subscribers (lastname) VALUES ('toto')")
+            started.set()
+            while True:
+                progress.advance()
+        task = self.runner.run(operation,
+                on_cancelled=lambda: self.events.append('cancelled'))
+        self.assertTrue(started.wait(TIMEOUT))
+        self.runner.cancel()
+        self.assertTrue(task.join(TIMEOUT))
+        self.dispatcher.run_pending()
+        self.assertEqual(['cancelled'], self.events)
+        self.assertEqual([], Subscriber.get_subscribers_from_lastname('toto'))
+
+    def test_worker_connection(self):
+        '''The worker uses its own connection and closes it'''
+        connections = []
+        def operation(progress):
+            connections.append(gaabo_db.get_connection())
+        self.run_and_wait(operation)
+        self.assertFalse(connections[0] is gaabo_db.get_connection())
+        self.assertFalse(
+                connections[0] in gaabo_db.get_manager().connections)
+
+    def test_one_task_at_a_time(self):
+        '''A second task cannot start while the first one runs'''
+        release = threading.Event()
+        task = self.runner.run(lambda progress: release.wait(TIMEOUT))
+        self.assertTrue(self.runner.is_busy())
+        self.assertRaises(ValueError, self.runner.run, lambda progress: None)
+        release.set()
+        task.join(TIMEOUT)
+        self.assertFalse(self.runner.is_busy())
+
+    def test_export_progress(self):
+        '''The routing export reports the rows written over the active
+        subscribers'''
+        for lastname in ('toto', 'tata', 'titi'):
+            sub = Subscriber()
+            sub.lastname = lastname
+            sub.issues_to_receive = 1
+            sub.save()
+        self.run_and_wait(lambda progress: gaabo_controler.\
+                export_regular_issue_routing_file(TEST_FILE, progress))
+        self.assertEqual(('progress', 3, 3), self.events[-2])
+        self.assertEqual('done', self.events[-1][0])
+        self.assertTrue(os.path.isfile(TEST_FILE))
+
+    def test_failed_export(self):
+        '''A failed export calls on_error and removes its file'''
+        self.run_and_wait(lambda progress: FailingRoutageExporter(
+            TEST_FILE, progress).do_export())
+        self.assertEqual('error', self.events[-1][0])
+        self.assertTrue(isinstance(self.events[-1][1], IOError))
+        self.assertFalse(os.path.isfile(TEST_FILE))
+
+class CancelledExportTest(unittest.TestCase):
+    '''Tests the exporters stopped by a cancelled task'''
+
+    def setUp(self):
+        gaabo_conf.db_name = 'test.db'
+        sub = Subscriber()
+        sub.lastname = 'toto'
+        sub.issues_to_receive = 1
+        sub.save()
+
+    def test_partial_file_removed(self):
+        progress = TaskProgress()
+        progress.cancel()
+        exporter = RoutageExporter(TEST_FILE, progress)
+        self.assertRaises(TaskCancelled, exporter.do_export)
+        self.assertFalse(os.path.isfile(TEST_FILE))
+
+    def test_issue_files_removed(self):
+        '''The files of the single read export are all removed'''
+        file_names = [TEST_FILE, 'cancelled_email.txt', 'cancelled.csv']
+        progress = TaskProgress()
+        progress.cancel()
+        self.assertRaises(
+                TaskCancelled,
+                gaabo_controler.export_issue_files,
+                file_names[0],
+                file_names[1],
+                file_names[2],
+                progress
+                )
+        for file_name in file_names:
+            self.assertFalse(os.path.isfile(file_name), file_name)
+
+if __name__ == '__main__':
+    gaabo_conf.db_name = 'test.db'
+    exploiter = SqliteDbOperator()
+    exploiter.create_db()
+    unittest.main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""This module tests the French phonetic key of the names"""
+
+import unittest
+
+from phonetic import french_phonetic_key
+
+class FrenchPhoneticKeyTest(unittest.TestCase):
+    """Tests the french_phonetic_key function"""
+
+    SAME_SOUND = [
+            (u'Faullummel', u'Folummel'),
+            (u'Gicqueau', u'Giqueau'),
+            (u'Lefèvre', u'Lefebvre'),
+            (u'Martin', u'Martain'),
+            (u'Rousseau', u'Rousso'),
+            (u'Dupont', u'Dupond'),
+            (u'Philippe', u'Filipe'),
+            (u'Schmitt', u'Chmit'),
+            (u'Vincent', u'Vinsan'),
+            (u'Müller', u'MULLER'),
+            ]
+    OTHER_SOUND = [
+            (u'Martin', u'Marton'),
+            (u'Dubois', u'Dupuis'),
+            (u'Guérin', u'Gérin'),
+            ]
+
+    def test_same_sound(self):
+        for first, second in self.SAME_SOUND:
+            self.assertEqual(
+                    french_phonetic_key(first),
+                    french_phonetic_key(second),
+                    u'%s / %s' % (first, second)
+                    )
+
+    def test_other_sound(self):
+        for first, second in self.OTHER_SOUND:
+            self.assertNotEqual(
+                    french_phonetic_key(first),
+                    french_phonetic_key(second),
+                    u'%s / %s' % (first, second)
+                    )
+
+    def test_empty_values(self):
+        self.assertEqual(None, french_phonetic_key(None))
+        self.assertEqual('', french_phonetic_key(u''))
+        self.assertEqual('', french_phonetic_key(u'-- '))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+# -*- coding: utf-8 -*-
 '''This module tests the subscriber object'''
 
 import unittest
@@ -6,6 +7,9 @@ import sqlite3
 import datetime
 
 from subscriber import Subscriber
+from subscriber import SubscriberDAO
+from subscriber import SubscriberRecord
+from subscriber import prefix_search_parameters
 from subscriber import is_correct_date
 from subscriber import Address
 import gaabo_conf
@@ -58,6 +62,28 @@ class TestSubscriber(unittest.TestCase):
         self.sub = sub_class.get_subscribers_from_lastname('DUPONT')[0]
         self.assertEqual(self.sub.firstname, 'Toto')
 
+    def test_get_subscribers_from_name_case_insensitive(self):
+        '''Retrieve a subsriber list using the name typed in lowercase'''
+        sql = """INSERT INTO subscribers (lastname, firstname)
+        VALUES ('DUPONT', 'Jean')"""
+        self.cursor.execute(sql)
+        self.conn.commit()
+        self.sub = Subscriber.get_subscribers_from_lastname('dup')[0]
+        self.assertEqual(self.sub.firstname, 'Jean')
+
+    def test_get_subscribers_from_name_wildcard(self):
+        '''A wildcard typed by the user keeps its LIKE meaning'''
+        sql = """INSERT INTO subscribers (lastname, firstname)
+        VALUES ('DUPONT', 'Jean')"""
+        self.cursor.execute(sql)
+        self.conn.commit()
+        self.assertEqual(
+                len(Subscriber.get_subscribers_from_lastname('d%ont')), 1)
+        self.assertEqual(
+                len(Subscriber.get_subscribers_from_lastname('du_ont')), 1)
+        self.assertEqual(
+                len(Subscriber.get_subscribers_from_lastname('d%x')), 0)
+
     def test_get_subscribers_from_company(self):
         '''Retrieve a subsriber list using a company name'''
         sql = """INSERT INTO subscribers (company, name_addition)
@@ -146,6 +172,23 @@ class TestSubscriber(unittest.TestCase):
         sub = Subscriber.get_subscribers_from_lastname('titi')[0]
         self.assertEqual(sub.issues_to_receive, 0)
 
+    def test_decrement_keeps_subscriber_rows(self):
+        """Shipping an issue only moves the issue counter"""
+        self.sub.lastname = 'toto'
+        self.sub.issues_to_receive = 2
+        self.sub.save()
+        sql = 'SELECT last_issue FROM subscribers'
+        last_issue = self.cursor.execute(sql).fetchone()[0]
+        Subscriber.decrement_issues_to_receive()
+        self.assertEqual(last_issue, self.cursor.execute(sql).fetchone()[0])
+
+        sub = Subscriber.get_subscribers_from_lastname('toto')[0]
+        self.assertEqual(1, sub.issues_to_receive)
+        sub.order_new_subscription()
+        sub.save()
+        sub = Subscriber.get_subscribers_from_lastname('toto')[0]
+        self.assertEqual(7, sub.issues_to_receive)
+
     def test_decrement_special_issues_to_receive(self):
         self.sub.lastname = 'toto'
         self.sub.hors_serie1 = 3
@@ -213,6 +256,52 @@ class TestSubscriber(unittest.TestCase):
         ident = self.sub.identifier
         self.assertNotEqual(-1, ident)
 
+    def test_save_all_new_subscribers(self):
+        """Test that bulk saved subscribers get their own id"""
+        subscribers = []
+        for lastname in ['toto', 'tata', 'titi']:
+            sub = Subscriber()
+            sub.lastname = lastname
+            subscribers.append(sub)
+        Subscriber.save_all(subscribers, batch_size=2)
+
+        for sub in subscribers:
+            retrieved = Subscriber.get_subscribers_from_lastname(sub.lastname)
+            self.assertEqual(1, len(retrieved))
+            self.assertEqual(sub.identifier, retrieved[0].identifier)
+
+    def test_save_all_known_subscribers(self):
+        """Test that bulk saving existing subscribers updates them"""
+        self.sub.lastname = 'toto'
+        self.sub.save()
+        self.sub.email_address = 'toto@example.com'
+        new_sub = Subscriber()
+        new_sub.lastname = 'tata'
+        Subscriber.save_all([self.sub, new_sub])
+
+        self.assertEqual(2, Subscriber.get_count())
+        retrieved = Subscriber.get_subscribers_from_lastname('toto')[0]
+        self.assertEqual('toto@example.com', retrieved.email_address)
+
+    def test_save_many_failed_chunk(self):
+        """Test that the chunk with an error is rolled back while the
+        previous ones are kept"""
+        subscribers = []
+        for lastname in ['toto', 'tata', 'titi']:
+            sub = Subscriber()
+            sub.lastname = lastname
+            subscribers.append(sub)
+        subscribers.append(BrokenSubscriber())
+        dao = SubscriberDAO()
+        self.assertRaises(
+                sqlite3.ProgrammingError,
+                dao.save_many,
+                subscribers,
+                2
+                )
+        self.assertEqual(2, Subscriber.get_count())
+        self.assertEqual(0, len(Subscriber.get_subscribers_from_lastname('titi')))
+
     def test_email_based_search(self):
         """Test if we can retrieve a subscriber using its email address."""
         self.sub.firstname = 'email'
@@ -225,6 +314,147 @@ class TestSubscriber(unittest.TestCase):
         self.assertEqual(user.firstname, 'email')
         self.assertEqual(user.lastname, 'user')
 
+    def test_email_based_search_case_insensitive(self):
+        """Test that the email search ignores the case"""
+        self.sub.lastname = 'user'
+        self.sub.email_address = 'Email.User@foobar.com'
+        self.sub.save()
+
+        user = Subscriber.get_subscribers_from_email('email.user@FOOBAR.com')[0]
+        self.assertEqual(user.lastname, 'user')
+
+    def test_summary_searches(self):
+        """The summary searches only return the displayed columns"""
+        self.sub.lastname = 'Summary'
+        self.sub.firstname = 'John'
+        self.sub.company = 'Acme'
+        self.sub.email_address = 'john@acme.com'
+        self.sub.save()
+        expected = [(self.sub.identifier, 'Summary', 'John', 'Acme')]
+
+        self.assertEqual(expected, Subscriber.search_summaries(lastname='sum'))
+        self.assertEqual(expected, Subscriber.search_summaries(company='ACM'))
+        self.assertEqual(
+                expected,
+                Subscriber.search_summaries(email='John@acme.com')
+                )
+
+    def test_multi_criteria_search(self):
+        """A subscriber matching several criteria is returned once and the
+        result is ordered by id"""
+        for lastname, company in [('Dupont', 'Dupuis'), ('Martin', 'Dupont SA'),
+                ('Durand', 'Acme')]:
+            sub = Subscriber()
+            sub.lastname = lastname
+            sub.company = company
+            sub.email_address = lastname.lower() + '@example.com'
+            sub.save()
+
+        result = Subscriber.search_summaries('dup', 'dup', 'durand@example.com')
+        self.assertEqual(
+                ['Dupont', 'Martin', 'Durand'],
+                [summary[1] for summary in result]
+                )
+        self.assertEqual(sorted(result), result)
+        self.assertEqual([], Subscriber.search_summaries())
+
+    def test_get_from_id(self):
+        """The whole subscriber is retrieved from its id"""
+        self.sub.lastname = 'Identified'
+        self.sub.issues_to_receive = 4
+        self.sub.save()
+
+        sub = Subscriber.get_from_id(self.sub.identifier)
+        self.assertEqual('Identified', sub.lastname)
+        self.assertEqual(4, sub.issues_to_receive)
+        self.assertEqual(None, Subscriber.get_from_id(self.sub.identifier + 1))
+
+    def test_accent_insensitive_search(self):
+        """The lastname and company are searched without case nor accents"""
+        self.sub.lastname = u'Lefèvre'
+        self.sub.company = u'École du Louvre'
+        self.sub.save()
+        for lastname in (u'Lefevre', u'lefèv', u'LEFEVRE'):
+            result = Subscriber.get_subscribers_from_lastname(lastname)
+            self.assertEqual([u'Lefèvre'], [sub.lastname for sub in result])
+        for company in (u'Ecole', u'école du l'):
+            result = Subscriber.get_subscribers_from_company(company)
+            self.assertEqual([u'École du Louvre'],
+                    [sub.company for sub in result])
+        self.assertEqual([(self.sub.identifier, u'Lefèvre', self.sub.firstname,
+            u'École du Louvre')], Subscriber.search_summaries(u'lefe'))
+
+    def test_search_key_updated(self):
+        """The keys follow the changes of the lastname"""
+        self.sub.lastname = u'Müller'
+        self.sub.save()
+        sub = Subscriber.get_subscribers_from_lastname(u'muller')[0]
+        sub.lastname = u'Meunier'
+        sub.save()
+        self.assertEqual([], Subscriber.get_subscribers_from_lastname(u'mull'))
+        self.assertEqual(1, len(Subscriber.get_subscribers_from_lastname(u'meu')))
+
+    def test_search_key_fallback(self):
+        """The rows inserted without the DAO get an ASCII folded key"""
+        self.cursor.execute("""INSERT INTO subscribers (lastname, company)
+        VALUES ('Raw', 'Raw Inc')""")
+        self.conn.commit()
+        self.assertEqual(1, len(Subscriber.get_subscribers_from_lastname(u'raw')))
+        self.assertEqual(1, len(Subscriber.get_subscribers_from_company(u'RAW I')))
+
+    def test_sounds_like_search(self):
+        """The lastname is found from a name written differently"""
+        self.sub.lastname = u'Faullummel'
+        self.sub.save()
+        result = Subscriber.get_subscribers_sounding_like(u'Folummel')
+        self.assertEqual([u'Faullummel'], [sub.lastname for sub in result])
+        self.assertEqual([], Subscriber.get_subscribers_from_lastname(u'Folu'))
+        self.assertEqual(1, len(
+            Subscriber.search_summaries(u'folumel', sounds_like=True)))
+        self.assertEqual(1,
+                Subscriber.count_summaries(u'folumel', sounds_like=True))
+        self.assertEqual(0,
+                Subscriber.count_summaries(u'folumel', sounds_like=False))
+
+    def test_search_query_plans(self):
+        """Test that the searches use the indexes instead of a table scan"""
+        prefix_parameters = prefix_search_parameters('dup')
+        self.assert_uses_index(
+                SubscriberDAO.LASTNAME_SEARCH,
+                prefix_parameters,
+                'subscribers_lastname_key_idx'
+                )
+        self.assert_uses_index(
+                SubscriberDAO.COMPANY_SEARCH,
+                prefix_parameters,
+                'subscribers_company_key_idx'
+                )
+        self.assert_uses_index(
+                SubscriberDAO.LASTNAME_SOUND_SEARCH,
+                ('FOLUMEL', ),
+                'subscribers_lastname_phonetic_idx'
+                )
+        self.assert_uses_index(
+                SubscriberDAO.EMAIL_SEARCH,
+                ('toto@example.com', ),
+                'subscribers_email_idx'
+                )
+
+    def test_multi_criteria_query_plan(self):
+        """Each criteria of the multi criteria search uses its index"""
+        sql, parameters = SubscriberDAO().compile_summary_search(
+                'dup', 'acme', 'toto@example.com')
+        for index_name in ['subscribers_lastname_key_idx',
+                'subscribers_company_key_idx', 'subscribers_email_idx']:
+            self.assert_uses_index(sql, parameters, index_name)
+
+    def assert_uses_index(self, sql, parameters, index_name):
+        """Check the query plan of sql"""
+        plan = self.cursor.execute('EXPLAIN QUERY PLAN ' + sql, parameters)
+        details = ' '.join([row[-1] for row in plan])
+        self.assertTrue('SEARCH' in details, details)
+        self.assertTrue(index_name in details, details)
+
     def test_subscription_counter(self):
         """Test subscription counter retrieval"""
         sub = Subscriber()
@@ -239,6 +469,19 @@ class TestSubscriber(unittest.TestCase):
 
         self.assertEqual(3, Subscriber.get_count())
 
+    def test_fetched_subscribers_share_dao(self):
+        """Test that the subscribers of a search reuse the DAO connection"""
+        sub = Subscriber()
+        sub.lastname = 'toto'
+        sub.save()
+        sub = Subscriber()
+        sub.lastname = 'toto'
+        sub.save()
+
+        sub_list = Subscriber.get_subscribers_from_lastname('toto')
+        self.assertTrue(sub_list[0].dao is sub_list[1].dao)
+        self.assertTrue(sub_list[0].dao.conn is sub.dao.conn)
+
     def test_subscriber_address(self):
         sub = Subscriber()
         address = Address()
@@ -300,6 +543,296 @@ class TestSubscriber(unittest.TestCase):
         self.assertEqual(1, toto.mail_sent)
         self.assertEqual(0, tata.mail_sent)
 
+class SubscriberRecordTest(unittest.TestCase):
+    """Tests the read only SubscriberRecord"""
+
+    ATTRIBUTES = ['identifier', 'lastname', 'firstname', 'company',
+            'name_addition', 'email_address', 'subscriber_since_issue',
+            'subscription_date', 'issues_to_receive', 'subs_beginning_issue',
+            'member', 'subscription_price', 'membership_price', 'hors_serie1',
+            'sticker_sent', 'comment', 'ordering_type', 'mail_sent']
+
+    def setUp(self):
+        conn = sqlite3.Connection('../databases/test.db')
+        conn.execute('DELETE FROM subscribers')
+        conn.commit()
+        conn.close()
+        self.sub = Subscriber()
+        self.sub.lastname = u'Record'
+        self.sub.firstname = u'Léa'
+        self.sub.company = u'Acme'
+        self.sub.email_address = u'lea@acme.com'
+        self.sub.issues_to_receive = 1
+        self.sub.hors_serie1 = 2
+        self.sub.subscription_price = 25.5
+        self.sub.subscription_date = datetime.date(2011, 12, 24)
+        self.sub.comment = u'comment'
+        address = Address()
+        address.address1 = u'1 rue du Moulin'
+        address.post_code = 76000
+        address.city = u'Rouen'
+        self.sub.address = address
+        self.sub.save()
+
+    def test_same_values_as_subscriber(self):
+        """The record gives the values of the subscriber"""
+        record = Subscriber.get_end_of_subscribtion_records()[0]
+        expected = Subscriber.get_end_of_subscribtion()[0]
+        for attribute in self.ATTRIBUTES:
+            self.assertEqual(
+                    getattr(expected, attribute),
+                    getattr(record, attribute),
+                    attribute
+                    )
+        self.assertEqual(expected.address.to_tuple(), record.address.to_tuple())
+
+    def test_to_subscriber(self):
+        """The record is converted to a Subscriber that can be saved"""
+        sub = Subscriber.get_end_of_subscribtion_records()[0].to_subscriber()
+        sub.lastname = u'Modified'
+        sub.save()
+        self.assertEqual(
+                self.sub.identifier,
+                Subscriber.get_subscribers_from_lastname('modified')[0].identifier
+                )
+
+    def test_iter_records(self):
+        """All the subscribers are read as records"""
+        other = Subscriber()
+        other.lastname = u'Other'
+        other.save()
+        records = list(Subscriber.iter_records())
+        self.assertEqual([u'Record', u'Other'],
+                [record.lastname for record in records])
+        self.assertTrue(isinstance(records[0], SubscriberRecord))
+
+    def test_compact(self):
+        """Records and addresses have no instance dictionary"""
+        record = Subscriber.get_end_of_subscribtion_records()[0]
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertFalse(hasattr(record.address, '__dict__'))
+        self.assertRaises(AttributeError, setattr, record, 'lastname', 'x')
+
+class IdentityMapTest(unittest.TestCase):
+    """Tests the cache of the subscribers read by id"""
+
+    def setUp(self):
+        conn = sqlite3.Connection('../databases/test.db')
+        conn.execute('DELETE FROM subscribers')
+        conn.commit()
+        conn.close()
+        self.cache = Subscriber.get_cache()
+        self.cache.clear()
+        self.active = self.save_subscriber('active', 2)
+        self.ended = self.save_subscriber('ended', 0)
+
+    def save_subscriber(self, lastname, issues_to_receive):
+        sub = Subscriber()
+        sub.lastname = lastname
+        sub.issues_to_receive = issues_to_receive
+        sub.save()
+        return sub.identifier
+
+    def test_same_object_returned(self):
+        hits = self.cache.hits
+        sub = Subscriber.get_from_id(self.active)
+        self.assertTrue(sub is Subscriber.get_from_id(self.active))
+        self.assertEqual(hits + 1, self.cache.hits)
+
+    def test_update_invalidates(self):
+        sub = Subscriber.get_from_id(self.active)
+        modified = Subscriber.get_subscribers_from_lastname('active')[0]
+        modified.firstname = 'modified'
+        modified.save()
+        self.assertFalse(self.active in self.cache)
+        self.assertEqual('modified', Subscriber.get_from_id(self.active).firstname)
+
+    def test_delete_invalidates(self):
+        Subscriber.get_from_id(self.ended)
+        Subscriber.delete_from_id(self.ended)
+        self.assertEqual(None, Subscriber.get_from_id(self.ended))
+
+    def test_decrement_invalidates_active_only(self):
+        Subscriber.get_from_id(self.active)
+        Subscriber.get_from_id(self.ended)
+        Subscriber.decrement_issues_to_receive()
+        self.assertFalse(self.active in self.cache)
+        self.assertTrue(self.ended in self.cache)
+        self.assertEqual(1, Subscriber.get_from_id(self.active).issues_to_receive)
+
+    def test_update_mail_sent_invalidates_ended_only(self):
+        Subscriber.get_from_id(self.active)
+        Subscriber.get_from_id(self.ended)
+        Subscriber.update_mail_sent()
+        self.assertTrue(self.active in self.cache)
+        self.assertFalse(self.ended in self.cache)
+        self.assertEqual(1, Subscriber.get_from_id(self.ended).mail_sent)
+
+class SubscriberCountsTest(unittest.TestCase):
+    """Tests the counters maintained by the triggers of subscriber_stats"""
+
+    def setUp(self):
+        conn = sqlite3.Connection('../databases/test.db')
+        conn.execute('DELETE FROM subscribers')
+        conn.commit()
+        conn.close()
+        Subscriber.get_cache().clear()
+        self.active = self.save_subscriber('active', 2, 1)
+        self.last = self.save_subscriber('last', 1, 0)
+        self.ended = self.save_subscriber('ended', 0, 0)
+
+    def save_subscriber(self, lastname, issues_to_receive, hors_serie1):
+        sub = Subscriber()
+        sub.lastname = lastname
+        sub.issues_to_receive = issues_to_receive
+        sub.hors_serie1 = hors_serie1
+        sub.save()
+        return sub.identifier
+
+    def recount(self):
+        """Compute the counters from the subscribers table"""
+        conn = sqlite3.Connection('../databases/test.db')
+        row = conn.execute("""SELECT COUNT(*),
+        COUNT(CASE WHEN last_issue > regular_issue THEN 1 END),
+        COUNT(CASE WHEN last_special_issue > special_issue THEN 1 END),
+        COUNT(CASE WHEN last_issue <= regular_issue AND mail_sent = 0
+            THEN 1 END)
+        FROM subscribers, issue_counter""").fetchone()
+        conn.close()
+        return dict(zip(
+            ('total', 'active', 'special_pending', 'awaiting_renewal'), row))
+
+    def test_insert(self):
+        expected = {'total': 3, 'active': 2, 'special_pending': 1,
+                'awaiting_renewal': 1}
+        self.assertEqual(expected, Subscriber.get_counts())
+        self.assertEqual(3, Subscriber.get_count())
+
+    def test_update(self):
+        sub = Subscriber.get_from_id(self.ended)
+        sub.issues_to_receive = 5
+        sub.hors_serie1 = 2
+        sub.save()
+        self.assertEqual(self.recount(), Subscriber.get_counts())
+        self.assertEqual(3, Subscriber.get_counts()['active'])
+
+    def test_delete(self):
+        Subscriber.delete_from_id(self.active)
+        self.assertEqual(self.recount(), Subscriber.get_counts())
+        self.assertEqual(2, Subscriber.get_count())
+
+    def test_issue_shipments(self):
+        Subscriber.decrement_issues_to_receive()
+        self.assertEqual(self.recount(), Subscriber.get_counts())
+        self.assertEqual(1, Subscriber.get_counts()['active'])
+        self.assertEqual(2, Subscriber.get_counts()['awaiting_renewal'])
+        Subscriber.decrement_special_issues_to_receive()
+        self.assertEqual(self.recount(), Subscriber.get_counts())
+        self.assertEqual(0, Subscriber.get_counts()['special_pending'])
+
+    def test_update_mail_sent(self):
+        Subscriber.decrement_issues_to_receive()
+        Subscriber.update_mail_sent()
+        self.assertEqual(self.recount(), Subscriber.get_counts())
+        self.assertEqual(0, Subscriber.get_counts()['awaiting_renewal'])
+
+class FullTextSearchTest(unittest.TestCase):
+    """Tests the free text search in the full text index"""
+
+    def setUp(self):
+        conn = sqlite3.Connection('../databases/test.db')
+        conn.execute('DELETE FROM subscribers')
+        conn.commit()
+        conn.close()
+        Subscriber.get_cache().clear()
+        self.faullummel = self.save_subscriber(u'Faullummel', u'Hélène',
+                u'12 rue Victor Hugo', u'Saint-Étienne', u'')
+        self.dupont = self.save_subscriber(u'Dupont', u'Jean',
+                u'3 place Bellecour', u'Lyon', u'ami de Victor')
+        self.victor = self.save_subscriber(u'Victor', u'Paul',
+                u'1 boulevard de la Paix', u'Paris', u'')
+
+    def save_subscriber(self, lastname, firstname, address, city, comment):
+        sub = Subscriber()
+        sub.lastname = lastname
+        sub.firstname = firstname
+        sub.address.address1 = address
+        sub.address.city = city
+        sub.comment = comment
+        sub.save()
+        return sub.identifier
+
+    def get_ids(self, text):
+        return Subscriber.full_text_ids(text)
+
+    def test_all_words(self):
+        self.assertEqual([self.faullummel], self.get_ids(u'rue victor'))
+        self.assertEqual([self.dupont], self.get_ids(u'bellecour lyon'))
+
+    def test_prefix_and_accents(self):
+        self.assertEqual([self.faullummel], self.get_ids(u'faull helene'))
+        self.assertEqual([self.faullummel], self.get_ids(u'saint-etienne'))
+
+    def test_ranking(self):
+        """A match in the lastname comes before a match in the address or
+        the comment"""
+        self.assertEqual(self.victor, self.get_ids(u'victor')[0])
+        self.assertEqual(3, len(self.get_ids(u'victor')))
+
+    def test_syntax_not_interpreted(self):
+        self.assertEqual([], self.get_ids(u'"'))
+        self.assertEqual([self.victor], self.get_ids(u'(paix*'))
+        self.assertEqual([], self.get_ids(u'paix NOT lyon'))
+
+    def test_update_and_delete(self):
+        sub = Subscriber.get_from_id(self.dupont)
+        sub.address.city = u'Grenoble'
+        sub.save()
+        self.assertEqual([], self.get_ids(u'lyon'))
+        self.assertEqual([self.dupont], self.get_ids(u'grenoble'))
+        Subscriber.delete_from_id(self.dupont)
+        self.assertEqual([], self.get_ids(u'grenoble'))
+
+    def test_summaries(self):
+        """The summaries of a page follow the order of the ids"""
+        ids = self.get_ids(u'victor')
+        self.assertEqual(ids,
+                [row[0] for row in Subscriber.get_summaries(ids)])
+        self.assertEqual([(self.victor, u'Victor', u'Paul', u'')],
+                Subscriber.get_summaries([self.victor]))
+
+    def test_scan_without_index(self):
+        """The columns are scanned when sqlite has no full text index"""
+        dao = NoFullTextIndexDAO()
+        self.assertEqual([self.faullummel], dao.full_text_ids(u'rue victor'))
+        self.assertEqual([self.faullummel, self.dupont, self.victor],
+                dao.full_text_ids(u'victor'))
+
+    def test_scan_escapes_wildcards(self):
+        """The underscore of a word is not a LIKE wildcard"""
+        dao = NoFullTextIndexDAO()
+        self.assertEqual([], dao.full_text_ids(u'faul_ummel'))
+
+    def test_index_errors_raised(self):
+        """An error of the full text index is not hidden by a scan"""
+        dao = BrokenFullTextDAO()
+        self.assertRaises(sqlite3.OperationalError,
+                dao.full_text_ids, u'victor')
+
+class NoFullTextIndexDAO(SubscriberDAO):
+    """DAO of a database without the full text index"""
+    FULL_TEXT_TABLE = 'missing_fts'
+
+class BrokenFullTextDAO(SubscriberDAO):
+    """DAO whose full text query fails"""
+    FULL_TEXT_SEARCH = """SELECT rowid FROM subscribers_fts
+        WHERE missing_column MATCH ?"""
+
+class BrokenSubscriber(Subscriber):
+    """Subscriber that cannot be written in the database"""
+    def get_attribute_sequence(self):
+        return ('only lastname', )
+
 class CorrectDateTest(unittest.TestCase):
     """This class tests if the function correct_date in module subscriber works
     well."""
@@ -7,8 +7,10 @@ import os
 import sqlite3
 import codecs
 import datetime
+import time
 
 import gaabo_conf
+import gaabo_controler
 from subscriber import Subscriber, Address
 import subscriber_exporter
 
@@ -445,6 +447,111 @@ class ResubscribingTest(AbstractExportTest):
         #actual_line = get_second_line()
 
 
+class DeltaCsvExporterTest(AbstractExportTest):
+    """Tests the export of the subscribers changed since the previous one"""
+
+    HEADER = (u'id;modification;nom;société;ville/pays;numeros à recevoir;'
+            u'HS à recevoir;prix abonnement;prix cottisation;'
+            u'date abonnement\r\n')
+
+    def setUp(self):
+        AbstractExportTest.setUp(self)
+        conn = sqlite3.Connection('../databases/test.db')
+        conn.execute('DELETE FROM deleted_subscribers')
+        conn.execute('UPDATE export_watermark SET exported_at = NULL')
+        conn.commit()
+        conn.close()
+        self.toto = self.save_subscriber('toto', 2)
+        self.tata = self.save_subscriber('tata', 0)
+
+    def save_subscriber(self, lastname, issues_to_receive):
+        subscriber = Subscriber()
+        subscriber.lastname = lastname
+        subscriber.issues_to_receive = issues_to_receive
+        subscriber.save()
+        return subscriber
+
+    def export_delta(self):
+        """Run a delta export and return its lines without the header. The
+        changes done before are a millisecond older than the watermark."""
+        time.sleep(0.002)
+        subscriber_exporter.DeltaCsvExporter(TEST_FILE).do_export()
+        content = read_whole_file()
+        self.assertTrue(content.startswith(self.HEADER), content)
+        return [line.split(u';')[0:3]
+                for line in content[len(self.HEADER):].splitlines()]
+
+    def test_first_export_writes_all(self):
+        self.assertEqual(
+                [[unicode(self.toto.identifier), u'modifié', u' toto'],
+                    [unicode(self.tata.identifier), u'modifié', u' tata']],
+                self.export_delta()
+                )
+
+    def test_nothing_changed(self):
+        self.export_delta()
+        self.assertEqual([], self.export_delta())
+
+    def test_changed_subscribers(self):
+        self.export_delta()
+        self.tata.firstname = 'Marie'
+        self.tata.save()
+        titi = self.save_subscriber('titi', 1)
+        self.assertEqual(
+                [[unicode(self.tata.identifier), u'modifié', u'Marie tata'],
+                    [unicode(titi.identifier), u'modifié', u' titi']],
+                self.export_delta()
+                )
+        self.assertEqual([], self.export_delta())
+
+    def test_deleted_subscriber(self):
+        """A deleted subscriber is written once with its id only"""
+        self.export_delta()
+        identifier = self.toto.identifier
+        self.toto.delete()
+        time.sleep(0.002)
+        subscriber_exporter.DeltaCsvExporter(TEST_FILE).do_export()
+        self.assertEqual(
+                u'%d;supprimé;;;;;;;;\r\n' % identifier,
+                read_whole_file()[len(self.HEADER):]
+                )
+        self.assertEqual([], self.export_delta())
+
+    def test_shipped_issue(self):
+        """Shipping an issue changes the remaining issues of the subscribers
+        still receiving them"""
+        self.export_delta()
+        Subscriber.decrement_issues_to_receive()
+        self.assertEqual(
+                [[unicode(self.toto.identifier), u'modifié', u' toto']],
+                self.export_delta()
+                )
+        self.assertEqual([], self.export_delta())
+
+    def test_mail_sent(self):
+        self.export_delta()
+        Subscriber.update_mail_sent()
+        self.assertEqual(
+                [[unicode(self.tata.identifier), u'modifié', u' tata']],
+                self.export_delta()
+                )
+
+    def test_failed_export_keeps_watermark(self):
+        """The changes of a failed export are in the next one"""
+        self.export_delta()
+        self.tata.firstname = 'Marie'
+        self.tata.save()
+        exporter = subscriber_exporter.DeltaCsvExporter(TEST_FILE)
+        def fail(row):
+            raise ValueError(row)
+        exporter.format_changed = fail
+        self.assertRaises(ValueError, exporter.do_export)
+        exporter.close_resources()
+        self.assertEqual(
+                [[unicode(self.tata.identifier), u'modifié', u'Marie tata']],
+                self.export_delta()
+                )
+
 class EmailExporterTest(AbstractExportTest):
     """This class tests the fonctionnality to unload the email list of
     subscribers with ended subscription. The extracted emails are stored in a
@@ -529,6 +636,397 @@ class EmailExporterTest(AbstractExportTest):
         self.exporter.do_export()
         return read_whole_file()
     
+class ChunkedWriteTest(AbstractExportTest):
+    """Tests the exports when the rows are written by several chunks"""
+
+    def setUp(self):
+        AbstractExportTest.setUp(self)
+        self.chunk_size = gaabo_conf.export_chunk_size
+        gaabo_conf.export_chunk_size = 2
+        for i in range(5):
+            subscriber = Subscriber()
+            subscriber.issues_to_receive = 0
+            subscriber.email_address = 'sub%d@example.com' % i
+            subscriber.save()
+        self.expected = ''.join(['sub%d@example.com\n' % i for i in range(5)])
+
+    def tearDown(self):
+        gaabo_conf.export_chunk_size = self.chunk_size
+        AbstractExportTest.tearDown(self)
+
+    def test_every_chunk_written(self):
+        exporter = subscriber_exporter.EmailExporter(TEST_FILE)
+        written_chunks = []
+        write_lines = exporter.write_lines
+        def count_chunks(lines):
+            written_chunks.append(len(lines))
+            write_lines(lines)
+        exporter.write_lines = count_chunks
+        exporter.do_export()
+        self.assertEqual(self.expected, read_whole_file())
+        self.assertEqual([2, 2, 1], written_chunks)
+
+    def test_every_sink_chunk_written(self):
+        issue_exporter = subscriber_exporter.IssueExporter()
+        exporter = subscriber_exporter.EmailExporter(TEST_FILE)
+        issue_exporter.add_sink(exporter.get_sink())
+        issue_exporter.do_export()
+        self.assertEqual(self.expected, read_whole_file())
+
+class PresortedRoutageExportTest(AbstractExportTest):
+    """Tests the routing export sorted by post code and its summary"""
+
+    SUMMARY_FILE = 'export_test_departements.csv'
+    POST_CODES = [75002, 1000, 20090, 75002, 20200, 97400, 75001, 75002, 0]
+
+    def setUp(self):
+        AbstractExportTest.setUp(self)
+        self.bundle_size = gaabo_conf.routage_bundle_size
+        gaabo_conf.routage_bundle_size = 2
+        for i, post_code in enumerate(self.POST_CODES):
+            subscriber = Subscriber()
+            subscriber.lastname = 'sub%d' % i
+            subscriber.address.post_code = post_code
+            subscriber.issues_to_receive = 1
+            subscriber.save()
+        subscriber = Subscriber()
+        subscriber.lastname = 'ended'
+        subscriber.address.post_code = 33000
+        subscriber.issues_to_receive = 0
+        subscriber.save()
+
+    def tearDown(self):
+        gaabo_conf.routage_bundle_size = self.bundle_size
+        if os.path.isfile(self.SUMMARY_FILE):
+            os.remove(self.SUMMARY_FILE)
+        AbstractExportTest.tearDown(self)
+
+    def test_sorted_lines(self):
+        """The lines are the ones of the routing export, sorted by post code
+        then by creation"""
+        subscriber_exporter.RoutageExporter(TEST_FILE).do_export()
+        lines = read_whole_file().splitlines(True)
+        subscriber_exporter.PresortedRoutageExporter(TEST_FILE).do_export()
+        sorted_lines = read_whole_file().splitlines(True)
+        self.assertEqual(sorted(lines), sorted(sorted_lines))
+        self.assertEqual(
+                ['', '01000', '20090', '20200', '75001', '75002', '75002',
+                    '75002', '97400'],
+                [line.split('\t')[8] for line in sorted_lines]
+                )
+        self.assertEqual(
+                [u'SUB1', u'SUB0', u'SUB3', u'SUB7'],
+                [line.split('\t')[2] for line in sorted_lines[1:2] +
+                    sorted_lines[5:8]]
+                )
+
+    def test_summary(self):
+        """Each department has its post codes, copies and bundles"""
+        subscriber_exporter.PresortedRoutageExporter(TEST_FILE).do_export()
+        summary = codecs.open(self.SUMMARY_FILE, 'r', 'utf-8').read()
+        self.assertEqual(
+                u'département;codes postaux;exemplaires;liasses\r\n'
+                u';1;1;1\r\n'
+                u'01;1;1;1\r\n'
+                u'2A;1;1;1\r\n'
+                u'2B;1;1;1\r\n'
+                u'75;2;4;3\r\n'
+                u'974;1;1;1\r\n'
+                u'total;7;9;8\r\n',
+                summary
+                )
+
+class ShardedRoutageExportTest(unittest.TestCase):
+    """Tests the routing export written in one file per zone"""
+
+    POST_CODES = [75002, 1000, 20090, 75002, 20200, 97400, 75001, 999, 0,
+            99100, 123456]
+    FILE = 'export_zones.txt'
+    MANIFEST = 'export_zones_manifeste.csv'
+
+    def setUp(self):
+        reset_test_db()
+        gaabo_conf.db_name = 'test.db'
+        for i, post_code in enumerate(self.POST_CODES):
+            subscriber = Subscriber()
+            subscriber.lastname = 'sub%d' % i
+            subscriber.address.post_code = post_code
+            subscriber.issues_to_receive = 1
+            subscriber.save()
+        conn = sqlite3.Connection('../databases/test.db')
+        conn.execute("""INSERT INTO subscribers (lastname, firstname, company,
+            name_addition, address, address_addition, city, last_issue)
+            VALUES ('nopostcode', '', '', '', '', '', '',
+            (SELECT regular_issue FROM issue_counter) + 1)""")
+        conn.commit()
+        conn.close()
+        self.exporter = subscriber_exporter.ShardedRoutageExporter(
+                self.FILE, pool_size=2)
+
+    def tearDown(self):
+        self.exporter.discard()
+        for file_path in (TEST_FILE, 'export_test_departements.csv'):
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+
+    def read_zone_files(self):
+        content = u''
+        for zone_path in self.exporter.zone_files:
+            content += codecs.open(zone_path, 'r', 'utf-8').read()
+        return content
+
+    def test_same_lines_as_presorted(self):
+        """The zone files, one after the other, are the presorted file"""
+        self.exporter.do_export()
+        subscriber_exporter.PresortedRoutageExporter(TEST_FILE).do_export()
+        self.assertEqual(read_whole_file(), self.read_zone_files())
+        self.assertEqual(12, len(self.read_zone_files().splitlines()))
+
+    def test_special_issue_same_lines_as_presorted(self):
+        self.exporter.do_export_special_issue()
+        subscriber_exporter.PresortedRoutageExporter(
+                TEST_FILE).do_export_special_issue()
+        self.assertEqual(read_whole_file(), self.read_zone_files())
+
+    def test_manifest(self):
+        self.exporter.do_export()
+        manifest = codecs.open(self.MANIFEST, 'r', 'utf-8').read()
+        self.assertEqual(
+                u'fichier;zone;exemplaires\r\n'
+                u'export_zones_00.txt;00;3\r\n'
+                u'export_zones_01.txt;01;1\r\n'
+                u'export_zones_2A.txt;2A;1\r\n'
+                u'export_zones_2B.txt;2B;1\r\n'
+                u'export_zones_75.txt;75;3\r\n'
+                u'export_zones_974.txt;974;1\r\n'
+                u'export_zones_99.txt;99;2\r\n'
+                u'total;;12\r\n',
+                manifest
+                )
+        self.assertFalse(os.path.isfile('export_zones_33.txt'))
+
+    def test_zones_cover_post_codes(self):
+        """Each zone starts where the previous one ends"""
+        zones = subscriber_exporter.routage_zones()
+        self.assertEqual(None, zones[0][1])
+        self.assertEqual(None, zones[-1][2])
+        for previous, zone in zip(zones, zones[1:]):
+            self.assertEqual(previous[2], zone[1])
+
+class DepartmentTest(unittest.TestCase):
+    """Tests the department of the post codes"""
+
+    def test_department(self):
+        department = subscriber_exporter.department_from_postcode
+        self.assertEqual('01', department(1000))
+        self.assertEqual('2A', department(20167))
+        self.assertEqual('2B', department(20600))
+        self.assertEqual('971', department(97110))
+        self.assertEqual('', department(None))
+
+class IssueExporterTest(unittest.TestCase):
+    """Tests that the single pass IssueExporter writes the same files as the
+    exporters run one after another"""
+
+    SINK_FILES = ['issue_routage.txt', 'issue_special.txt', 'issue_list.csv',
+            'issue_email.txt', 'issue_resubscribe.csv']
+    SINGLE_FILES = ['single_routage.txt', 'single_special.txt',
+            'single_list.csv', 'single_email.txt', 'single_resubscribe.csv']
+
+    def setUp(self):
+        reset_test_db()
+        gaabo_conf.db_name = 'test.db'
+        self.save_subscribers()
+
+    def tearDown(self):
+        for file_name in self.SINK_FILES + self.SINGLE_FILES:
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
+    def save_subscribers(self):
+        """Save subscribers matching the different exports"""
+        values = [
+                (u'Doe', u'John', u'', 5, 1, 'john@example.com', 0),
+                (u'Yé', u'Bébé', u'Apave', 0, 0, 'BEBE@example.com', 0),
+                (u'', u'', u'Mairie', 0, 2, '', 0),
+                (u'Martin', u'Paul', u'', 0, 0, 'paul@example.com', 1),
+                (u'Durand', u'Léa', u'', 3, 0, '', 0),
+                (u'Petit', u'Jean', u'', 0, 0, None, 0),
+                ]
+        for lastname, firstname, company, issues, special, email, mail_sent \
+                in values:
+            sub = Subscriber()
+            sub.lastname = lastname
+            sub.firstname = firstname
+            sub.company = company
+            address = Address()
+            address.address1 = u'1 rue du Moulin'
+            address.post_code = 76000
+            address.city = u'Rouen'
+            sub.address = address
+            sub.issues_to_receive = issues
+            sub.hors_serie1 = special
+            sub.email_address = email
+            sub.subscription_date = datetime.date(2011, 7, 12)
+            sub.mail_sent = mail_sent
+            sub.save()
+
+    def get_exporters(self, file_names):
+        """Return the exporters writing in the given files"""
+        return [
+                subscriber_exporter.RoutageExporter(file_names[0]),
+                subscriber_exporter.RoutageExporter(file_names[1]),
+                subscriber_exporter.CsvExporter(file_names[2]),
+                subscriber_exporter.EmailExporter(file_names[3]),
+                subscriber_exporter.ReSubscribeExporter(file_names[4]),
+                ]
+
+    def export_with_sinks(self):
+        exporters = self.get_exporters(self.SINK_FILES)
+        issue_exporter = subscriber_exporter.IssueExporter()
+        issue_exporter.add_sink(exporters[0].get_sink())
+        issue_exporter.add_sink(exporters[1].get_sink(special_issue=True))
+        for exporter in exporters[2:]:
+            issue_exporter.add_sink(exporter.get_sink())
+        issue_exporter.do_export()
+
+    def export_one_by_one(self):
+        exporters = self.get_exporters(self.SINGLE_FILES)
+        exporters[0].do_export()
+        exporters[1].do_export_special_issue()
+        for exporter in exporters[2:]:
+            exporter.do_export()
+
+    def test_same_files(self):
+        """Each sink writes the file of its exporter"""
+        self.export_with_sinks()
+        self.export_one_by_one()
+        for sink_file, single_file in zip(self.SINK_FILES, self.SINGLE_FILES):
+            expected = codecs.open(single_file, 'r', 'utf-8').read()
+            actual = codecs.open(sink_file, 'r', 'utf-8').read()
+            self.assertEqual(expected, actual, sink_file)
+            self.assertNotEqual(u'', actual, sink_file)
+
+    def test_rows_dispatched(self):
+        """The rows are only given to the sinks that accept them"""
+        self.export_with_sinks()
+        routage = codecs.open(self.SINK_FILES[0], 'r', 'utf-8').readlines()
+        special = codecs.open(self.SINK_FILES[1], 'r', 'utf-8').readlines()
+        emails = codecs.open(self.SINK_FILES[3], 'r', 'utf-8').read()
+        self.assertEqual(2, len(routage))
+        self.assertEqual(2, len(special))
+        self.assertEqual(u'bebe@example.com\npaul@example.com\n', emails)
+
+    def test_null_email(self):
+        """An ending subscriber without email is not in the email list"""
+        self.export_with_sinks()
+        emails = codecs.open(self.SINK_FILES[3], 'r', 'utf-8').read()
+        resubscribe = codecs.open(self.SINK_FILES[4], 'r', 'utf-8').read()
+        self.assertFalse(u'None' in emails)
+        self.assertTrue(u'JEAN PETIT' in resubscribe)
+
+    def test_issue_files(self):
+        """The controler writes the files of an issue with one read"""
+        gaabo_controler.export_issue_files(self.SINK_FILES[0],
+                self.SINK_FILES[3], self.SINK_FILES[4])
+        self.export_one_by_one()
+        for index in (0, 3, 4):
+            self.assertEqual(
+                    codecs.open(self.SINGLE_FILES[index], 'r', 'utf-8').read(),
+                    codecs.open(self.SINK_FILES[index], 'r', 'utf-8').read()
+                    )
+
+    def test_sinks_closed_without_connection(self):
+        """The sinks never open their own connection"""
+        exporter = subscriber_exporter.EmailExporter(self.SINK_FILES[3])
+        issue_exporter = subscriber_exporter.IssueExporter()
+        issue_exporter.add_sink(exporter.get_sink())
+        issue_exporter.do_export()
+        self.assertTrue(exporter._conn is None)
+        self.assertTrue(exporter.file_pointer.closed)
+
+class ExportQueryPlanTest(AbstractExportTest):
+    """Checks that the exports only read the active slice of the table from
+    their index"""
+
+    def setUp(self):
+        AbstractExportTest.setUp(self)
+        self.conn = sqlite3.Connection('../databases/test.db')
+        # The exporters need a file to be created
+        self.exporter = subscriber_exporter.RoutageExporter(TEST_FILE)
+
+    def tearDown(self):
+        self.conn.close()
+        self.exporter.close_resources()
+        AbstractExportTest.tearDown(self)
+
+    def get_plan(self, query):
+        """Return the query plan details as a string"""
+        plan = self.conn.execute('EXPLAIN QUERY PLAN ' + query)
+        return ' '.join([row[-1] for row in plan])
+
+    def assert_covering_index(self, query, index_name):
+        details = self.get_plan(query)
+        self.assertTrue(
+                'SEARCH subscribers USING COVERING INDEX ' + index_name
+                in details,
+                details
+                )
+
+    def test_routage_query(self):
+        self.assert_covering_index(
+                self.exporter.get_regular_issue_query(),
+                'subscribers_issue_address_idx'
+                )
+
+    def test_special_issue_routage_query(self):
+        self.assert_covering_index(
+                self.exporter.get_special_issue_query(),
+                'subscribers_special_issue_address_idx'
+                )
+
+    def test_presorted_routage_query(self):
+        """The rows are read in the order of the post code index, without
+        sorting them"""
+        exporter = subscriber_exporter.PresortedRoutageExporter(TEST_FILE)
+        for query in (exporter.get_regular_issue_query(),
+                exporter.get_special_issue_query()):
+            details = self.get_plan(query)
+            self.assertTrue(
+                    'USING INDEX subscribers_post_code_idx' in details,
+                    details
+                    )
+            self.assertFalse('TEMP B-TREE' in details, details)
+        exporter.close_resources()
+
+    def test_zone_query(self):
+        """Each zone reads its range of the post code index"""
+        exporter = subscriber_exporter.ShardedRoutageExporter(
+                'export_zones.txt')
+        exporter.query = exporter.get_regular_issue_query()
+        query, parameters = exporter.get_zone_query(75000, 76000)
+        plan = self.conn.execute('EXPLAIN QUERY PLAN ' + query, parameters)
+        details = ' '.join([row[-1] for row in plan])
+        self.assertTrue(
+                'SEARCH subscribers USING INDEX subscribers_post_code_idx '
+                '(post_code>? AND post_code<?)' in details,
+                details
+                )
+        self.assertFalse('TEMP B-TREE' in details, details)
+        exporter.discard()
+
+    def test_resubscribe_query(self):
+        self.assert_covering_index(
+                subscriber_exporter.ReSubscribeExporter.QUERY,
+                'subscribers_resubscribe_idx'
+                )
+
+    def test_email_query(self):
+        self.assert_covering_index(
+                subscriber_exporter.EmailExporter.QUERY,
+                'subscribers_email_export_idx'
+                )
+
 def reset_test_db():
     conn = sqlite3.Connection('../databases/test.db')
     cursor = conn.cursor()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""This module tests the import of the legacy subscriber file"""
+
+import unittest
+import sqlite3
+import datetime
+
+import gaabo_conf
+from subscriber import Subscriber
+from subscriber_importer import LegacyImporter
+from gaabo_exploit_db import SqliteDbOperator
+
+LEGACY_FILE = 'data/import_subscriber_test.txt'
+
+class LegacyImporterTest(unittest.TestCase):
+    """Tests the LegacyImporter class with the sample legacy file"""
+
+    def setUp(self):
+        gaabo_conf.db_name = 'test.db'
+        conn = sqlite3.Connection('../databases/test.db')
+        conn.execute('DELETE FROM subscribers')
+        conn.commit()
+        conn.close()
+        self.importer = LegacyImporter(LEGACY_FILE, batch_size=5)
+
+    def test_imported_count(self):
+        """Every non empty line is imported"""
+        self.assertEqual(22, self.importer.do_import())
+        self.assertEqual(22, Subscriber.get_count())
+
+    def test_full_line(self):
+        """Checks the conversion of a line with all the fields"""
+        self.importer.do_import()
+        sub = Subscriber.get_subscribers_from_lastname('Feugere')[0]
+        self.assertEqual(u'Emilie', sub.firstname)
+        self.assertEqual(datetime.date(2009, 11, 8), sub.subscription_date)
+        self.assertEqual(0, sub.issues_to_receive)
+        self.assertEqual(21, sub.subs_beginning_issue)
+        self.assertEqual(15, sub.subscriber_since_issue)
+        self.assertEqual(1, sub.member)
+        self.assertEqual(u'ch', sub.ordering_type)
+        self.assertEqual(u'67 rue de la raffiniere', sub.address.address1)
+        self.assertEqual(85350, sub.address.post_code)
+        self.assertEqual(u"Ile d'Yeu", sub.address.city)
+        self.assertEqual(27.0, sub.subscription_price)
+        self.assertEqual(13.0, sub.membership_price)
+        self.assertEqual(u'xavier.gicqueau@club-internet.fr',
+                sub.email_address)
+        self.assertEqual(1, sub.sticker_sent)
+
+    def test_company_line(self):
+        """Checks a subscriber known by its company"""
+        self.importer.do_import()
+        sub = Subscriber.get_subscribers_from_company('Mediatheque J')[0]
+        self.assertEqual(u'Mediatheque Jean Falala', sub.company)
+        self.assertEqual(u'', sub.lastname)
+        self.assertEqual(51095, sub.address.post_code)
+
+    def test_french_price_and_special_issue(self):
+        """Checks decimal comma prices and special issues ordered"""
+        self.importer.do_import()
+        sub = Subscriber.get_subscribers_from_email(
+                'nannouxkinnard@advalvas.be')[0]
+        self.assertEqual(5, sub.issues_to_receive)
+        self.assertEqual(1, sub.hors_serie1)
+        self.assertEqual(41.0, sub.subscription_price)
+        self.assertEqual(15.5, sub.membership_price)
+
+    def test_rate(self):
+        """The import speed is measured"""
+        self.importer.do_import()
+        self.assertTrue(self.importer.get_rate() > 0)
+
+if __name__ == '__main__':
+    gaabo_conf.db_name = 'test.db'
+    exploiter = SqliteDbOperator()
+    exploiter.create_db()
+    unittest.main()
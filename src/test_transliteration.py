@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""This module tests the ASCII folding used by the routage export"""
+
+import unittest
+import random
+import unicodedata
+
+import transliteration
+from transliteration import AsciiFolder
+
+# Code point ranges the random strings are taken from: ASCII, the Latin
+# blocks, Greek, Cyrillic, ligatures and compatibility forms, and the
+# mathematical letters which are outside of the basic plane.
+RANDOM_RANGES = [
+        (0x20, 0x7f),
+        (0xa0, 0x250),
+        (0x300, 0x370),
+        (0x370, 0x530),
+        (0x1e00, 0x1f00),
+        (0x2000, 0x2200),
+        (0xfb00, 0xfb07),
+        (0xff00, 0xff60),
+        (0x1d400, 0x1d500),
+        ]
+
+def reference_format_string(string):
+    """The conversion previously done by RoutageExporter.format_string"""
+    new_string = unicodedata.normalize('NFKD', unicode(string))
+    new_string = ''.join([c for c in new_string if not unicodedata.combining(c)])
+    new_string = new_string.encode('ascii', 'ignore')
+    return new_string.upper()
+
+def random_string(generator, max_length=12):
+    """Return a random unicode string taken from RANDOM_RANGES"""
+    characters = []
+    for i in range(generator.randint(0, max_length)):
+        start, end = generator.choice(RANDOM_RANGES)
+        characters.append(unichr(generator.randrange(start, end)))
+    return u''.join(characters)
+
+class AsciiFolderTest(unittest.TestCase):
+    """Tests the AsciiFolder class"""
+
+    def setUp(self):
+        self.folder = AsciiFolder(cache_size=50)
+
+    def assert_same_as_reference(self, string):
+        expected = reference_format_string(string)
+        actual = self.folder.fold(string)
+        self.assertEqual(expected, actual, repr(string))
+        self.assertEqual(type(expected), type(actual))
+
+    def test_accents(self):
+        self.assertEqual('ILE D\'YEU', self.folder.fold(u"Île d'Yeu"))
+        self.assertEqual('SAINT-ETIENNE', self.folder.fold(u'Saint-Étienne'))
+
+    def test_compatibility_forms(self):
+        """Ligatures and full width letters are decomposed"""
+        for string in [u'ﬁlet', u'Ｒｏｕｅｎ', u'½', u'Straße', u'Œuvre']:
+            self.assert_same_as_reference(string)
+
+    def test_non_unicode_values(self):
+        """Byte strings and numbers are converted like before"""
+        for value in ['Rouen', 76000, 12.5]:
+            self.assert_same_as_reference(value)
+
+    def test_random_strings(self):
+        """Random strings are folded like the reference conversion"""
+        generator = random.Random(20111218)
+        for i in range(5000):
+            self.assert_same_as_reference(random_string(generator))
+
+    def test_every_precomputed_code_point(self):
+        for code_point in range(transliteration.PRECOMPUTED_RANGE):
+            self.assert_same_as_reference(unichr(code_point))
+
+    def test_bounded_cache(self):
+        """The cache never keeps more values than its size"""
+        generator = random.Random(1)
+        for i in range(200):
+            self.folder.fold(random_string(generator))
+        self.assertTrue(len(self.folder.cache) <= 50)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''This module converts the unicode strings to the upper case ASCII expected
+by the routing service'''
+
+import unicodedata
+
+# The Latin blocks cover almost all the names and cities of the database,
+# their translation is computed when the module is loaded.
+PRECOMPUTED_RANGE = 0x250
+
+# Number of whole field values kept by the memo cache
+CACHE_SIZE = 10000
+
+def fold_character(character):
+    """Return the upper case ASCII form of one unicode character, an empty
+    string if it has none. The combining characters removed from the NFKD
+    form are the only ones reordered by the normalization, so folding a
+    string character by character gives the same result as folding it as a
+    whole."""
+    decomposed = unicodedata.normalize('NFKD', character)
+    kept = u''.join([c for c in decomposed if not unicodedata.combining(c)])
+    return kept.encode('ascii', 'ignore').upper().decode('ascii')
+
+class TranslationTable(dict):
+    """Code point -> upper case ASCII string, as expected by
+    unicode.translate. The code points outside of the precomputed range are
+    computed the first time they are met."""
+
+    def __init__(self):
+        dict.__init__(self)
+        for code_point in xrange(PRECOMPUTED_RANGE):
+            self[code_point] = fold_character(unichr(code_point))
+
+    def __missing__(self, code_point):
+        folded = fold_character(unichr(code_point))
+        self[code_point] = folded
+        return folded
+
+class AsciiFolder(object):
+    """Converts strings to upper case ASCII. The whole values are kept in a
+    bounded cache, as the same cities and names come back on many rows. The
+    cache is emptied when it is full, which is cheaper than tracking the
+    least recently used values on each hit."""
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.table = TranslationTable()
+        self.cache = {}
+        self.cache_size = cache_size
+
+    def fold(self, string):
+        """Return the upper case ASCII str of string"""
+        folded = self.cache.get(string)
+        if folded is None:
+            folded = unicode(string).translate(self.table).encode('ascii')
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[string] = folded
+        return folded
+
+# Folder shared by the exporters and the search keys
+_folder = AsciiFolder()
+
+def to_routing_ascii(string):
+    """Return the upper case ASCII str of string, with the accents removed"""
+    return _folder.fold(string)
+
+def to_search_key(value):
+    """Return the key a searched column is indexed with. It is folded like
+    the routing labels, so a search finds what the routing file prints."""
+    if value is None:
+        return None
+    return _folder.fold(value)